@@ -0,0 +1,184 @@
+import logging
+from datetime import datetime
+from typing import Literal
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette import status
+from telethon import TelegramClient
+
+from app.config import settings
+from app.dependencies.auth import verify_api_key
+from app.dependencies.clients import active_client, full_client, leased
+from app.models import APIResponse, UserChannel
+from app.services.channels import DEFAULT_FIELDS, MESSAGE_FIELDS, encode_stream, iter_history, project_message
+from app.services.entities import entity_cache
+from app.services.search import search_channels
+from app.services.sync import sync_channels
+from app.services.updates import update_dispatcher, webhook_sender
+from app.utils import as_utc
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    """
+    Parse the comma separated list of message fields to return.
+    """
+    if not fields:
+        return DEFAULT_FIELDS
+
+    parsed = tuple(field.strip() for field in fields.split(",") if field.strip())
+    unknown = set(parsed) - MESSAGE_FIELDS.keys()
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(MESSAGE_FIELDS)}",
+        )
+    return parsed
+
+
+@router.get("/channels/{user_id}/{telegram_id}/history")
+async def channel_history(
+    user_id: UUID,
+    telegram_id: str,
+    format: Literal["ndjson", "sse"] = "ndjson",
+    min_id: int = Query(0, ge=0, description="Return messages with a greater id"),
+    max_id: int = Query(0, ge=0, description="Return messages with a lower id"),
+    since: datetime | None = Query(None, description="Return messages sent at or after this date"),
+    until: datetime | None = Query(None, description="Return messages sent before this date"),
+    limit: int | None = Query(None, gt=0),
+    fields: str | None = Query(None, description="Comma separated message fields"),
+    client: TelegramClient = Depends(active_client),
+) -> StreamingResponse:
+    """
+    Stream the history of the channel from the newest message to the oldest one.
+    Messages are fetched page by page while the consumer reads them.
+    """
+    projection = parse_fields(fields)
+    logger.info("Streaming history of channel %s for user %s", telegram_id, user_id)
+
+    messages = iter_history(client, user_id, telegram_id, min_id, max_id, as_utc(since), as_utc(until), limit)
+    items = (project_message(message, projection) async for message in messages)
+    return StreamingResponse(
+        leased(user_id, encode_stream(items, MEDIA_TYPES[format])), media_type=MEDIA_TYPES[format],
+    )
+
+
+@router.post("/channels/{user_id}/sync", response_model=APIResponse)
+async def sync_user_channels(
+    user_id: UUID,
+    channels: list[UserChannel],
+    fields: str | None = Query(None, description="Comma separated message fields"),
+    client: TelegramClient = Depends(active_client),
+) -> dict:
+    """
+    Return the messages posted to the active channels since their previous sync.
+    The first sync of a channel returns only its latest messages.
+    """
+    projection = parse_fields(fields)
+    results = await sync_channels(client, user_id, channels, projection)
+
+    new_messages = sum(len(result["messages"]) for result in results.values())
+    logger.info("Synced %s channels for user %s: %s new messages", len(results), user_id, new_messages)
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Channels have been synced.",
+        "data": results,
+    }
+
+
+@router.post("/channels/{user_id}/search", response_model=APIResponse)
+async def search_user_channels(
+    user_id: UUID,
+    channels: list[UserChannel],
+    q: str = Query(..., min_length=1, description="Text to search for"),
+    limit: int = Query(50, gt=0, le=1000),
+    since: datetime | None = Query(None, description="Return messages sent at or after this date"),
+    until: datetime | None = Query(None, description="Return messages sent before this date"),
+    fields: str | None = Query(None, description="Comma separated message fields"),
+    client: TelegramClient = Depends(active_client),
+) -> dict:
+    """
+    Search the user's active channels concurrently and return the matching messages
+    of all channels ordered by date from the newest one.
+    """
+    projection = parse_fields(fields)
+    results, errors = await search_channels(client, user_id, channels, q, limit, as_utc(since), as_utc(until))
+
+    logger.info("Search in %s channels for user %s found %s messages", len(channels), user_id, len(results))
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Search has been finished.",
+        "data": {
+            "messages": [
+                {"telegram_id": telegram_id, **project_message(message, projection)}
+                for telegram_id, message in results
+            ],
+            "errors": errors,
+        },
+    }
+
+
+@router.post("/updates/{user_id}/subscribe", response_model=APIResponse)
+async def subscribe_updates(
+    user_id: UUID,
+    channels: list[UserChannel],
+    client: TelegramClient = Depends(full_client),
+) -> dict:
+    """
+    Push new messages of the user's active channels to the main service as they arrive.
+    Replaces the channels watched before. A passive client is promoted to a full one.
+    """
+    if not settings.UPDATES_PUSH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Real-time push is disabled.")
+
+    unresolved = await update_dispatcher.subscribe(user_id, client, channels)
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "New messages of the channels will be pushed.",
+        "data": {"unresolved": unresolved},
+    }
+
+
+@router.delete("/updates/{user_id}/subscribe", response_model=APIResponse)
+async def unsubscribe_updates(user_id: UUID) -> dict:
+    """
+    Stop pushing new messages of the user's channels.
+    """
+    update_dispatcher.unsubscribe(user_id)
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "New messages of the channels will not be pushed.",
+        "data": {},
+    }
+
+
+@router.get("/updates/stats", response_model=APIResponse)
+async def updates_stats() -> dict:
+    """
+    Return the number of watched users and the webhook delivery counters.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Real-time push statistics.",
+        "data": {"subscribed": update_dispatcher.subscribed, **webhook_sender.stats()},
+    }
+
+
+@router.get("/entities/stats", response_model=APIResponse)
+async def entities_stats() -> dict:
+    """
+    Return the size and hit counters of the shared channel cache.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Entity cache statistics.",
+        "data": entity_cache.stats(),
+    }
@@ -0,0 +1,59 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from starlette import status
+
+from app.config import settings
+from app.dependencies.auth import verify_api_key
+from app.models import APIResponse
+from app.services.profiling import loop_monitor
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/debug/loop/stats", response_model=APIResponse)
+async def loop_stats() -> dict:
+    """
+    Return the lag of the event loop and the stack of its last stall.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Event loop statistics.",
+        "data": loop_monitor.stats(),
+    }
+
+
+@router.post("/debug/profile", response_model=APIResponse)
+async def profile(
+    seconds: float = Query(5.0, gt=0, le=settings.PROFILE_MAX_SECONDS, description="Duration of the profile"),
+    interval: float = Query(0.01, ge=0.001, le=1.0, description="Seconds between samples"),
+    all_threads: bool = Query(False, description="Sample every thread instead of the event loop one"),
+    format: str = Query("json", pattern="^(json|collapsed)$", description="json or collapsed for flame graphs"),
+):
+    """
+    Sample the stacks of the running process for the given number of seconds and return
+    how many samples every stack got, the most frequent first. A stack which shows up
+    in many samples of the event loop thread outside of the selector is blocking the loop.
+    """
+    try:
+        stacks = await loop_monitor.profile(seconds, interval, all_threads)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+    logger.info("Profile of %s seconds took %s samples.", seconds, stacks.total())
+    ranked = stacks.most_common()
+    if format == "collapsed":
+        return PlainTextResponse("".join(f"{stack} {count}\n" for stack, count in ranked))
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Profile has been taken.",
+        "data": {
+            "seconds": seconds,
+            "samples": stacks.total(),
+            "stacks": [{"stack": stack, "count": count} for stack, count in ranked],
+        },
+    }
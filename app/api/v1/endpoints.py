@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from uuid import UUID
 
@@ -5,19 +6,25 @@ from fastapi import APIRouter, Depends
 from starlette import status
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError
-from telethon.sessions import StringSession
 
 from app.config import settings
 from app.dependencies.auth import verify_api_key
 from app.exceptions.exceptions import AuthTelegramException, NotFoundClientException
 from app.models import Connection, AuthRequest, APIResponse
-from app.security.crypto import decrypt_session, encrypt_session
-from app.services.session import send_encrypted_session
+from app.security.crypto import decrypt_session, decrypt_sessions
+from app.services.checkpoint import checkpointer
+from app.services.export import export_jobs
+from app.services.health import health_monitor
+from app.services.scheduler import Priority, scheduler
+from app.services.updates import update_dispatcher
+from app.services.verification import verified_sessions
 from app.storage import storage
-from app.utils import send_welcome_message, get_user_info
+from app.utils import SingleFlight, create_client, send_welcome_message, get_user_info
 
 logger = logging.getLogger(__name__)
 
+# Concurrent /connect and /authorize_client calls for the same user share one operation
+flights = SingleFlight()
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
@@ -26,42 +33,58 @@ async def connect(connection: Connection) -> dict:
     """
     Connect to Telegram using the provided session data and user information.
     If the user is not authorized, send a code request to their phone.
+    Concurrent calls for the same user share the result of the first one.
     """
+    return await flights.run(("connect", connection.user.id), lambda: _connect(connection))
+
+
+async def _connect(
+    connection: Connection,
+    priority: Priority = Priority.INTERACTIVE,
+    session_data: str | None = None,
+) -> dict:
     user = connection.user
 
-    # Decrypt the session data
-    session_data = decrypt_session(connection.session_data)
+    # Decrypt the session data unless the caller has done it already
+    if session_data is None:
+        session_data = decrypt_session(connection.session_data)
 
-    client = TelegramClient(
-        StringSession(session_data),
-        settings.TG_API_ID,
-        settings.TG_API_HASH,
-    )
+    passive = connection.mode == "passive"
+    client = create_client(session_data, passive=passive)
+    checkpointer.mark_clean(user.id, session_data)
 
-    storage.add_unauthorized_client(user.id, client)
+    storage.add_unauthorized_client(user.id, client, passive=passive)
     logger.info("Connecting to Telegram for user %s with phone %s", user.id, user.phone)
     await client.connect()
 
     # Check if the client is already authorized
-    if not await client.is_user_authorized():
+    if not await scheduler.call(client, client.is_user_authorized, priority=priority):
+        verified_sessions.discard(user.id)
         logger.info(
             "User %s is not authorized. Sending code request to phone %s", user.id, user.phone
         )
-        await client.send_code_request(user.phone)
+        await scheduler.call(client, client.send_code_request, user.phone, priority=priority)
 
         raise AuthTelegramException("User is not authorized. Code sent to phone.")
 
-    # Check the 2FA status by sending a welcome message
-    await check_2fa_status(client, user.id)
-    # TODO: Check if the user has provided a 2FA password
+    # Skip the checks below if this session has been verified recently
+    fingerprint = verified_sessions.fingerprint(client.session.save())
+    if verified_sessions.get(user.id, fingerprint) is not None:
+        logger.info("Session of user %s has been verified recently. Skipping the checks.", user.id)
+    else:
+        # Check the 2FA status by sending a welcome message
+        await check_2fa_status(client, user.id, priority=priority)
+        # TODO: Check if the user has provided a 2FA password
 
-    # Check getting user information
-    await get_user_info(client, user.id, raise_exc=True)
-    logger.info("User: %s is authorized and connected with telegram.", user.id)
+        # Check getting user information
+        me = await get_user_info(client, user.id, raise_exc=True, priority=priority)
+        verified_sessions.add(user.id, fingerprint, me)
+        logger.info("User: %s is authorized and connected with telegram.", user.id)
 
     # Move the client to the authorized clients storage
     await move_client_to_active(user.id)
     logger.info("User %s is authorized and connected.", user.id)
+    export_jobs.resume(user.id, client)
 
     # Return a successful response
     return {
@@ -71,11 +94,61 @@ async def connect(connection: Connection) -> dict:
     }
 
 
+@router.post("/connect/batch", response_model=APIResponse)
+async def connect_batch(connections: list[Connection]) -> dict:
+    """
+    Connect many users to Telegram concurrently, e.g. to restore sessions after a restart.
+    A failure for one user does not fail the whole batch: every user gets its own result,
+    which is one of "active", "code_sent", "2fa_required" or "failed".
+    Telegram requests of the batch have a lower priority than the interactive ones.
+    """
+    semaphore = asyncio.Semaphore(settings.CONNECT_BATCH_CONCURRENCY)
+    sessions = await decrypt_sessions(
+        [connection.session_data for connection in connections], return_exceptions=True,
+    )
+
+    async def restore(connection: Connection, session_data: str | Exception) -> dict:
+        if isinstance(session_data, Exception):
+            logger.error("Failed to decrypt the session of user %s: %s", connection.user.id, str(session_data))
+            return {"status": "failed", "error": str(session_data)}
+        async with semaphore:
+            try:
+                await flights.run(
+                    ("connect", connection.user.id),
+                    lambda: _connect(connection, priority=Priority.BACKGROUND, session_data=session_data),
+                )
+            except AuthTelegramException as e:
+                return {"status": "code_sent", "error": str(e.detail)}
+            except SessionPasswordNeededError:
+                return {"status": "2fa_required", "error": "Two-Factor Authentication Required"}
+            except Exception as e:
+                logger.error("Failed to restore connection for user %s: %s", connection.user.id, str(e))
+                return {"status": "failed", "error": str(e)}
+            return {"status": "active", "error": None}
+
+    results = await asyncio.gather(*(restore(*item) for item in zip(connections, sessions)))
+    data = {
+        str(connection.user.id): result for connection, result in zip(connections, results)
+    }
+
+    logger.info("Batch connect finished for %s users.", len(connections))
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Batch connect finished.",
+        "data": data,
+    }
+
+
 @router.post("/authorize_client", response_model=APIResponse)
 async def authorize_client(auth: AuthRequest) -> dict:
     """
     Authorize a client using the code sent to the user's phone and the 2FA password if required.
+    Concurrent calls for the same user share the result of the first one.
     """
+    return await flights.run(("authorize", auth.user_id), lambda: _authorize_client(auth))
+
+
+async def _authorize_client(auth: AuthRequest) -> dict:
     try:
         client = storage.get_unauthorized_client(auth.user_id)
     except KeyError as e:
@@ -86,7 +159,9 @@ async def authorize_client(auth: AuthRequest) -> dict:
 
     try:
         logger.info("Authorizing user %s with phone %s", auth.user_id, auth.phone)
-        await client.sign_in(
+        await scheduler.call(
+            client,
+            client.sign_in,
             phone=auth.phone,
             code=auth.code,  # Code received from the user phone
             **tfa_password,
@@ -100,12 +175,13 @@ async def authorize_client(auth: AuthRequest) -> dict:
         )
 
     # Check getting user information
-    await get_user_info(client, auth.user_id, raise_exc=True)
+    me = await get_user_info(client, auth.user_id, raise_exc=True)
     logger.info("User: %s is authorized and connected with telegram.", auth.user_id)
 
     # Check the 2FA status by sending a welcome message
     await check_2fa_status(client, auth.user_id)
     logger.info("Welcome message sent to user %s with phone %s", auth.user_id, auth.phone)
+    verified_sessions.add(auth.user_id, verified_sessions.fingerprint(client.session.save()), me)
 
     # Move the client to the authorized clients storage
     await move_client_to_active(auth.user_id)
@@ -123,18 +199,28 @@ async def authorize_client(auth: AuthRequest) -> dict:
 async def disconnect(user_id: UUID) -> dict:
     """
     Disconnect the client associated with the given user_id.
+    A suspended client has no connection left and its session has been checkpointed already.
     """
+    if storage.is_suspended(user_id):
+        storage.remove_active_client(user_id)
+        logger.info("Suspended client of user %s has been dropped.", user_id)
+        return {
+            "status_code": status.HTTP_200_OK,
+            "message": "User %s has been disconnected." % user_id,
+            "data": {},
+        }
+
     try:
         client = storage.get_active_client(user_id)
     except KeyError as e:
         logger.error("Client with user_id %s not found in active clients.", user_id)
         raise NotFoundClientException(str(e))
 
+    update_dispatcher.unsubscribe(user_id)
     await client.disconnect()
 
-    session_data = await client.session.save()
-    await send_encrypted_session(user_id, encrypt_session(session_data))
-    logger.info("Session data for user %s has been sent to the storage service.", user_id)
+    await checkpointer.checkpoint(user_id, client, force=True)
+    logger.info("Session data for user %s has been queued for the storage service.", user_id)
 
     storage.remove_active_client(user_id)
 
@@ -146,13 +232,54 @@ async def disconnect(user_id: UUID) -> dict:
     }
 
 
-async def check_2fa_status(client: TelegramClient, user_id: UUID, raise_exc: bool = False):
+@router.get("/storage/stats", response_model=APIResponse)
+async def storage_stats() -> dict:
+    """
+    Return the number of stored clients and how many of them have been evicted.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Client storage statistics.",
+        "data": storage.stats(),
+    }
+
+
+@router.get("/health/stats", response_model=APIResponse)
+async def health_stats() -> dict:
+    """
+    Return the number of healthy, reconnecting and dead clients and the reconnect counters.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Client health statistics.",
+        "data": health_monitor.stats(),
+    }
+
+
+@router.get("/scheduler/stats", response_model=APIResponse)
+async def scheduler_stats() -> dict:
+    """
+    Return the queue depth and wait times of the Telegram request scheduler.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Telegram scheduler statistics.",
+        "data": scheduler.stats(),
+    }
+
+
+async def check_2fa_status(
+    client: TelegramClient,
+    user_id: UUID,
+    raise_exc: bool = False,
+    priority: Priority = Priority.INTERACTIVE,
+):
     """
     Check if the user has 2FA enabled by sending a welcome message.
     If 2FA is enabled and the user has not provided a password, raise an exception.
     """
     try:
-        await send_welcome_message(client)
+        await send_welcome_message(client, priority=priority)
     except SessionPasswordNeededError as e:  # This means the user has 2FA enabled
         logger.info("2FA password required for user %s", str(user_id))
         # TODO: Check if the user has provided a 2FA password
@@ -0,0 +1,50 @@
+import logging
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException
+from starlette import status
+from telethon import TelegramClient
+
+from app.dependencies.auth import verify_api_key
+from app.dependencies.clients import active_client
+from app.models import APIResponse, UserChannel
+from app.services.export import export_jobs
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.post("/export/{user_id}", response_model=APIResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_export(
+    user_id: UUID,
+    channels: list[UserChannel],
+    client: TelegramClient = Depends(active_client),
+) -> dict:
+    """
+    Start a background export of the whole history of the active channels.
+    An unfinished export of the user is resumed instead.
+    """
+    job = export_jobs.start(user_id, client, channels)
+    logger.info("Export job %s has been started for user %s", job.id, user_id)
+    return {
+        "status_code": status.HTTP_202_ACCEPTED,
+        "message": "Export has been started.",
+        "data": export_jobs.progress(job),
+    }
+
+
+@router.get("/export/{user_id}/{job_id}", response_model=APIResponse)
+async def export_progress(user_id: UUID, job_id: str) -> dict:
+    """
+    Return the progress and the throughput of the export job.
+    """
+    job = export_jobs.get(job_id)
+    if job is None or job.user_id != str(user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Export job not found")
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": f"Export is {job.status}.",
+        "data": export_jobs.progress(job),
+    }
@@ -0,0 +1,46 @@
+import logging
+from datetime import datetime
+from typing import Literal
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from starlette import status
+
+from app.dependencies.auth import verify_api_key
+from app.models import APIResponse
+from app.services.index import match_expression, message_index
+from app.utils import as_utc
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/index/{user_id}/search", response_model=APIResponse)
+async def search_index(
+    user_id: UUID,
+    q: str = Query(..., min_length=1, description="Words to search for"),
+    telegram_id: list[str] | None = Query(None, description="Channels to search in"),
+    since: datetime | None = Query(None, description="Return messages sent at or after this date"),
+    until: datetime | None = Query(None, description="Return messages sent before this date"),
+    order: Literal["rank", "date"] = "rank",
+    dedup: bool = Query(True, description="Collapse reposts of the same text"),
+    limit: int = Query(50, gt=0, le=1000),
+    offset: int = Query(0, ge=0),
+) -> dict:
+    """
+    Search the locally indexed messages of the user without calling Telegram.
+    """
+    if not match_expression(q):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query has no words to search for")
+
+    results = await message_index.search(
+        user_id, q, telegram_id, as_utc(since), as_utc(until), order, dedup, limit, offset,
+    )
+    logger.info("Index search for user %s found %s messages", user_id, len(results))
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Index search has been finished.",
+        "data": {"messages": results, "limit": limit, "offset": offset},
+    }
@@ -0,0 +1,71 @@
+import logging
+from urllib.parse import quote
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette import status
+from telethon import TelegramClient
+
+from app.dependencies.auth import verify_api_key
+from app.dependencies.clients import active_client, leased
+from app.models import APIResponse
+from app.services.media import get_media_file, media_cache, parse_range
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("/media/{user_id}/{telegram_id}/{message_id}")
+async def download_media(
+    user_id: UUID,
+    telegram_id: str,
+    message_id: int,
+    range: str | None = Header(None),
+    client: TelegramClient = Depends(active_client),
+) -> StreamingResponse:
+    """
+    Stream the document or photo of the channel message in chunks.
+    A single byte range can be requested with the Range header.
+    """
+    media = await get_media_file(client, user_id, telegram_id, message_id)
+    if media is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message has no downloadable media")
+
+    try:
+        requested = parse_range(range, media.size)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range is not satisfiable",
+            headers={"Content-Range": f"bytes */{media.size}"},
+        )
+
+    start, end = requested or (0, media.size - 1)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
+    if requested:
+        headers["Content-Range"] = f"bytes {start}-{end}/{media.size}"
+    if media.file_name:
+        headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(media.file_name)}"
+
+    logger.info("Streaming media %s of message %s in %s for user %s", media.key, message_id, telegram_id, user_id)
+    return StreamingResponse(
+        leased(user_id, media_cache.stream(client, media, start, end)) if media.size else iter(()),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if requested else status.HTTP_200_OK,
+        media_type=media.mime_type,
+        headers=headers,
+    )
+
+
+@router.get("/media/stats", response_model=APIResponse)
+async def media_cache_stats() -> dict:
+    """
+    Return the size and hit counters of the shared media cache.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Media cache statistics.",
+        "data": media_cache.stats(),
+    }
@@ -0,0 +1,60 @@
+import logging
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException
+from starlette import status
+
+from app.dependencies.auth import verify_api_key
+from app.models import APIResponse, OutboundMessage
+from app.services.outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.post("/messages/batch", response_model=APIResponse, status_code=status.HTTP_202_ACCEPTED)
+async def send_messages(messages: list[OutboundMessage]) -> dict:
+    """
+    Queue messages of many accounts to be sent in the background, in order per account.
+    Return the status of every job by its id, to be polled with GET /messages/{user_id}/jobs/{job_id}.
+    Job ids are unique across the accounts, reusing the id of another account's job is a conflict.
+    """
+    try:
+        jobs = outbox.submit(messages)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logger.info("%s outbound messages have been queued.", len(jobs))
+    return {
+        "status_code": status.HTTP_202_ACCEPTED,
+        "message": "Messages have been queued.",
+        "data": {job.id: job.progress() for job in jobs},
+    }
+
+
+@router.get("/messages/{user_id}/jobs/{job_id}", response_model=APIResponse)
+async def message_job(user_id: UUID, job_id: str) -> dict:
+    """
+    Return the status of an outbound message job.
+    """
+    job = outbox.get(user_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message job not found")
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": f"Message is {job.status}.",
+        "data": job.progress(),
+    }
+
+
+@router.get("/messages/stats", response_model=APIResponse)
+async def outbox_stats() -> dict:
+    """
+    Return the number of outbound message jobs by status and the queue depth.
+    """
+    return {
+        "status_code": status.HTTP_200_OK,
+        "message": "Outbox statistics.",
+        "data": outbox.stats(),
+    }
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.dependencies.auth import verify_api_key
+from app.metrics import client_health_clients, client_storage_clients, registry
+from app.services.health import DEAD, HEALTHY, RECONNECTING, health_monitor
+from app.storage import storage
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+client_storage_clients.set_function(
+    lambda: {(state,): storage.stats()[state] for state in ("active", "unauthorized", "suspended")}
+)
+client_health_clients.set_function(
+    lambda: {(state,): health_monitor.stats()[state] for state in (HEALTHY, RECONNECTING, DEAD)}
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Export the metrics in the Prometheus text format.
+    Like the API, the endpoint requires the API key in the x-api-key header, so the scrape
+    config has to send it (http_headers needs Prometheus 2.55 or newer):
+
+        scrape_configs:
+          - job_name: telegram-client
+            http_headers:
+              x-api-key:
+                secrets: ["<API_KEY>"]
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,69 @@
+"""
+Run the service as several worker processes on one node.
+
+Every worker owns a shard of user_ids, picked by consistent hashing, and listens on
+its own port starting from SHARD_BASE_PORT. A front router on the public port forwards
+each request to the owning worker; workers also forward requests they don't own.
+Forwarded requests are signed with the ENCRYPTION_KEY, which all the workers share.
+
+    python -m app.cluster --workers 4 --port 8000
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+
+import uvicorn
+
+from app.config import settings
+from app.sharding import ShardRouter, worker_nodes
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(index: int, workers: int, host: str, base_port: int, log_level: str) -> None:
+    # Settings are read on import, so the shard has to be set before the app is imported
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["SHARD_WORKERS"] = str(workers)
+    os.environ["SHARD_HOST"] = host
+    os.environ["SHARD_BASE_PORT"] = str(base_port)
+    uvicorn.run("app.main:app", host=host, port=base_port + index, log_level=log_level)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=settings.SHARD_WORKERS or os.cpu_count())
+    parser.add_argument("--host", default="0.0.0.0", help="Host of the front router")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the front router")
+    parser.add_argument("--worker-host", default=settings.SHARD_HOST)
+    parser.add_argument("--base-port", type=int, default=settings.SHARD_BASE_PORT)
+    parser.add_argument("--log-level", default=settings.LOG_LEVEL.lower())
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(index, args.workers, args.worker_host, args.base_port, args.log_level),
+            name=f"worker-{index}",
+        )
+        for index in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("Started %s workers from port %s", args.workers, args.base_port)
+
+    router = ShardRouter(
+        None, worker_nodes(args.worker_host, args.base_port, args.workers), secret=settings.ENCRYPTION_KEY,
+    )
+    try:
+        uvicorn.run(router, host=args.host, port=args.port, log_level=args.log_level)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
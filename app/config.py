@@ -55,13 +55,146 @@ class Settings(BaseSettings):
     TG_API_ID: int = 123456  # Replace with your actual Telegram API ID
     TG_API_HASH: str = "your_api_hash_here"  # Replace with your actual Telegram API hash
 
+    # Outbound Telegram traffic shaping
+    TG_GLOBAL_RATE: float = 30.0  # Requests per second for the whole process
+    TG_GLOBAL_BURST: float = 60.0
+    TG_CLIENT_RATE: float = 1.0  # Requests per second for a single client
+    TG_CLIENT_BURST: float = 5.0
+    TG_MAX_FLOOD_WAIT: float = 120.0  # Longer FloodWaits are returned to the caller
+    TG_FLOOD_SLEEP_THRESHOLD: int = 0  # FloodWaits Telethon sleeps through itself
+
     ENCRYPTION_KEY: str = "your_encryption_key_here"  # Key for encrypting session data
+    # Format of new encrypted sessions: "legacy" ciphertext:iv:tag or the "compact" envelope.
+    # Both are always accepted for decryption.
+    SESSION_ENVELOPE: str = "legacy"
+    CRYPTO_THREAD_THRESHOLD: int = 256  # Batches of at least this many sessions are processed in threads
+    CRYPTO_CHUNK_SIZE: int = 128  # Sessions processed by one thread task
 
     API_KEY: str = "your_api_key_here"  # Own API key to access the API
 
     MAIN_SERVICE_URL: AnyHttpUrl = "http://localhost:8000"  # URL to the main service
     MAIN_SERVICE_API_KEY: str = "your_main_service_api_key_here"  # API key for the main service
 
+    # Background outbox for session uploads to the main service
+    SESSION_UPLOAD_MAX_PENDING: int = 10000  # Max number of users with a pending upload
+    SESSION_UPLOAD_BATCH_SIZE: int = 50  # Uploads sent concurrently per batch
+    SESSION_UPLOAD_MAX_RETRIES: int = 5
+    SESSION_UPLOAD_BACKOFF_BASE: float = 0.5  # Seconds, doubled on each retry
+    SESSION_UPLOAD_BACKOFF_MAX: float = 30.0  # Seconds
+    SESSION_UPLOAD_POOL_SIZE: int = 20  # Max open connections to the main service
+    SESSION_UPLOAD_TIMEOUT: float = 10.0  # Seconds per upload request
+
+    # Client storage limits
+    UNAUTHORIZED_CLIENT_TTL: float | None = 600.0  # Seconds to wait for /authorize_client
+    ACTIVE_CLIENTS_LIMIT: int | None = None  # Max active clients, least recently used are evicted
+    ACTIVE_CLIENT_IDLE_TIMEOUT: float | None = None  # Seconds before an unused client is evicted
+    CLIENT_STORAGE_SWEEP_INTERVAL: float = 30.0  # Seconds between eviction sweeps
+    PASSIVE_ENTITY_CACHE_LIMIT: int = 100  # Entities kept in memory by a passive client
+    PASSIVE_CLIENT_SUSPEND_AFTER: float | None = 300.0  # Idle seconds before a passive client is suspended
+
+    SESSION_CHECKPOINT_INTERVAL: float = 300.0  # Seconds to walk over all active sessions
+
+    # Event loop lag watchdog and the sampling profiler of /debug/profile
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_LAG_INTERVAL: float = 0.25  # Seconds between heartbeats of the loop
+    LOOP_LAG_THRESHOLD: float = 0.5  # Seconds the loop may be blocked before its stack is logged
+    PROFILE_MAX_SECONDS: float = 60.0  # Longest profile which can be requested
+
+    # Background health checks of the active clients' connections
+    HEALTH_CHECK_ENABLED: bool = True
+    HEALTH_CHECK_INTERVAL: float = 60.0  # Seconds to ping all active clients once
+    HEALTH_PING_TIMEOUT: float = 10.0  # Seconds
+    HEALTH_RECONNECT_BASE_DELAY: float = 1.0  # Seconds before the first reconnect, doubled on every failure
+    HEALTH_RECONNECT_MAX_DELAY: float = 300.0  # Seconds
+    HEALTH_RECONNECT_MAX_ATTEMPTS: int = 8  # Failed reconnects before a client is dead
+    HEALTH_EVICT_REVOKED: bool = True  # Evict clients whose auth key has been revoked instead of flagging them
+
+    # Graceful shutdown
+    SHUTDOWN_TIMEOUT: float = 30.0  # Seconds to disconnect clients and flush their sessions
+    SHUTDOWN_CONCURRENCY: int = 100  # Max clients disconnected concurrently
+
+    CONNECT_BATCH_CONCURRENCY: int = 50  # Max users connected concurrently by /connect/batch
+
+    # Reconnects of recently verified sessions skip the welcome message and get_me
+    VERIFIED_SESSION_TTL: float = 24 * 60 * 60  # Seconds
+    VERIFIED_SESSION_CACHE_SIZE: int = 100000
+    VERIFIED_SESSION_CACHE_PATH: str | None = None  # File to keep the cache across restarts
+
+    # Incremental channel sync
+    SYNC_STATE_PATH: str = "./sync_state.sqlite3"  # SQLite file of the per-channel high-water marks
+    SYNC_CONCURRENCY: int = 5  # Max channels of one user synced concurrently
+    SYNC_INITIAL_LIMIT: int = 100  # Messages returned by the first sync of a channel
+
+    # Local full-text index of the collected messages
+    MESSAGE_INDEX_ENABLED: bool = True
+    MESSAGE_INDEX_PATH: str = "./message_index.sqlite3"
+    MESSAGE_INDEX_BATCH_SIZE: int = 500  # Messages written per transaction
+    MESSAGE_INDEX_FLUSH_INTERVAL: float = 2.0  # Seconds
+
+    # On-disk cache of downloaded message media, shared by all users
+    MEDIA_CACHE_PATH: str = "./media_cache"
+    MEDIA_CACHE_MAX_BYTES: int = 1024**3
+    MEDIA_CHUNK_SIZE: int = 512 * 1024  # Bytes requested from Telegram at once, max 512 KiB
+
+    # Bulk export of the channel history to compressed NDJSON files
+    EXPORT_PATH: str = "./exports"
+    EXPORT_CHUNK_SIZE: int = 5000  # Messages per file
+    EXPORT_CONCURRENCY: int = 2  # Export jobs running at once
+    EXPORT_USE_TAKEOUT: bool = True  # Export through a takeout session, which has higher limits
+
+    # Bulk outbound messages, queued per account
+    OUTBOX_RATE: float = 1.0  # Messages per second of one account
+    OUTBOX_BURST: float = 5.0
+    OUTBOX_PEER_INTERVAL: float = 1.0  # Min seconds between two messages to the same peer
+    OUTBOX_QUEUE_LIMIT: int = 10000  # Max queued messages of one account, more are rejected
+    OUTBOX_JOB_TTL: float = 60 * 60  # Seconds the status of a finished job is kept
+    OUTBOX_MAX_FLOOD_WAIT: float = 60 * 60  # Longest FloodWait the queue of an account waits out
+
+    SEARCH_CONCURRENCY: int = 10  # Max concurrent search requests of one cross-channel search
+
+    # Real-time push of new channel messages to the main service
+    UPDATES_PUSH_ENABLED: bool = False
+    UPDATES_WEBHOOK_URL: str | None = None  # MAIN_SERVICE_URL/new_messages by default
+    UPDATES_QUEUE_SIZE: int = 10000  # Max events waiting for delivery
+    UPDATES_BATCH_SIZE: int = 100  # Events per webhook request
+    UPDATES_FLUSH_INTERVAL: float = 1.0  # Seconds to wait for a full batch
+    UPDATES_OVERFLOW_POLICY: str = "drop_oldest"  # drop_oldest, drop_newest or spill
+    UPDATES_SPILL_PATH: str = "./updates_spill.ndjson"  # File for spilled events
+    UPDATES_MAX_RETRIES: int = 3
+
+    # Shared cache of resolved channels
+    ENTITY_CACHE_MAX_CHANNELS: int = 50000
+    ENTITY_CACHE_MAX_USERS: int = 100000  # Users whose access hashes are kept
+    ENTITY_CACHE_TTL: float = 24 * 60 * 60  # Seconds
+    ENTITY_CACHE_PATH: str | None = None  # File to keep the cache across restarts
+
+    # Multi-process mode, see app/cluster.py
+    SHARD_WORKERS: int = 1  # Number of worker processes on the node
+    SHARD_INDEX: int = 0  # Index of this worker
+    SHARD_HOST: str = "127.0.0.1"  # Host the workers listen on
+    SHARD_BASE_PORT: int = 8100  # Worker N listens on SHARD_BASE_PORT + N
+
+    # Client storage backend: "memory" or "registry" for multi-node deployments
+    STORAGE_BACKEND: str = "memory"
+    NODE_ID: str | None = None  # Unique id of this node, hostname and pid by default
+    NODE_ADDRESS: str | None = None  # URL other nodes use to forward requests to this node
+    REGISTRY_PATH: str = "./client_registry.sqlite3"  # SQLite file of the client registry
+    REGISTRY_LEASE_TTL: float = 30.0  # Seconds a node is considered alive after a heartbeat
+    REGISTRY_HEARTBEAT_INTERVAL: float = 10.0  # Seconds
+    REGISTRY_RESTORE_CONCURRENCY: int = 20  # Max clients reconnected concurrently on takeover
+
+    @field_validator("SESSION_ENVELOPE", mode="before")
+    def check_session_envelope(cls, value: str) -> str:  # NOQA: N805
+        if value not in ("legacy", "compact"):
+            raise ValueError("Invalid session envelope")
+        return value
+
+    @field_validator("STORAGE_BACKEND", mode="before")
+    def check_storage_backend(cls, value: str) -> str:  # NOQA: N805
+        if value not in ("memory", "registry"):
+            raise ValueError("Invalid storage backend")
+        return value
+
     # BACKEND_CORS_ORIGINS is a JSON-formatted list of origins
     BACKEND_CORS_ORIGINS: list[AnyHttpUrl] = [
         "http://localhost",
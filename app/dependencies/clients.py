@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import AsyncGenerator, AsyncIterator, TypeVar
+from uuid import UUID
+
+from telethon import TelegramClient
+
+from app.exceptions.exceptions import AuthTelegramException, ClientUnavailableException, NotFoundClientException
+from app.services.health import RECONNECTING, health_monitor
+from app.storage import storage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def active_client(user_id: UUID) -> AsyncIterator[TelegramClient]:
+    """
+    Get the active client of the user from the path, or respond with 404.
+    A suspended passive client is reconnected first. The client is leased until
+    the handler returns, streamed responses take their own lease.
+    """
+    try:
+        client = await storage.acquire_active_client(user_id)
+    except KeyError as e:
+        logger.error("Client with user_id %s not found in active clients.", user_id)
+        raise NotFoundClientException(str(e))
+    check_health(user_id, client)
+    with storage.lease(user_id):
+        yield client
+
+
+async def full_client(user_id: UUID) -> AsyncIterator[TelegramClient]:
+    """
+    Get the active client of the user from the path promoted to a full client
+    which receives updates, or respond with 404. The client is leased until the handler returns.
+    """
+    try:
+        client = await storage.promote(user_id)
+    except KeyError as e:
+        logger.error("Client with user_id %s not found in active clients.", user_id)
+        raise NotFoundClientException(str(e))
+    check_health(user_id, client)
+    with storage.lease(user_id):
+        yield client
+
+
+async def leased(user_id: UUID, items: AsyncGenerator[T, None]) -> AsyncIterator[T]:
+    """
+    Hold a lease on the user's client while the streamed response is sent,
+    the lease of the dependency ends when the handler returns.
+    """
+    with storage.lease(user_id):
+        try:
+            async for item in items:
+                yield item
+        finally:
+            await items.aclose()
+
+
+def check_health(user_id: UUID, client: TelegramClient) -> None:
+    """
+    Fail fast with 503 while the client is being reconnected or is dead,
+    and with 401 if its auth key has been revoked.
+    """
+    health = health_monitor.get(user_id, client)
+    if health is None:
+        return
+    if health.revoked:
+        raise AuthTelegramException("Session has been revoked. Connect again.")
+
+    logger.warning("Client of user %s is %s: %s", user_id, health.state, health.error)
+    retry_after = max(0.0, health.retry_at - time.monotonic()) if health.state == RECONNECTING else None
+    raise ClientUnavailableException(f"Client of user {user_id} is {health.state}.", retry_after=retry_after)
@@ -25,3 +25,17 @@ class NotFoundClientException(HTTPException):
             status_code=status.HTTP_404_NOT_FOUND,
             detail=msg or "User client not found."
         )
+
+
+class ClientUnavailableException(HTTPException):
+    def __init__(self, msg: str | None = None, retry_after: float | None = None) -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=msg or "User client is not connected.",
+            headers={"Retry-After": str(max(1, round(retry_after)))} if retry_after is not None else None,
+        )
+
+
+class SessionUploadException(BaseCustomAppException):
+    def __init__(self, msg: str | None = None) -> None:
+        super().__init__(msg or "Failed to send session data to the main service.")
@@ -4,7 +4,7 @@ from fastapi import HTTPException
 from starlette import status
 from starlette.requests import Request
 from starlette.responses import JSONResponse
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import FloodWaitError, SessionPasswordNeededError
 
 from app.exceptions.exceptions import AuthTelegramException, NotFoundClientException
 
@@ -44,6 +44,7 @@ async def http_exception_handler(request: Request, exc: HTTPException) -> JSONRe
             "message": str(exc.detail),
         },
         headers={
+            **(exc.headers or {}),
             "Content-Type": "application/json",
         },
     )
@@ -109,3 +110,24 @@ async def not_found_client_exception_handler(
             "Content-Type": "application/json",
         },
     )
+
+
+# FloodWait which is too long to be deferred by the scheduler
+async def flood_wait_exception_handler(request: Request, exc: FloodWaitError) -> JSONResponse:
+    """
+    Custom exception handler for FloodWaitError.
+    Logs the error and returns a JSON response telling when to retry.
+    """
+    logger.warning("FloodWaitError occurred: %s", str(exc))
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={
+            "status": status.HTTP_429_TOO_MANY_REQUESTS,
+            "error": str(exc),
+            "message": "Telegram rate limit is reached. Retry after %s seconds." % exc.seconds,
+        },
+        headers={
+            "Content-Type": "application/json",
+            "Retry-After": str(exc.seconds),
+        },
+    )
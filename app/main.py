@@ -1,9 +1,11 @@
 import logging
+import time
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import FloodWaitError, SessionPasswordNeededError
 
-from app.api.v1 import endpoints
+from app.api.v1 import channels, debug, endpoints, export, index, media, messages, metrics
 from app.exceptions.exceptions import AuthTelegramException, NotFoundClientException
 from app.exceptions.handlers import (
     general_exception_handler,
@@ -11,19 +13,132 @@ from app.exceptions.handlers import (
     auth_telegram_exception_handler,
     two_fa_password_required_handler,
     not_found_client_exception_handler,
+    flood_wait_exception_handler,
 )
+from app.metrics import MetricsMiddleware
+from app.services.checkpoint import checkpointer
+from app.services.entities import entity_cache
+from app.services.export import export_jobs
+from app.services.health import health_monitor
+from app.services.index import message_index
+from app.services.media import media_cache
+from app.services.outbox import outbox
+from app.services.profiling import loop_monitor
+from app.services.scheduler import scheduler
+from app.services.session import session_uploader
+from app.services.sync import high_water_marks
+from app.services.updates import webhook_sender
+from app.services.verification import verified_sessions
+from app.sharding import RegistryRouter, ShardRouter, worker_nodes
+from app.storage import storage
 from config import settings
 
 logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the background services on startup and stop them gracefully on shutdown.
+    """
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    if settings.VERIFIED_SESSION_CACHE_PATH:
+        verified_sessions.load(settings.VERIFIED_SESSION_CACHE_PATH)
+    if settings.ENTITY_CACHE_PATH:
+        entity_cache.load(settings.ENTITY_CACHE_PATH)
+    media_cache.load()
+    export_jobs.load()
+    await session_uploader.start()
+    if settings.UPDATES_PUSH_ENABLED:
+        await webhook_sender.start()
+    storage.start()
+    if settings.MESSAGE_INDEX_ENABLED:
+        message_index.start()
+    checkpointer.start(
+        storage.active_clients,
+        lambda user_id: storage.get_active_client(user_id, raise_exc=False, touch=False),
+    )
+    if settings.HEALTH_CHECK_ENABLED:
+        health_monitor.start()
+    yield
+
+    # Both the disconnect of all clients and the flush of their sessions share one deadline
+    deadline = time.monotonic() + settings.SHUTDOWN_TIMEOUT
+    await checkpointer.stop()
+    await health_monitor.stop()
+    await export_jobs.stop()
+    await outbox.stop()
+    await storage.shutdown(
+        concurrency=settings.SHUTDOWN_CONCURRENCY,
+        timeout=settings.SHUTDOWN_TIMEOUT,
+    )
+    await scheduler.stop()
+    await webhook_sender.stop(timeout=max(0.0, deadline - time.monotonic()))
+    await message_index.stop()
+    high_water_marks.close()
+    await session_uploader.stop(timeout=max(0.0, deadline - time.monotonic()))
+    if settings.VERIFIED_SESSION_CACHE_PATH:
+        verified_sessions.dump(settings.VERIFIED_SESSION_CACHE_PATH)
+    if settings.ENTITY_CACHE_PATH:
+        entity_cache.dump(settings.ENTITY_CACHE_PATH)
+    await loop_monitor.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(
     endpoints.router,
     prefix=settings.API_V1_STR,
     tags=["v1"],
 )
+app.include_router(
+    channels.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "channels"],
+)
+app.include_router(
+    index.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "index"],
+)
+app.include_router(
+    media.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "media"],
+)
+app.include_router(
+    export.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "export"],
+)
+app.include_router(
+    messages.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "messages"],
+)
+app.include_router(
+    debug.router,
+    prefix=settings.API_V1_STR,
+    tags=["v1", "debug"],
+)
+# Scraped by Prometheus, so it is not versioned. The scraper sends the x-api-key header, see metrics()
+app.include_router(metrics.router, tags=["metrics"])
+
+# Added before the routers below, so only the requests served by this process are observed
+app.add_middleware(MetricsMiddleware)
+
+# Forward requests for user_ids owned by other workers or nodes, see app/cluster.py.
+# The nodes share the encryption key anyway, so it also signs the forwarded requests.
+if settings.STORAGE_BACKEND == "registry" and settings.NODE_ADDRESS:
+    app.add_middleware(
+        RegistryRouter, registry=storage.registry, own_node=settings.NODE_ADDRESS, secret=settings.ENCRYPTION_KEY,
+    )
+elif settings.SHARD_WORKERS > 1:
+    nodes = worker_nodes(settings.SHARD_HOST, settings.SHARD_BASE_PORT, settings.SHARD_WORKERS)
+    app.add_middleware(
+        ShardRouter, nodes=nodes, own_node=nodes[settings.SHARD_INDEX], secret=settings.ENCRYPTION_KEY,
+    )
 
 
 app.add_exception_handler(Exception, general_exception_handler)
@@ -31,6 +146,7 @@ app.add_exception_handler(HTTPException, http_exception_handler)
 app.add_exception_handler(AuthTelegramException, auth_telegram_exception_handler)
 app.add_exception_handler(SessionPasswordNeededError, two_fa_password_required_handler)
 app.add_exception_handler(NotFoundClientException, not_found_client_exception_handler)
+app.add_exception_handler(FloodWaitError, flood_wait_exception_handler)
 
 
 if __name__ == "__main__":
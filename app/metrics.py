@@ -0,0 +1,219 @@
+"""
+Metrics exported in the Prometheus text format on /metrics.
+
+The metrics are plain in-process counters: an observation is a dict lookup and a few
+additions, so they are cheap enough for every request and every Telegram call.
+"""
+import abc
+import bisect
+import time
+from typing import Callable, Iterable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Seconds, from a cached lookup to a slow Telegram call
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INFINITY_LABEL = 'le="+Inf"'
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[str]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        # A counter without labels is exported from the start, so rate() sees its first increment
+        self._values: dict[tuple[str, ...], float] = {} if self.labels else {(): 0.0}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """
+    Gauge set directly or read from a callback returning {label values: value} on every scrape.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._callback: Callable[[], dict[tuple[str, ...], float]] | None = None
+
+    def set(self, *labels: str, value: float) -> None:
+        self._values[labels] = value
+
+    def set_function(self, callback: Callable[[], dict[tuple[str, ...], float]]) -> None:
+        self._callback = callback
+
+    def samples(self) -> Iterable[str]:
+        values = self._callback() if self._callback is not None else self._values
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list] = {}  # {labels: [bucket counts..., sum, count]}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        # Counts are kept per bucket and accumulated on scrape
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket = _format_labels(self.labels, labels, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{bucket} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, labels, INFINITY_LABEL)} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {series[-1]}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Latency of the API requests by route.", ("method", "route", "status"),
+))
+telegram_rpc_duration = registry.register(Histogram(
+    "telegram_rpc_duration_seconds", "Latency of the Telegram calls, without the rate limit waits.", ("method",),
+))
+telegram_rpc_errors = registry.register(Counter(
+    "telegram_rpc_errors_total", "Failed Telegram calls by error type.", ("method", "error"),
+))
+telegram_flood_wait_seconds = registry.register(Counter(
+    "telegram_flood_wait_seconds_total", "Seconds of FloodWait requested by Telegram.", ("method",),
+))
+telegram_scheduler_wait = registry.register(Histogram(
+    "telegram_scheduler_wait_seconds", "Time the Telegram calls have waited for the rate limits.", ("priority",),
+))
+client_storage_clients = registry.register(Gauge(
+    "client_storage_clients", "Clients held by the client storage.", ("state",),
+))
+client_health_clients = registry.register(Gauge(
+    "client_health_clients", "Active clients by connection health.", ("state",),
+))
+client_health_reconnects = registry.register(Counter(
+    "client_health_reconnects_total", "Reconnect attempts of unhealthy clients by result.", ("result",),
+))
+event_loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "Delay of the event loop heartbeat past its interval.",
+))
+event_loop_stalls = registry.register(Counter(
+    "event_loop_stalls_total", "Times the event loop has been blocked for longer than the threshold.",
+))
+outbox_messages = registry.register(Counter(
+    "outbox_messages_total", "Outbound messages of the batch API by final status.", ("status",),
+))
+session_upload_duration = registry.register(Histogram(
+    "session_upload_duration_seconds", "Latency of the session uploads to the main service.", ("result",),
+))
+session_upload_failures = registry.register(Counter(
+    "session_upload_failures_total", "Session uploads given up after all the retries.",
+))
+message_index_dropped = registry.register(Counter(
+    "message_index_dropped_messages_total", "Messages dropped after failing to be written to the index.",
+))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware observing the latency of every request under its route template,
+    so the label set stays bounded whatever the path parameters are.
+    Streaming responses are timed until their last chunk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # FastAPI sets the matched route in the scope. Forwarded and unknown paths have none.
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code),
+            )
@@ -1,6 +1,7 @@
+from typing import Literal
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, model_validator
 
 
 class UserChannel(BaseModel):
@@ -29,10 +30,27 @@ class Connection(BaseModel):
     user_id: UUID
     user: User
     tfa_password: str | None = None  # Optional 2FA password
+    # A passive client receives no updates and is suspended when idle, see ClientStorage
+    mode: Literal["full", "passive"] = "full"
 
     model_config = ConfigDict(extra="ignore")
 
 
+class OutboundMessage(BaseModel):
+    id: str | None = Field(default=None, max_length=128)  # Job id, generated if not given
+    user_id: UUID  # Account sending the message
+    peer: str  # "me", a username or a channel id as in UserChannel.telegram_id
+    text: str | None = Field(default=None, max_length=4096)
+    file: str | None = None  # URL of a media to send, with the text as its caption
+    coalesce: bool = True  # The text may be merged with the next ones to the same peer
+
+    @model_validator(mode="after")
+    def check_content(self) -> "OutboundMessage":
+        if not self.text and not self.file:
+            raise ValueError("Either text or file is required.")
+        return self
+
+
 class APIResponse(BaseModel):
     status_code: int
     message: str
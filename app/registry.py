@@ -0,0 +1,175 @@
+import abc
+import asyncio
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+
+@dataclass
+class ClientLocation:
+    user_id: UUID
+    node_id: str
+    address: str | None
+    state: str  # "unauthorized" or "active"
+    alive: bool  # Whether the lease of the owning node is still valid
+
+
+class ClientRegistry(abc.ABC):
+    """
+    Shared registry of the nodes and of the users whose live clients they hold.
+
+    Nodes keep their lease alive with heartbeats. The clients of a node whose lease
+    has expired are orphaned and can be claimed by another node, which reconnects
+    them from the last encrypted session saved in the registry.
+    """
+
+    @abc.abstractmethod
+    async def heartbeat(self, node_id: str, address: str | None, ttl: float) -> None:
+        """Register the node or renew its lease for ttl seconds."""
+
+    @abc.abstractmethod
+    async def remove_node(self, node_id: str) -> None:
+        """Drop the node, so its active clients become orphaned right away."""
+
+    @abc.abstractmethod
+    async def live_nodes(self) -> list[str]:
+        """Return the ids of the nodes with a valid lease."""
+
+    @abc.abstractmethod
+    async def set_client(self, user_id: UUID, node_id: str, state: str) -> None:
+        """Record that the node holds the client of the user in the given state."""
+
+    @abc.abstractmethod
+    async def remove_client(self, user_id: UUID, node_id: str) -> None:
+        """Forget the client of the user if it is still held by the node."""
+
+    @abc.abstractmethod
+    async def save_session(self, user_id: UUID, encrypted_session: str) -> None:
+        """Keep the last encrypted session of the user for a handover."""
+
+    @abc.abstractmethod
+    async def locate(self, user_id: UUID) -> ClientLocation | None:
+        """Return where the client of the user lives."""
+
+    @abc.abstractmethod
+    async def orphaned_clients(self) -> list[tuple[UUID, str, str | None]]:
+        """Return (user_id, node_id, encrypted_session) of active clients held by dead nodes."""
+
+    @abc.abstractmethod
+    async def claim(self, user_id: UUID, from_node: str, to_node: str) -> bool:
+        """Atomically move the client from a dead node. Return False if someone else was first."""
+
+    @abc.abstractmethod
+    async def prune(self) -> int:
+        """Delete unauthorized clients of dead nodes, they can't be restored. Return the count."""
+
+
+class SQLiteClientRegistry(ClientRegistry):
+    """
+    Registry stored in SQLite. Shared between the processes of one host through a file,
+    or kept in memory for tests. The blocking queries run in a thread.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    address TEXT,
+                    lease_until REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS clients (
+                    user_id TEXT PRIMARY KEY,
+                    node_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    session_data TEXT
+                );
+                CREATE INDEX IF NOT EXISTS clients_node_id ON clients (node_id);
+                """
+            )
+
+    async def _query(self, query: str, params: tuple = ()) -> list[tuple]:
+        def query_rows() -> list[tuple]:
+            with self._lock:
+                return self._connection.execute(query, params).fetchall()
+
+        return await asyncio.to_thread(query_rows)
+
+    async def _update(self, query: str, params: tuple = ()) -> int:
+        def update_rows() -> int:
+            with self._lock:
+                return self._connection.execute(query, params).rowcount
+
+        return await asyncio.to_thread(update_rows)
+
+    async def heartbeat(self, node_id: str, address: str | None, ttl: float) -> None:
+        await self._update(
+            "INSERT INTO nodes (node_id, address, lease_until) VALUES (?, ?, ?) "
+            "ON CONFLICT (node_id) DO UPDATE SET address = excluded.address, lease_until = excluded.lease_until",
+            (node_id, address, time.time() + ttl),
+        )
+
+    async def remove_node(self, node_id: str) -> None:
+        await self._update("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+
+    async def live_nodes(self) -> list[str]:
+        rows = await self._query("SELECT node_id FROM nodes WHERE lease_until > ? ORDER BY node_id", (time.time(),))
+        return [node_id for node_id, in rows]
+
+    async def set_client(self, user_id: UUID, node_id: str, state: str) -> None:
+        await self._update(
+            "INSERT INTO clients (user_id, node_id, state, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "node_id = excluded.node_id, state = excluded.state, updated_at = excluded.updated_at",
+            (str(user_id), node_id, state, time.time()),
+        )
+
+    async def remove_client(self, user_id: UUID, node_id: str) -> None:
+        await self._update("DELETE FROM clients WHERE user_id = ? AND node_id = ?", (str(user_id), node_id))
+
+    async def save_session(self, user_id: UUID, encrypted_session: str) -> None:
+        await self._update(
+            "UPDATE clients SET session_data = ? WHERE user_id = ?", (encrypted_session, str(user_id))
+        )
+
+    async def locate(self, user_id: UUID) -> ClientLocation | None:
+        rows = await self._query(
+            "SELECT c.node_id, n.address, c.state, COALESCE(n.lease_until > ?, 0) "
+            "FROM clients c LEFT JOIN nodes n ON n.node_id = c.node_id WHERE c.user_id = ?",
+            (time.time(), str(user_id)),
+        )
+        if not rows:
+            return None
+        node_id, address, state, alive = rows[0]
+        return ClientLocation(user_id, node_id, address, state, bool(alive))
+
+    async def orphaned_clients(self) -> list[tuple[UUID, str, str | None]]:
+        rows = await self._query(
+            "SELECT c.user_id, c.node_id, c.session_data FROM clients c "
+            "LEFT JOIN nodes n ON n.node_id = c.node_id "
+            "WHERE c.state = 'active' AND (n.node_id IS NULL OR n.lease_until <= ?)",
+            (time.time(),),
+        )
+        return [(UUID(user_id), node_id, session_data) for user_id, node_id, session_data in rows]
+
+    async def claim(self, user_id: UUID, from_node: str, to_node: str) -> bool:
+        updated = await self._update(
+            "UPDATE clients SET node_id = ?, updated_at = ? WHERE user_id = ? AND node_id = ?",
+            (to_node, time.time(), str(user_id), from_node),
+        )
+        return updated == 1
+
+    async def prune(self) -> int:
+        return await self._update(
+            "DELETE FROM clients WHERE state != 'active' AND node_id NOT IN "
+            "(SELECT node_id FROM nodes WHERE lease_until > ?)",
+            (time.time(),),
+        )
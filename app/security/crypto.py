@@ -1,27 +1,41 @@
+import asyncio
 import base64
 import os
+from typing import Callable, Literal, TypeVar
 
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 from config import settings
 
 ENCRYPTION_KEY = base64.b64decode(settings.ENCRYPTION_KEY)
+IV_SIZE = 12
+TAG_SIZE = 16
+# The compact envelope is the prefix and the urlsafe base64 of iv + ciphertext + tag.
+# The prefix never occurs in the legacy format, whose parts are standard base64.
+COMPACT_PREFIX = "v1."
 
+# One key object serves all the calls, it is safe to share between threads
+_aesgcm = AESGCM(ENCRYPTION_KEY)
 
-def encrypt_session(data: str) -> str:
+T = TypeVar("T")
+Envelope = Literal["legacy", "compact"]
+
+
+def encrypt_session(data: str, envelope: Envelope | None = None) -> str:
     """
     Encrypt the session data using the encryption key.
     Args:
         data (str): The session data to encrypt.
+        envelope (str): "legacy" ciphertext:iv:tag or "compact", SESSION_ENVELOPE by default.
     """
-    iv = os.urandom(12)
-    cipher = Cipher(algorithms.AES(ENCRYPTION_KEY), modes.GCM(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(data.encode()) + encryptor.finalize()
-    tag = encryptor.tag
+    iv = os.urandom(IV_SIZE)
+    sealed = _aesgcm.encrypt(iv, data.encode(), None)  # The ciphertext followed by the tag
+
+    if (envelope or settings.SESSION_ENVELOPE) == "compact":
+        return COMPACT_PREFIX + base64.urlsafe_b64encode(iv + sealed).decode().rstrip("=")
 
     # Encode the ciphertext, iv, and tag in base64 with `:` as a separator
+    ciphertext, tag = sealed[:-TAG_SIZE], sealed[-TAG_SIZE:]
     return f"{base64.b64encode(ciphertext).decode()}:{base64.b64encode(iv).decode()}:{base64.b64encode(tag).decode()}"  # NOQA
 
 
@@ -29,19 +43,70 @@ def decrypt_session(encrypted_data: str) -> str:
     """
     Decrypt the session data using the encryption key.
     Args:
-        encrypted_data (str): The encrypted session data in the format
-                              "ciphertext:iv:tag" where each part is base64 encoded.
+        encrypted_data (str): The encrypted session data either in the legacy format
+                              "ciphertext:iv:tag" where each part is base64 encoded,
+                              or in the compact envelope.
     """
     if encrypted_data == "":
         return encrypted_data
 
     try:
-        ciphertext, iv, tag = map(base64.b64decode, encrypted_data.split(":"))
+        if encrypted_data.startswith(COMPACT_PREFIX):
+            encoded = encrypted_data[len(COMPACT_PREFIX):]
+            envelope = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+            iv, sealed = envelope[:IV_SIZE], envelope[IV_SIZE:]
+        else:
+            ciphertext, iv, tag = map(base64.b64decode, encrypted_data.split(":"))
+            sealed = ciphertext + tag
     except ValueError as e:
         raise Exception("Invalid encrypted data format.") from e
 
-    cipher = Cipher(algorithms.AES(ENCRYPTION_KEY), modes.GCM(iv, tag), backend=default_backend())
-    decryptor = cipher.decryptor()
-    decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
+    return _aesgcm.decrypt(iv, sealed, None).decode()
+
+
+async def encrypt_sessions(sessions: list[str], envelope: Envelope | None = None) -> list[str]:
+    """
+    Encrypt many sessions at once, in the same order.
+    Args:
+        sessions (list[str]): The session data to encrypt.
+        envelope (str): "legacy" or "compact", SESSION_ENVELOPE by default.
+    """
+    return await _process(lambda chunk: [encrypt_session(data, envelope) for data in chunk], sessions)
+
+
+async def decrypt_sessions(
+    encrypted_sessions: list[str], return_exceptions: bool = False,
+) -> list[str | Exception]:
+    """
+    Decrypt many sessions at once, in the same order.
+    Args:
+        encrypted_sessions (list[str]): The encrypted session data in any supported format.
+        return_exceptions (bool): Return the error in place of a session which can't be
+                                  decrypted instead of raising it.
+    """
+    def decrypt(chunk: list[str]) -> list[str | Exception]:
+        results = []
+        for encrypted_data in chunk:
+            try:
+                results.append(decrypt_session(encrypted_data))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    return await _process(decrypt, encrypted_sessions)
+
+
+async def _process(func: Callable[[list[str]], list[T]], items: list[str]) -> list[T]:
+    # Small batches are cheaper on the event loop than a thread hop. Large ones are split
+    # into chunks processed in a thread one after another: the GIL leaves no gain in running
+    # them in parallel, while a single worker thread lets the loop keep serving requests.
+    if len(items) < settings.CRYPTO_THREAD_THRESHOLD:
+        return func(items)
 
-    return decrypted_data.decode()
+    results = []
+    size = settings.CRYPTO_CHUNK_SIZE
+    for start in range(0, len(items), size):
+        results += await asyncio.to_thread(func, items[start:start + size])
+    return results
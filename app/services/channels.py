@@ -0,0 +1,123 @@
+import json
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.tl.functions.messages import GetHistoryRequest
+
+from app.services.entities import entity_cache
+from app.services.scheduler import Priority, scheduler
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PAGE_SIZE = 100  # Max messages Telegram returns per GetHistoryRequest
+
+# Message fields which can be requested by the consumers: {name: getter}
+MESSAGE_FIELDS: dict[str, Callable[[Any], Any]] = {
+    "id": lambda message: message.id,
+    "date": lambda message: message.date.isoformat() if message.date else None,
+    "edit_date": lambda message: message.edit_date.isoformat() if getattr(message, "edit_date", None) else None,
+    "text": lambda message: getattr(message, "message", None),
+    "views": lambda message: getattr(message, "views", None),
+    "forwards": lambda message: getattr(message, "forwards", None),
+    "post_author": lambda message: getattr(message, "post_author", None),
+    "grouped_id": lambda message: getattr(message, "grouped_id", None),
+    "has_media": lambda message: getattr(message, "media", None) is not None,
+    "reply_to_msg_id": lambda message: getattr(getattr(message, "reply_to", None), "reply_to_msg_id", None),
+}
+DEFAULT_FIELDS = ("id", "date", "text")
+
+
+async def iter_history_pages(
+    client: TelegramClient,
+    user_id: UUID,
+    telegram_id: str,
+    min_id: int = 0,
+    max_id: int = 0,
+    until: datetime | None = None,
+    limit: int | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> AsyncIterator[Any]:
+    """
+    Iterate over the raw GetHistoryRequest results from the newest messages to the oldest ones.
+    Only messages with min_id < id < max_id (if set) sent before until are returned.
+    """
+    peer = await entity_cache.resolve(client, user_id, telegram_id, priority)
+
+    offset_id, offset_date, returned = max_id, until, 0
+    while limit is None or returned < limit:
+        page_size = HISTORY_PAGE_SIZE if limit is None else min(HISTORY_PAGE_SIZE, limit - returned)
+        result = await scheduler.request(
+            client,
+            GetHistoryRequest(
+                peer=peer,
+                offset_id=offset_id,
+                offset_date=offset_date,
+                add_offset=0,
+                limit=page_size,
+                max_id=0,
+                min_id=min_id,
+                hash=0,
+            ),
+            priority=priority,
+        )
+        yield result
+
+        returned += len(result.messages)
+        if len(result.messages) < page_size:
+            return
+        offset_id, offset_date = result.messages[-1].id, None
+
+
+async def iter_history(
+    client: TelegramClient,
+    user_id: UUID,
+    telegram_id: str,
+    min_id: int = 0,
+    max_id: int = 0,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> AsyncIterator[Any]:
+    """
+    Iterate over the channel history from the newest message to the oldest one.
+    Only messages with min_id < id < max_id (if set) and since <= date < until are returned.
+    Pages are requested lazily, so a slow consumer holds at most one page in memory.
+    """
+    pages = iter_history_pages(client, user_id, telegram_id, min_id, max_id, until, limit, priority)
+    async for result in pages:
+        for message in result.messages:
+            if since is not None and message.date is not None and message.date < since:
+                await pages.aclose()
+                return
+            yield message
+
+
+def project_message(message: Any, fields: tuple[str, ...] = DEFAULT_FIELDS) -> dict:
+    """
+    Return the requested fields of the message as a JSON-serializable dict.
+    """
+    return {field: MESSAGE_FIELDS[field](message) for field in fields}
+
+
+async def encode_stream(items: AsyncIterator[dict], media_type: str) -> AsyncIterator[bytes]:
+    """
+    Encode the items as NDJSON lines or Server-Sent Events.
+    An error in the middle of the stream is sent as the last item.
+    """
+    sse = media_type == "text/event-stream"
+    try:
+        async for item in items:
+            data = json.dumps(item, ensure_ascii=False)
+            yield f"data: {data}\n\n".encode() if sse else f"{data}\n".encode()
+    except Exception as e:
+        logger.error("Stream has been interrupted: %s", str(e))
+        data = json.dumps({"error": str(e)})
+        yield f"event: error\ndata: {data}\n\n".encode() if sse else f"{data}\n".encode()
+        return
+
+    if sse:
+        yield b"event: end\ndata: {}\n\n"
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import logging
+from typing import Callable
+from uuid import UUID
+
+from telethon import TelegramClient
+
+from app.config import settings
+from app.security.crypto import encrypt_session, encrypt_sessions
+from app.services.session import session_uploader
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCheckpointer:
+    """
+    Persists the sessions of active clients to the main service.
+
+    A hash of the last persisted session is kept per user, so only the sessions which
+    have changed since then (new auth key, DC migration) are encrypted and uploaded.
+    The periodic walk over the active clients is spread evenly over the interval.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        self._hashes: dict[UUID, str] = {}  # {user_id: sha256 of the last persisted session}
+        self._worker: asyncio.Task | None = None
+        self._listeners: list[Callable[[UUID, str], None]] = []
+
+        self.uploaded = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _hash(session_data: str) -> str:
+        return hashlib.sha256(session_data.encode()).hexdigest()
+
+    def mark_clean(self, user_id: UUID, session_data: str) -> None:
+        """
+        Remember the session which the main service already has, e.g. the one used to connect.
+        """
+        self._hashes[user_id] = self._hash(session_data)
+
+    def forget(self, user_id: UUID) -> None:
+        self._hashes.pop(user_id, None)
+
+    def subscribe(self, listener: Callable[[UUID, str], None]) -> None:
+        """
+        Call the listener with the user_id and the encrypted session on every upload.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    async def checkpoint(self, user_id: UUID, client: TelegramClient, force: bool = False) -> bool:
+        """
+        Upload the session of the client if it has changed since the last checkpoint.
+        Return True if the session has been queued for upload.
+        """
+        session_data = client.session.save()
+        digest = self._hash(session_data)
+        if not force and self._hashes.get(user_id) == digest:
+            self.skipped += 1
+            return False
+
+        await self._upload(user_id, encrypt_session(session_data), digest)
+        return True
+
+    async def checkpoint_many(self, clients: list[tuple[UUID, TelegramClient]], force: bool = False) -> int:
+        """
+        Upload the changed sessions of many clients, e.g. on shutdown.
+        The sessions are encrypted in one batch, off the event loop if the batch is large.
+        Return the number of sessions queued for upload.
+        """
+        changed = []
+        for user_id, client in clients:
+            session_data = client.session.save()
+            digest = self._hash(session_data)
+            if not force and self._hashes.get(user_id) == digest:
+                self.skipped += 1
+                continue
+            changed.append((user_id, session_data, digest))
+
+        encrypted_sessions = await encrypt_sessions([session_data for _, session_data, _ in changed])
+        for (user_id, _, digest), encrypted_session in zip(changed, encrypted_sessions):
+            await self._upload(user_id, encrypted_session, digest)
+        return len(changed)
+
+    async def _upload(self, user_id: UUID, encrypted_session: str, digest: str) -> None:
+        await session_uploader.enqueue(user_id, encrypted_session)
+        self._hashes[user_id] = digest
+        for listener in self._listeners:
+            listener(user_id, encrypted_session)
+        self.uploaded += 1
+
+    def start(
+        self,
+        clients: Callable[[], list[tuple[UUID, TelegramClient]]],
+        current: Callable[[UUID], TelegramClient | None],
+    ) -> None:
+        """
+        Start checkpointing the clients returned by the first callable every interval.
+        The second one returns the current client of a user, so a client which has been
+        replaced or removed since the walk began is not checkpointed.
+        """
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(clients, current), name="session-checkpointer")
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(
+        self,
+        clients: Callable[[], list[tuple[UUID, TelegramClient]]],
+        current: Callable[[UUID], TelegramClient | None],
+    ) -> None:
+        while True:
+            snapshot = clients()
+            if not snapshot:
+                await asyncio.sleep(self._interval)
+                continue
+
+            # Spread the work over the interval instead of sweeping all clients at once
+            step = self._interval / len(snapshot)
+            uploaded = 0
+            for user_id, client in snapshot:
+                if current(user_id) is not client:
+                    continue  # Its stale session would overwrite the one of the new client
+                try:
+                    uploaded += await self.checkpoint(user_id, client)
+                except Exception as e:
+                    logger.error("Failed to checkpoint session for user %s: %s", user_id, str(e))
+                await asyncio.sleep(step)
+
+            logger.info("Checkpointed %s of %s active sessions.", uploaded, len(snapshot))
+
+
+checkpointer = SessionCheckpointer(interval=settings.SESSION_CHECKPOINT_INTERVAL)
@@ -0,0 +1,202 @@
+import json
+import logging
+import pathlib
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from uuid import UUID
+
+from telethon import TelegramClient, utils
+from telethon.tl.types import Channel, InputPeerChannel, PeerChannel
+
+from app.config import settings
+from app.services.scheduler import Priority, scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def channel_peer(telegram_id: str) -> int | str | PeerChannel:
+    """
+    Convert UserChannel.telegram_id to a peer Telethon can resolve.
+    Marked ids (-100...) are used as is, bare positive ids are channel ids,
+    anything else is a username.
+    """
+    value = telegram_id.strip().lstrip("@")
+    if value.lstrip("-").isdigit():
+        number = int(value)
+        return number if number < 0 else PeerChannel(number)
+    return value
+
+
+@dataclass
+class ChannelInfo:
+    id: int  # Bare channel id, the same for every account
+    title: str | None
+    username: str | None
+    cached_at: float  # Wall clock time, so it survives a restart
+
+
+class EntityCache:
+    """
+    Process-wide cache of resolved channels.
+
+    Public channel metadata (id, title, username) is shared by all clients and expires
+    after a TTL. Access hashes are bound to the account, so they are kept in a per-user
+    layer. A channel whose access hash is known for the user is resolved without any RPC.
+    Both layers are size-bounded in LRU order and can be saved to disk for warm starts.
+    """
+
+    def __init__(self, max_channels: int, max_users: int, ttl: float):
+        self._max_channels = max_channels
+        self._max_users = max_users
+        self._ttl = ttl
+        self._channels: OrderedDict[int, ChannelInfo] = OrderedDict()
+        self._usernames: dict[str, int] = {}  # {lowercase username: channel id}
+        self._access_hashes: OrderedDict[UUID, dict[int, int]] = OrderedDict()  # {user_id: {id: hash}}
+
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "users": len(self._access_hashes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def get_channel(self, telegram_id: str) -> ChannelInfo | None:
+        """
+        Return the cached metadata of a channel by its id or username, if it has not expired.
+        """
+        channel_id = self._channel_id(telegram_id)
+        info = self._channels.get(channel_id) if channel_id is not None else None
+        if info is None:
+            return None
+
+        if time.time() - info.cached_at > self._ttl:
+            self._forget_channel(channel_id)
+            return None
+
+        self._channels.move_to_end(channel_id)
+        return info
+
+    def add_channel(self, user_id: UUID, channel: Channel) -> None:
+        """
+        Cache the metadata of the resolved channel and the user's access hash for it.
+        """
+        info = ChannelInfo(channel.id, channel.title, channel.username, time.time())
+        self._add(user_id, info, channel.access_hash if not channel.min else None)
+
+    def _add(self, user_id: UUID, info: ChannelInfo, access_hash: int | None) -> None:
+        self._forget_channel(info.id)
+        self._channels[info.id] = info
+        if info.username:
+            self._usernames[info.username.lower()] = info.id
+        while len(self._channels) > self._max_channels:
+            self._forget_channel(next(iter(self._channels)))
+        self._add_access_hash(user_id, info.id, access_hash)
+
+    def _add_access_hash(self, user_id: UUID, channel_id: int, access_hash: int | None) -> None:
+        if access_hash is not None:
+            self._access_hashes.setdefault(user_id, {})[channel_id] = access_hash
+            self._access_hashes.move_to_end(user_id)
+            while len(self._access_hashes) > self._max_users:
+                self._access_hashes.popitem(last=False)
+
+    async def resolve(
+        self,
+        client: TelegramClient,
+        user_id: UUID,
+        telegram_id: str,
+        priority: Priority = Priority.INTERACTIVE,
+    ):
+        """
+        Return the input peer of the channel for the user's client.
+        """
+        info = self.get_channel(telegram_id)
+        if info is not None:
+            access_hash = self._access_hashes.get(user_id, {}).get(info.id)
+            if access_hash is not None:
+                self.hits += 1
+                self._access_hashes.move_to_end(user_id)
+                return InputPeerChannel(info.id, access_hash)
+
+        # A bare id can't be resolved without an access hash, but a username known from
+        # another user's lookup can
+        self.misses += 1
+        target = info.username if info is not None and info.username else channel_peer(telegram_id)
+        # The input peer comes from the session when the client has seen the channel, without any RPC
+        peer = await scheduler.call(client, client.get_input_entity, target, priority=priority)
+        if not isinstance(peer, InputPeerChannel):
+            return peer
+
+        if info is not None:
+            self._add_access_hash(user_id, info.id, peer.access_hash)
+        elif isinstance(target, str):
+            self._add(user_id, ChannelInfo(peer.channel_id, None, target, time.time()), peer.access_hash)
+        else:
+            # Only the full channel tells the username the other users can resolve it by
+            entity = await scheduler.call(client, client.get_entity, peer, priority=priority)
+            if isinstance(entity, Channel):
+                self.add_channel(user_id, entity)
+        return peer
+
+    def load(self, path: str) -> None:
+        """
+        Load the cache saved by dump, skipping the expired channels.
+        """
+        file = pathlib.Path(path)
+        if not file.exists():
+            return
+
+        try:
+            data = json.loads(file.read_text())
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load entity cache from %s: %s", path, str(e))
+            return
+
+        now = time.time()
+        for channel in data.get("channels", []):
+            if now - channel["cached_at"] <= self._ttl:
+                info = ChannelInfo(**channel)
+                self._channels[info.id] = info
+                if info.username:
+                    self._usernames[info.username.lower()] = info.id
+        for user_id, hashes in data.get("access_hashes", {}).items():
+            self._access_hashes[UUID(user_id)] = {int(channel_id): value for channel_id, value in hashes.items()}
+        logger.info("Loaded %s channels from the entity cache %s", len(self._channels), path)
+
+    def dump(self, path: str) -> None:
+        data = {
+            "channels": [asdict(info) for info in self._channels.values()],
+            "access_hashes": {
+                str(user_id): {str(channel_id): value for channel_id, value in hashes.items()}
+                for user_id, hashes in self._access_hashes.items()
+            },
+        }
+        try:
+            pathlib.Path(path).write_text(json.dumps(data))
+        except OSError as e:
+            logger.error("Failed to save entity cache to %s: %s", path, str(e))
+
+    def _channel_id(self, telegram_id: str) -> int | None:
+        peer = channel_peer(telegram_id)
+        if isinstance(peer, PeerChannel):
+            return peer.channel_id
+        if isinstance(peer, int):
+            channel_id, peer_type = utils.resolve_id(peer)
+            return channel_id if peer_type is PeerChannel else None
+        return self._usernames.get(peer.lower())
+
+    def _forget_channel(self, channel_id: int) -> None:
+        info = self._channels.pop(channel_id, None)
+        if info is not None and info.username:
+            self._usernames.pop(info.username.lower(), None)
+
+
+entity_cache = EntityCache(
+    max_channels=settings.ENTITY_CACHE_MAX_CHANNELS,
+    max_users=settings.ENTITY_CACHE_MAX_USERS,
+    ttl=settings.ENTITY_CACHE_TTL,
+)
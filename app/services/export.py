@@ -0,0 +1,265 @@
+import asyncio
+import gzip
+import json
+import logging
+import pathlib
+import re
+import time
+import uuid
+from contextlib import AsyncExitStack
+from dataclasses import asdict, dataclass, field
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.errors import TakeoutInitDelayError, TakeoutInvalidError
+
+from app.config import settings
+from app.models import UserChannel
+from app.services.channels import MESSAGE_FIELDS, iter_history_pages, project_message
+from app.services.scheduler import Priority
+from app.storage import storage
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = tuple(MESSAGE_FIELDS)
+UNSAFE_CHARACTERS_RE = re.compile(r"[^\w.-]")
+UNFINISHED = ("pending", "running")
+
+
+@dataclass
+class ChannelProgress:
+    telegram_id: str
+    offset_id: int = 0  # Messages older than this id are left to export, 0 before the first chunk
+    messages: int = 0
+    chunks: int = 0
+    done: bool = False
+    error: str | None = None
+
+
+@dataclass
+class ExportJob:
+    id: str
+    user_id: str
+    channels: list[ChannelProgress]
+    status: str = "pending"  # pending, running, interrupted, done or failed
+    takeout: bool = False
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+    error: str | None = None
+
+    @property
+    def messages(self) -> int:
+        return sum(channel.messages for channel in self.channels)
+
+
+class ExportManager:
+    """
+    Background jobs exporting the whole history of the user's channels.
+
+    Channels are paged through a takeout session when Telegram allows it, with background
+    priority, from the newest message to the oldest one. Every EXPORT_CHUNK_SIZE messages
+    are written to a gzipped NDJSON file, and the job state is saved next to them right
+    after, so an interrupted job resumes from its last file. File writes and compression
+    run in a thread.
+    """
+
+    def __init__(self, path: str, chunk_size: int, concurrency: int, use_takeout: bool):
+        self._path = pathlib.Path(path)
+        self._chunk_size = chunk_size
+        self._use_takeout = use_takeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._jobs: dict[str, ExportJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._runs: dict[str, tuple[float, int]] = {}  # {job_id: (started at, messages at start)}
+
+    def get(self, job_id: str) -> ExportJob | None:
+        return self._jobs.get(job_id)
+
+    def progress(self, job: ExportJob) -> dict:
+        """
+        Return the job state with the throughput of its current (or last) run.
+        """
+        started, messages_at_start = self._runs.get(job.id, (None, job.messages))
+        elapsed = time.monotonic() - started if started is not None else 0.0
+        return {
+            "job_id": job.id,
+            "user_id": job.user_id,
+            "status": job.status,
+            "takeout": job.takeout,
+            "messages": job.messages,
+            "messages_per_second": round((job.messages - messages_at_start) / elapsed, 2) if elapsed else 0.0,
+            "channels_done": sum(channel.done for channel in job.channels),
+            "channels_total": len(job.channels),
+            "channels": [asdict(channel) for channel in job.channels],
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+            "error": job.error,
+        }
+
+    def load(self) -> None:
+        """
+        Load the jobs saved by the previous run. The unfinished ones wait for the user's client to resume.
+        """
+        if not self._path.exists():
+            return
+
+        for file in self._path.glob("*/job.json"):
+            try:
+                data = json.loads(file.read_text())
+                channels = [ChannelProgress(**channel) for channel in data.pop("channels")]
+                job = ExportJob(channels=channels, **data)
+            except (OSError, ValueError, TypeError) as e:
+                logger.error("Failed to load export job from %s: %s", file, str(e))
+                continue
+            if job.status in UNFINISHED:
+                # The process has stopped in the middle of the job
+                job.status = "interrupted"
+            self._jobs[job.id] = job
+        logger.info("Loaded %s export jobs", len(self._jobs))
+
+    def start(self, user_id: UUID, client: TelegramClient, channels: list[UserChannel]) -> ExportJob:
+        """
+        Start exporting the active channels of the user.
+        An unfinished or failed job of the user is resumed instead of starting a new one.
+        """
+        for job in self._jobs.values():
+            if job.user_id == str(user_id) and job.status != "done":
+                self._spawn(job, client)
+                return job
+
+        job = ExportJob(
+            id=str(uuid.uuid4()),
+            user_id=str(user_id),
+            channels=[ChannelProgress(channel.telegram_id) for channel in channels if channel.is_active],
+        )
+        self._jobs[job.id] = job
+        self._spawn(job, client)
+        return job
+
+    def resume(self, user_id: UUID, client: TelegramClient) -> None:
+        """
+        Resume the interrupted jobs of the user, e.g. once their client is connected again.
+        """
+        for job in self._jobs.values():
+            if job.user_id == str(user_id) and job.status == "interrupted":
+                self._spawn(job, client)
+
+    async def stop(self) -> None:
+        """
+        Cancel the running jobs. Their progress up to the last written file is kept.
+        """
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, job: ExportJob, client: TelegramClient) -> None:
+        if job.id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(job, client))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+
+    async def _run(self, job: ExportJob, client: TelegramClient) -> None:
+        job.status, job.finished_at = "pending", None
+        await self._save(job)
+        try:
+            async with self._semaphore, AsyncExitStack() as stack:
+                # A passive client must not be suspended under a running export
+                stack.enter_context(storage.lease(UUID(job.user_id)))
+                job.status, job.error = "running", None
+                self._runs[job.id] = (time.monotonic(), job.messages)
+                logger.info("Exporting %s channels for user %s, job %s", len(job.channels), job.user_id, job.id)
+                source = client
+                if self._use_takeout:
+                    source = await self._enter_takeout(stack, job, client)
+                for channel in job.channels:
+                    if not channel.done:
+                        await self._export_channel(job, source, channel)
+        except asyncio.CancelledError:
+            job.status = "interrupted"
+            await asyncio.shield(self._save(job))
+            raise
+        except Exception as e:
+            logger.error("Export job %s has failed: %s", job.id, str(e))
+            job.status, job.error = "failed", str(e)
+        else:
+            failed = [channel.telegram_id for channel in job.channels if channel.error]
+            job.status = "failed" if failed else "done"
+            job.error = f"Failed channels: {', '.join(failed)}" if failed else None
+        job.finished_at = time.time()
+        await self._save(job)
+        logger.info("Export job %s is %s with %s messages", job.id, job.status, job.messages)
+
+    async def _enter_takeout(self, stack: AsyncExitStack, job: ExportJob, client: TelegramClient):
+        # A takeout left open by an interrupted run is reused
+        options = {} if client.session.takeout_id else {"channels": True, "megagroups": True}
+        try:
+            takeout = await stack.enter_async_context(client.takeout(finalize=True, **options))
+        except (TakeoutInitDelayError, TakeoutInvalidError) as e:
+            logger.warning("Takeout is unavailable for job %s, exporting with ordinary requests: %s", job.id, str(e))
+            return client
+        job.takeout = True
+        return takeout
+
+    async def _export_channel(self, job: ExportJob, client: TelegramClient, channel: ChannelProgress) -> None:
+        messages, lowest_id = [], channel.offset_id
+        channel.error = None
+        try:
+            async for result in iter_history_pages(
+                client, UUID(job.user_id), channel.telegram_id, max_id=channel.offset_id, priority=Priority.BACKGROUND,
+            ):
+                for message in result.messages:
+                    messages.append(project_message(message, EXPORT_FIELDS))
+                    lowest_id = message.id
+                # A chunk always ends with a whole page, so the offset is exact
+                if len(messages) >= self._chunk_size:
+                    await self._write_chunk(job, channel, messages, lowest_id)
+                    messages = []
+            if messages:
+                await self._write_chunk(job, channel, messages, lowest_id)
+        except Exception as e:
+            logger.error("Failed to export channel %s for job %s: %s", channel.telegram_id, job.id, str(e))
+            channel.error = str(e)
+            return
+        channel.done = True
+        await self._save(job)
+
+    async def _write_chunk(
+        self, job: ExportJob, channel: ChannelProgress, messages: list[dict], lowest_id: int,
+    ) -> None:
+        name = f"{UNSAFE_CHARACTERS_RE.sub('_', channel.telegram_id)}-{channel.chunks:05d}.ndjson.gz"
+        file = self._path / job.id / name
+
+        def write() -> None:
+            data = "".join(json.dumps(message, ensure_ascii=False) + "\n" for message in messages)
+            file.parent.mkdir(parents=True, exist_ok=True)
+            temporary = file.with_name(file.name + ".tmp")
+            temporary.write_bytes(gzip.compress(data.encode()))
+            temporary.replace(file)
+
+        await asyncio.to_thread(write)
+        channel.chunks += 1
+        channel.messages += len(messages)
+        channel.offset_id = lowest_id
+        await self._save(job)
+
+    async def _save(self, job: ExportJob) -> None:
+        file = self._path / job.id / "job.json"
+        data = json.dumps(asdict(job))
+
+        def write() -> None:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            temporary = file.with_name(file.name + ".tmp")
+            temporary.write_text(data)
+            temporary.replace(file)
+
+        await asyncio.to_thread(write)
+
+
+export_jobs = ExportManager(
+    path=settings.EXPORT_PATH,
+    chunk_size=settings.EXPORT_CHUNK_SIZE,
+    concurrency=settings.EXPORT_CONCURRENCY,
+    use_takeout=settings.EXPORT_USE_TAKEOUT,
+)
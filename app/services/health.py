@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, UnauthorizedError
+from telethon.tl.functions import PingRequest
+
+from app.config import settings
+from app.metrics import client_health_reconnects
+from app.services.scheduler import Priority, scheduler
+from app.services.updates import update_dispatcher
+from app.storage import storage
+
+logger = logging.getLogger(__name__)
+
+HEALTHY = "healthy"
+RECONNECTING = "reconnecting"
+DEAD = "dead"
+
+
+@dataclass
+class ClientHealth:
+    client: TelegramClient
+    state: str = HEALTHY
+    attempts: int = 0  # Failed reconnects in a row
+    retry_at: float = 0.0  # Monotonic time of the next reconnect attempt
+    checked_at: float = 0.0
+    revoked: bool = False  # The auth key is no longer valid, only a new sign in helps
+    error: str | None = None
+
+
+class HealthMonitor:
+    """
+    Watches the MTProto connection of the active clients in the background.
+
+    The active clients are pinged spread evenly over the interval, without waiting for
+    the previous ping. Pings only take from their client's rate limit, not from the
+    process-wide budget, and a client which has successfully called Telegram within the
+    interval is not pinged at all. The ping timeout only covers the RPC, not the rate limit
+    waits, and a client deferred by a FloodWait is alive as Telegram has just answered it.
+    A client which is disconnected or doesn't answer is reconnected with a jittered
+    exponential backoff and is dead once the attempts are exhausted; every following
+    walk makes one more attempt. A client whose auth key has been revoked is dead at
+    once and evicted from the storage unless eviction is disabled.
+    Request handlers check the state first, so they fail fast instead of waiting
+    for a connection which is not there.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        ping_timeout: float,
+        base_delay: float,
+        max_delay: float,
+        max_attempts: int,
+        evict_revoked: bool,
+    ):
+        self._interval = interval
+        self._ping_timeout = ping_timeout
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._max_attempts = max_attempts
+        self._evict_revoked = evict_revoked
+
+        self._health: dict[UUID, ClientHealth] = {}
+        self._worker: asyncio.Task | None = None
+        self._checks: dict[UUID, asyncio.Task] = {}
+        self._reconnects: dict[UUID, asyncio.Task] = {}
+        self._reconnected = 0
+        self._reconnect_failures = 0
+        self._revoked = 0
+
+    def get(self, user_id: UUID, client: TelegramClient) -> ClientHealth | None:
+        """
+        Return the health of the client, or None if it hasn't been found unhealthy.
+        The state of a replaced client is not carried over to the new one.
+        """
+        health = self._health.get(user_id)
+        if health is None or health.client is not client or health.state == HEALTHY:
+            return None
+        return health
+
+    def stats(self) -> dict:
+        """
+        Return the number of clients in every state and the reconnect counters.
+        """
+        states = {HEALTHY: 0, RECONNECTING: 0, DEAD: 0}
+        for health in self._health.values():
+            states[health.state] += 1
+        return {
+            **states,
+            "reconnected": self._reconnected,
+            "reconnect_failures": self._reconnect_failures,
+            "revoked": self._revoked,
+        }
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), name="client-health-monitor")
+
+    async def stop(self) -> None:
+        tasks = [self._worker] if self._worker is not None else []
+        tasks += [*self._checks.values(), *self._reconnects.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+        self._checks.clear()
+        self._reconnects.clear()
+
+    async def check(self, user_id: UUID, client: TelegramClient) -> str:
+        """
+        Ping the client and start reconnecting it if the connection is gone.
+        Return the state of the client.
+        """
+        health = self._health.get(user_id)
+        if health is None or health.client is not client:
+            health = self._health[user_id] = ClientHealth(client)
+        if user_id in self._reconnects or health.revoked:
+            return health.state
+
+        health.checked_at = time.monotonic()
+        try:
+            if not client.is_connected():
+                raise ConnectionError("Client is disconnected.")
+            if health.checked_at - scheduler.answered_at(client) >= self._interval:
+                await self._ping(client)
+        except UnauthorizedError as e:
+            self._revoke(user_id, health, e)
+        except Exception as e:
+            logger.warning("Client of user %s failed the health check: %s", user_id, repr(e))
+            health.state, health.error = RECONNECTING, repr(e)
+            self._reconnects[user_id] = asyncio.create_task(self._reconnect(user_id, health))
+        else:
+            health.state, health.attempts, health.error = HEALTHY, 0, None
+        return health.state
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            snapshot = storage.active_clients()
+            active = {user_id for user_id, _ in snapshot}
+            for user_id in [user_id for user_id in self._health if user_id not in active]:
+                del self._health[user_id]
+
+            # Stagger the pings over the interval instead of pinging all clients at once.
+            # A slow ping must not hold up the walk, so every check runs in its own task.
+            step = self._interval / max(1, len(snapshot))
+            for index, (user_id, client) in enumerate(snapshot):
+                delay = started + index * step - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if user_id in self._checks:
+                    continue
+                if storage.get_active_client(user_id, raise_exc=False, touch=False) is client:
+                    task = self._checks[user_id] = asyncio.create_task(self._check(user_id, client))
+                    task.add_done_callback(lambda _, user_id=user_id: self._checks.pop(user_id, None))
+            await asyncio.sleep(max(0.0, started + self._interval - time.monotonic()))
+
+    async def _check(self, user_id: UUID, client: TelegramClient) -> None:
+        try:
+            await self.check(user_id, client)
+        except Exception as e:
+            logger.error("Failed to check the client of user %s: %s", user_id, str(e))
+
+    async def _reconnect(self, user_id: UUID, health: ClientHealth) -> None:
+        client = health.client
+        try:
+            while True:
+                # Exponential backoff with jitter, so clients of a lost DC don't reconnect in lockstep
+                delay = min(self._max_delay, self._base_delay * 2 ** health.attempts)
+                delay = random.uniform(delay / 2, delay)
+                health.retry_at = time.monotonic() + delay
+                await asyncio.sleep(delay)
+                if health.client is not storage.get_active_client(user_id, raise_exc=False, touch=False):
+                    return  # The client has been replaced or removed meanwhile
+
+                try:
+                    await client.disconnect()
+                    await client.connect()
+                    await self._ping(client)
+                except UnauthorizedError as e:
+                    self._revoke(user_id, health, e)
+                    return
+                except Exception as e:
+                    health.attempts += 1
+                    health.error = repr(e)
+                    self._reconnect_failures += 1
+                    client_health_reconnects.inc("failed")
+                    logger.warning(
+                        "Reconnect %s of the client of user %s failed: %s", health.attempts, user_id, repr(e),
+                    )
+                    if health.attempts >= self._max_attempts:
+                        health.state = DEAD
+                        logger.error("Client of user %s is dead after %s reconnects.", user_id, health.attempts)
+                        return
+                else:
+                    health.state, health.attempts, health.error = HEALTHY, 0, None
+                    self._reconnected += 1
+                    client_health_reconnects.inc("ok")
+                    logger.info("Client of user %s has been reconnected.", user_id)
+                    return
+        finally:
+            self._reconnects.pop(user_id, None)
+
+    async def _ping(self, client: TelegramClient) -> None:
+        """
+        Ping the client through the scheduler, raise if it doesn't answer within the timeout.
+        The ping is not shared, so health checks don't delay the other calls.
+        """
+        if scheduler.flood_wait(client) > 0:
+            return
+
+        async def ping() -> None:
+            await asyncio.wait_for(client(PingRequest(ping_id=random.getrandbits(63))), self._ping_timeout)
+
+        try:
+            await scheduler.call(client, ping, priority=Priority.BACKGROUND, shared=False)
+        except FloodWaitError:
+            pass  # Too long to wait for, but an answer of Telegram all the same
+
+    def _revoke(self, user_id: UUID, health: ClientHealth, error: Exception) -> None:
+        health.state, health.revoked, health.error = DEAD, True, repr(error)
+        self._revoked += 1
+        logger.error("Auth key of user %s has been revoked: %s", user_id, repr(error))
+        if not self._evict_revoked:
+            return
+        if storage.get_active_client(user_id, raise_exc=False, touch=False) is not health.client:
+            return
+
+        # The session is worthless, so it is not checkpointed
+        update_dispatcher.unsubscribe(user_id)
+        storage.remove_active_client(user_id)
+        self._health.pop(user_id, None)
+        task = asyncio.create_task(health.client.disconnect())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+health_monitor = HealthMonitor(
+    interval=settings.HEALTH_CHECK_INTERVAL,
+    ping_timeout=settings.HEALTH_PING_TIMEOUT,
+    base_delay=settings.HEALTH_RECONNECT_BASE_DELAY,
+    max_delay=settings.HEALTH_RECONNECT_MAX_DELAY,
+    max_attempts=settings.HEALTH_RECONNECT_MAX_ATTEMPTS,
+    evict_revoked=settings.HEALTH_EVICT_REVOKED,
+)
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any
+from uuid import UUID
+
+from app.config import settings
+from app.metrics import message_index_dropped
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r"\s+")
+MAX_WRITE_ATTEMPTS = 3
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash of the normalized text, equal for reposts of the same vacancy.
+    """
+    return hashlib.sha1(WHITESPACE_RE.sub(" ", text).strip().lower().encode()).hexdigest()
+
+
+def match_expression(query: str) -> str:
+    """
+    Turn free text into an FTS5 expression matching all of its words.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+class MessageIndex:
+    """
+    Local full-text index of collected channel messages stored in SQLite FTS5.
+
+    Messages are keyed by (user_id, telegram_id, message_id). Writes are buffered and
+    applied in one transaction once a batch is collected or the flush interval passes.
+    Rows of a failed write are written again with the next batch, and dropped after
+    MAX_WRITE_ATTEMPTS failures. The database is opened on first use. The blocking
+    queries run in a thread.
+    """
+
+    def __init__(self, path: str, batch_size: int, flush_interval: float):
+        self._path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._pending: list[tuple] = []
+        self._failed: list[tuple] = []  # Rows of the last failed write
+        self._failed_attempts = 0
+        self._batch_ready = asyncio.Event()
+        self._writer: asyncio.Task | None = None
+
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+        self.write_failures = 0
+        self.dropped = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return the connection, opening the database first if needed. Called with the lock held.
+        """
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, check_same_thread=False, timeout=30, isolation_level=None)
+            if self._path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    user_id TEXT NOT NULL,
+                    telegram_id TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    date REAL NOT NULL,
+                    text TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    PRIMARY KEY (user_id, telegram_id, message_id)
+                );
+                CREATE INDEX IF NOT EXISTS messages_user_date ON messages (user_id, date);
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                    text, content='messages', content_rowid='rowid'
+                );
+                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) + len(self._failed)
+
+    def add(self, user_id: UUID, telegram_id: str, messages: list[Any]) -> None:
+        """
+        Buffer the text messages of the channel for indexing. Edited messages replace the old text.
+        """
+        for message in messages:
+            text = getattr(message, "message", None)
+            if not text or message.date is None:
+                continue
+            self._pending.append(
+                (str(user_id), telegram_id, message.id, message.date.timestamp(), text, text_hash(text))
+            )
+
+        if len(self._pending) >= self._batch_size:
+            self._batch_ready.set()
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_forever(), name="message-index-writer")
+
+    async def stop(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+            self._writer = None
+        try:
+            await self.flush()
+        finally:
+            with self._lock:
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+
+    async def flush(self) -> None:
+        """
+        Write all the buffered messages in one transaction, with the rows of the last failed write.
+        """
+        if not self._pending and not self._failed:
+            return
+
+        rows, self._failed, self._pending = self._failed + self._pending, [], []
+
+        def write() -> None:
+            with self._lock:
+                connection = self._connect()
+                connection.execute("BEGIN")
+                try:
+                    connection.executemany(
+                        "INSERT INTO messages (user_id, telegram_id, message_id, date, text, text_hash) "
+                        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (user_id, telegram_id, message_id) DO UPDATE "
+                        "SET text = excluded.text, text_hash = excluded.text_hash "
+                        "WHERE text != excluded.text",
+                        rows,
+                    )
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+
+        try:
+            await asyncio.to_thread(write)
+        except asyncio.CancelledError:
+            # Written again by the flush on stop, the upsert makes it harmless if it went through
+            self._failed = rows
+            raise
+        except Exception:
+            self.write_failures += 1
+            self._failed_attempts += 1
+            if self._failed_attempts < MAX_WRITE_ATTEMPTS:
+                self._failed = rows
+            else:
+                self._failed_attempts = 0
+                self.dropped += len(rows)
+                message_index_dropped.inc(value=len(rows))
+                logger.error("Dropped %s messages after %s failed index writes", len(rows), MAX_WRITE_ATTEMPTS)
+            raise
+        self._failed_attempts = 0
+        logger.debug("Indexed %s messages", len(rows))
+
+    async def search(
+        self,
+        user_id: UUID,
+        query: str,
+        telegram_ids: list[str] | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+        order: str = "rank",
+        dedup: bool = True,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> list[dict]:
+        """
+        Search the user's indexed messages. Results are ordered by relevance (bm25) or date.
+        With dedup, reposts of the same text are collapsed into the newest one.
+        A query without words matches nothing.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+
+        conditions, params = ["messages_fts MATCH ?", "m.user_id = ?"], [expression, str(user_id)]
+        if telegram_ids:
+            conditions.append(f"m.telegram_id IN ({', '.join('?' * len(telegram_ids))})")
+            params.extend(telegram_ids)
+        if since is not None:
+            conditions.append("m.date >= ?")
+            params.append(since.timestamp())
+        if until is not None:
+            conditions.append("m.date < ?")
+            params.append(until.timestamp())
+
+        sql = f"""
+            WITH hits AS (
+                SELECT m.telegram_id, m.message_id, m.date, m.text, m.text_hash,
+                       snippet(messages_fts, 0, '[', ']', '...', 16) AS snippet,
+                       bm25(messages_fts) AS rank
+                FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+                WHERE {' AND '.join(conditions)}
+            ), ranked AS (
+                SELECT *,
+                       ROW_NUMBER() OVER (PARTITION BY text_hash ORDER BY date DESC) AS copy,
+                       COUNT(*) OVER (PARTITION BY text_hash) AS copies
+                FROM hits
+            )
+            SELECT telegram_id, message_id, date, text, snippet, rank, copies
+            FROM ranked {'WHERE copy = 1' if dedup else ''}
+            ORDER BY {'rank' if order == 'rank' else 'date DESC'}
+            LIMIT ? OFFSET ?
+        """
+        params.extend([limit, offset])
+
+        def query_rows() -> list[tuple]:
+            with self._lock:
+                return self._connect().execute(sql, params).fetchall()
+
+        rows = await asyncio.to_thread(query_rows)
+        return [
+            {
+                "telegram_id": telegram_id,
+                "id": message_id,
+                "date": datetime.fromtimestamp(date, timezone.utc).isoformat(),
+                "text": text,
+                "snippet": snippet,
+                "rank": rank,
+                "copies": copies,
+            }
+            for telegram_id, message_id, date, text, snippet, rank, copies in rows
+        ]
+
+    async def _write_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Failed to write messages to the index: %s", str(e))
+
+
+message_index = MessageIndex(
+    path=settings.MESSAGE_INDEX_PATH,
+    batch_size=settings.MESSAGE_INDEX_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_INDEX_FLUSH_INTERVAL,
+)
@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import os
+import pathlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import IO, Any, AsyncIterator
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.tl.types import (
+    Document,
+    DocumentAttributeFilename,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    Photo,
+    PhotoCachedSize,
+    PhotoSize,
+    PhotoSizeProgressive,
+    PhotoStrippedSize,
+)
+
+from app.config import settings
+from app.services.entities import entity_cache
+from app.services.scheduler import Priority, scheduler
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+
+
+@dataclass
+class MediaFile:
+    key: str  # Telegram file id, the same for every account the file is shared to
+    size: int
+    mime_type: str
+    file_name: str | None
+    location: Document | Photo  # Bound to the account, used only to download the file
+
+
+def photo_size(photo: Photo) -> int:
+    """
+    Size in bytes of the largest photo size, the one Telethon downloads.
+    """
+    size = photo.sizes[-1]
+    if isinstance(size, PhotoSize):
+        return size.size
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes)
+    if isinstance(size, (PhotoCachedSize, PhotoStrippedSize)):
+        return len(size.bytes)
+    return 0
+
+
+def media_file(message: Any) -> MediaFile | None:
+    """
+    Describe the document or photo of the message, or return None if it has no downloadable media.
+    """
+    media = getattr(message, "media", None)
+    if isinstance(media, MessageMediaDocument) and isinstance(media.document, Document):
+        document = media.document
+        file_name = next(
+            (
+                attribute.file_name for attribute in document.attributes
+                if isinstance(attribute, DocumentAttributeFilename)
+            ),
+            None,
+        )
+        return MediaFile(f"document-{document.id}", document.size, document.mime_type, file_name, document)
+    if isinstance(media, MessageMediaPhoto) and isinstance(media.photo, Photo) and media.photo.sizes:
+        photo = media.photo
+        return MediaFile(f"photo-{photo.id}-{photo.sizes[-1].type}", photo_size(photo), "image/jpeg", None, photo)
+    return None
+
+
+async def get_media_file(
+    client: TelegramClient,
+    user_id: UUID,
+    telegram_id: str,
+    message_id: int,
+    priority: Priority = Priority.INTERACTIVE,
+) -> MediaFile | None:
+    """
+    Fetch the message from the channel and describe its media.
+    """
+    peer = await entity_cache.resolve(client, user_id, telegram_id, priority)
+    message = await scheduler.call(client, client.get_messages, peer, ids=message_id, priority=priority)
+    return media_file(message) if message else None
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single "bytes=start-end" Range header into inclusive byte positions.
+    Return None for a missing or malformed header, so the whole file is sent,
+    and raise ValueError if the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    if not (start or end) or not all(part.isdigit() for part in (start, end) if part):
+        return None
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+
+    first, last = int(start), int(end) if end else size - 1
+    if first >= size or last < first:
+        raise ValueError("Unsatisfiable range")
+    return first, min(last, size - 1)
+
+
+class MediaCache:
+    """
+    Size-bounded on-disk cache of downloaded media, evicted in LRU order.
+
+    Files are keyed by the Telegram file id, so an attachment shared to many users is
+    downloaded from Telegram once. A file is cached while it is streamed to the first
+    client requesting it whole; concurrent and partial requests of an uncached file are
+    streamed straight from Telegram. Every chunk fetched from Telegram goes through the
+    scheduler. The blocking file operations run in a thread.
+    """
+
+    def __init__(self, path: str, max_bytes: int, chunk_size: int):
+        self._path = pathlib.Path(path)
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self._entries: OrderedDict[str, int] = OrderedDict()  # {key: size} from LRU to MRU
+        self._total = 0
+        self._downloading: set[str] = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def stats(self) -> dict:
+        """
+        Return the current cache size and the hit counters.
+        """
+        return {
+            "files": len(self._entries),
+            "bytes": self._total,
+            "max_bytes": self._max_bytes,
+            "downloading": len(self._downloading),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+    def load(self) -> None:
+        """
+        Index the files left by the previous run from the least to the most recently used one.
+        Partial downloads are removed.
+        """
+        self._path.mkdir(parents=True, exist_ok=True)
+        files = []
+        for file in self._path.iterdir():
+            if file.name.endswith(PART_SUFFIX):
+                file.unlink(missing_ok=True)
+            elif file.is_file():
+                stat = file.stat()
+                files.append((stat.st_mtime, file.name, stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+        self._evict()
+        logger.info("Media cache holds %s files, %s bytes", len(self._entries), self._total)
+
+    async def stream(
+        self,
+        client: TelegramClient,
+        media: MediaFile,
+        start: int,
+        end: int,
+    ) -> AsyncIterator[bytes]:
+        """
+        Yield the bytes start..end (inclusive) of the media, from the cache if possible.
+        """
+        file = None
+        if media.key in self._entries:
+            try:
+                file = await asyncio.to_thread(open, self._path / media.key, "rb")
+            except FileNotFoundError:
+                self._forget(media.key)
+
+        whole = start == 0 and end == media.size - 1
+        if file is not None:
+            self.hits += 1
+            self._entries.move_to_end(media.key)
+            chunks = self._read(file, start, end)
+        elif whole and media.size <= self._max_bytes and media.key not in self._downloading:
+            self.misses += 1
+            chunks = self._download_to_cache(client, media)
+        else:
+            self.misses += 1
+            chunks = self._download(client, media, start, end)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def _read(self, file: IO[bytes], start: int, end: int) -> AsyncIterator[bytes]:
+        try:
+            await asyncio.to_thread(file.seek, start)
+            # Touch the file, so the LRU order survives a restart
+            await asyncio.to_thread(os.utime, file.fileno())
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(file.read, min(self._chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(file.close)
+
+    async def _download(self, client: TelegramClient, media: MediaFile, start: int, end: int) -> AsyncIterator[bytes]:
+        # Telegram serves chunks at offsets divisible by the chunk size, so the first one is trimmed
+        offset = start - start % self._chunk_size
+        chunks = client.iter_download(
+            media.location,
+            offset=offset,
+            limit=(end - offset) // self._chunk_size + 1,
+            request_size=self._chunk_size,
+            file_size=media.size,
+        )
+
+        async def download_chunk() -> bytes | None:
+            try:
+                return await chunks.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        position = offset
+        try:
+            # Each step of the iterator is one GetFileRequest, so each one takes a token
+            while (chunk := await scheduler.call(client, download_chunk)) is not None:
+                low, high = max(start - position, 0), min(end + 1 - position, len(chunk))
+                position += len(chunk)
+                if low < high:
+                    yield bytes(chunk[low:high])
+                if position > end:
+                    break
+        finally:
+            # Release the download sender also when the consumer has gone
+            await chunks.close()
+
+    async def _download_to_cache(self, client: TelegramClient, media: MediaFile) -> AsyncIterator[bytes]:
+        self._downloading.add(media.key)
+        part = self._path / (media.key + PART_SUFFIX)
+        file = None
+        try:
+            await asyncio.to_thread(self._path.mkdir, parents=True, exist_ok=True)
+            file = await asyncio.to_thread(open, part, "wb")
+            written = 0
+            async for chunk in self._download(client, media, 0, media.size - 1):
+                await asyncio.to_thread(file.write, chunk)
+                written += len(chunk)
+                yield chunk
+            await asyncio.to_thread(file.close)
+            if written != media.size:
+                logger.warning("Media %s has %s bytes instead of %s, not cached", media.key, written, media.size)
+                return
+            await asyncio.to_thread(part.replace, self._path / media.key)
+            self._add(media.key, media.size)
+        finally:
+            self._downloading.discard(media.key)
+            if file is not None and not file.closed:
+                # The consumer has gone or the download failed: drop the partial file
+                await asyncio.shield(asyncio.to_thread(file.close))
+            await asyncio.shield(asyncio.to_thread(part.unlink, missing_ok=True))
+
+    def _add(self, key: str, size: int) -> None:
+        self._forget(key)
+        self._entries[key] = size
+        self._total += size
+        self._evict()
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total -= size
+
+    def _evict(self) -> None:
+        while self._total > self._max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            self.evicted += 1
+            # Readers of the evicted file keep their open descriptors
+            (self._path / key).unlink(missing_ok=True)
+
+
+media_cache = MediaCache(
+    path=settings.MEDIA_CACHE_PATH,
+    max_bytes=settings.MEDIA_CACHE_MAX_BYTES,
+    chunk_size=settings.MEDIA_CHUNK_SIZE,
+)
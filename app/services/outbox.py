@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError, PeerFloodError
+
+from app.config import settings
+from app.metrics import outbox_messages
+from app.models import OutboundMessage
+from app.services.entities import entity_cache
+from app.services.scheduler import Priority, TokenBucket, scheduler
+from app.storage import storage
+
+logger = logging.getLogger(__name__)
+
+TEXT_LIMIT = 4096  # Characters of one Telegram message
+CAPTION_LIMIT = 1024  # Characters of the caption of a media
+COALESCE_SEPARATOR = "\n\n"
+FINISHED = ("sent", "failed", "rejected")
+
+
+@dataclass
+class OutboundJob:
+    id: str
+    user_id: str
+    peer: str
+    text: str | None
+    file: str | None
+    coalesce: bool
+    status: str = "queued"  # queued, sending, sent, failed or rejected
+    message_id: int | None = None
+    coalesced_with: str | None = None  # Job whose message carried this one's text
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    def progress(self) -> dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "peer": self.peer,
+            "status": self.status,
+            "message_id": self.message_id,
+            "coalesced_with": self.coalesced_with,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class _Account:
+    def __init__(self, rate: float, burst: float):
+        self.queue: deque[OutboundJob] = deque()
+        self.bucket = TokenBucket(rate, burst)
+        self.sent_at: dict[str, float] = {}  # {peer: monotonic time of the last message}
+        self.peers: dict[str, Any] = {}  # {peer: resolved input peer}
+        self.worker: asyncio.Task | None = None
+
+
+class Outbox:
+    """
+    Sends batches of outbound messages in the background.
+
+    Every account has its own FIFO queue drained by one worker, with its own rate budget
+    and a minimal interval between two messages to the same peer, on top of the limits
+    of the scheduler. Consecutive texts to the same peer are coalesced into one message
+    when the jobs allow it and the result fits a Telegram message. A long FloodWait pauses
+    the account's queue, and a PeerFlood (spam limit) fails its queued jobs, as going on
+    would get the account restricted. The workers exit once their queue is empty, and an
+    idle account is dropped once its budget has refilled. Finished jobs are kept for the
+    job TTL so their status can be polled.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        peer_interval: float,
+        queue_limit: int,
+        job_ttl: float,
+        max_flood_wait: float,
+    ):
+        self._rate = rate
+        self._burst = burst
+        self._peer_interval = peer_interval
+        self._queue_limit = queue_limit
+        self._job_ttl = job_ttl
+        self._max_flood_wait = max_flood_wait
+
+        self._accounts: dict[str, _Account] = {}  # {user_id: account}
+        self._jobs: OrderedDict[str, OutboundJob] = OrderedDict()
+        self._finished: OrderedDict[str, float] = OrderedDict()  # {job id: finished_at} in finishing order
+
+        self._coalesced = 0
+
+    def get(self, user_id: UUID, job_id: str) -> OutboundJob | None:
+        """
+        Return the job of the account, or None if it is unknown or belongs to another account.
+        """
+        job = self._jobs.get(job_id)
+        return job if job is not None and job.user_id == str(user_id) else None
+
+    def stats(self) -> dict:
+        """
+        Return the number of jobs by status and the queue depth of the accounts.
+        """
+        statuses = {}
+        for job in self._jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "jobs": statuses,
+            "accounts": sum(account.worker is not None for account in self._accounts.values()),
+            "queued_max": max((len(account.queue) for account in self._accounts.values()), default=0),
+            "coalesced": self._coalesced,
+        }
+
+    def submit(self, messages: list[OutboundMessage]) -> list[OutboundJob]:
+        """
+        Queue the messages and return their jobs in the same order.
+        A message whose id is a known job of its account is not queued again, its job
+        is returned, so a batch can be resubmitted safely. If an id is used by another
+        account, ValueError is raised and nothing is queued. Jobs which can't be sent,
+        such as a media with a caption over CAPTION_LIMIT, are returned rejected.
+        """
+        self._prune()
+        owners = {}  # {job id: user_id} of the new jobs of the batch
+        for message in messages:
+            if not message.id:
+                continue
+            job = self._jobs.get(message.id)
+            owner = job.user_id if job is not None else owners.setdefault(message.id, str(message.user_id))
+            if owner != str(message.user_id):
+                raise ValueError(f"Job id {message.id} is used by another account.")
+
+        jobs = []
+        for message in messages:
+            job = self._jobs.get(message.id) if message.id else None
+            if job is None:
+                job = OutboundJob(
+                    id=message.id or str(uuid.uuid4()),
+                    user_id=str(message.user_id),
+                    peer=message.peer,
+                    text=message.text,
+                    file=message.file,
+                    coalesce=message.coalesce,
+                )
+                self._jobs[job.id] = job
+                self._enqueue(job)
+            jobs.append(job)
+        return jobs
+
+    async def stop(self) -> None:
+        """
+        Stop the workers. The unfinished jobs are lost and are reported as failed.
+        """
+        tasks = [account.worker for account in self._accounts.values() if account.worker is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        dropped = [job for job in self._jobs.values() if job.status not in FINISHED]
+        for job in dropped:
+            self._finish(job, "failed", error="Service has been stopped.")
+        self._accounts.clear()
+        if dropped:
+            logger.warning("%s outbound messages have been dropped on shutdown.", len(dropped))
+
+    def _enqueue(self, job: OutboundJob) -> None:
+        if job.file is not None and job.text and len(job.text) > CAPTION_LIMIT:
+            self._finish(job, "rejected", error=f"Caption is longer than {CAPTION_LIMIT} characters.")
+            return
+
+        account = self._accounts.get(job.user_id)
+        if account is None:
+            account = self._accounts[job.user_id] = _Account(self._rate, self._burst)
+        if len(account.queue) >= self._queue_limit:
+            self._finish(job, "rejected", error="Queue of the account is full.")
+            return
+
+        account.queue.append(job)
+        if account.worker is None:
+            account.worker = asyncio.create_task(self._run(job.user_id, account), name=f"outbox-{job.user_id}")
+
+    async def _run(self, user_id: str, account: _Account) -> None:
+        try:
+            while account.queue:
+                # Wait for the budget before taking the jobs, so texts queued meanwhile are coalesced too
+                peer = account.queue[0].peer
+                delay = max(
+                    account.bucket.reserve(),
+                    account.sent_at.get(peer, float("-inf")) + self._peer_interval - time.monotonic(),
+                )
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                batch = self._take(account)
+                for job in batch:
+                    job.status = "sending"
+                try:
+                    message = await self._send(user_id, account, batch)
+                except PeerFloodError as e:
+                    logger.error("Account of user %s has hit the spam limit. Its queue is dropped.", user_id)
+                    for job in batch + list(account.queue):
+                        self._finish(job, "failed", error=repr(e))
+                    account.queue.clear()
+                except Exception as e:
+                    logger.error("Failed to send %s messages of user %s to %s: %s", len(batch), user_id, peer, repr(e))
+                    for job in batch:
+                        self._finish(job, "failed", error=repr(e))
+                else:
+                    for job in batch:
+                        job.message_id = getattr(message, "id", None)
+                        job.coalesced_with = batch[0].id if job is not batch[0] else None
+                        self._finish(job, "sent")
+                    self._coalesced += len(batch) - 1
+        finally:
+            account.worker = None
+
+    def _take(self, account: _Account) -> list[OutboundJob]:
+        """
+        Pop the next job and the following texts to the same peer which can be sent with it.
+        """
+        head = account.queue.popleft()
+        batch = [head]
+        if head.file is not None or not head.coalesce:
+            return batch
+
+        length = len(head.text)
+        while account.queue:
+            job = account.queue[0]
+            if job.peer != head.peer or job.file is not None or not job.coalesce:
+                break
+            length += len(COALESCE_SEPARATOR) + len(job.text)
+            if length > TEXT_LIMIT:
+                break
+            batch.append(account.queue.popleft())
+        return batch
+
+    async def _send(self, user_id: str, account: _Account, batch: list[OutboundJob]) -> Any:
+        head = batch[0]
+        text = COALESCE_SEPARATOR.join(job.text for job in batch if job.text)
+        client = await storage.acquire_active_client(UUID(user_id))
+        with storage.lease(UUID(user_id)):
+            peer = await self._resolve(client, user_id, account, head.peer)
+            while True:
+                try:
+                    if head.file is not None:
+                        message = await scheduler.call(
+                            client, client.send_file, peer, head.file, caption=text or None,
+                            priority=Priority.BACKGROUND,
+                        )
+                    else:
+                        message = await scheduler.call(
+                            client, client.send_message, peer, text, priority=Priority.BACKGROUND,
+                        )
+                except FloodWaitError as e:
+                    # Longer than the scheduler defers by itself, but a background queue can afford it
+                    if e.seconds > self._max_flood_wait:
+                        raise
+                    logger.warning("FloodWait of %s seconds on the outbox of user %s.", e.seconds, user_id)
+                    await asyncio.sleep(e.seconds)
+                else:
+                    account.sent_at[head.peer] = time.monotonic()
+                    return message
+
+    @staticmethod
+    async def _resolve(client: TelegramClient, user_id: str, account: _Account, peer: str) -> Any:
+        if peer == "me":
+            return peer
+        resolved = account.peers.get(peer)
+        if resolved is None:
+            resolved = account.peers[peer] = await entity_cache.resolve(
+                client, UUID(user_id), peer, priority=Priority.BACKGROUND,
+            )
+        return resolved
+
+    def _finish(self, job: OutboundJob, status: str, error: str | None = None) -> None:
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        self._finished[job.id] = job.finished_at
+        outbox_messages.inc(status)
+
+    def _prune(self) -> None:
+        # Finished jobs are in finishing order, so stop at the first recent one.
+        # Unfinished jobs are not in there, so a job waiting out a FloodWait doesn't hold up the rest.
+        now = time.time()
+        while self._finished:
+            job_id, finished_at = next(iter(self._finished.items()))
+            if now - finished_at <= self._job_ttl:
+                break
+            del self._finished[job_id]
+            del self._jobs[job_id]
+
+        # An account is only worth keeping while its budget and peer intervals still apply
+        settled = time.monotonic() - max(self._peer_interval, self._burst / self._rate)
+        for user_id, account in list(self._accounts.items()):
+            if account.worker is None and not account.queue and max(account.sent_at.values(), default=0) < settled:
+                del self._accounts[user_id]
+
+
+outbox = Outbox(
+    rate=settings.OUTBOX_RATE,
+    burst=settings.OUTBOX_BURST,
+    peer_interval=settings.OUTBOX_PEER_INTERVAL,
+    queue_limit=settings.OUTBOX_QUEUE_LIMIT,
+    job_ttl=settings.OUTBOX_JOB_TTL,
+    max_flood_wait=settings.OUTBOX_MAX_FLOOD_WAIT,
+)
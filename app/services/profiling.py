@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+
+from app.config import settings
+from app.metrics import event_loop_lag, event_loop_stalls
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_stack(frame: FrameType) -> str:
+    """
+    Return the stack of the frame in the collapsed format of flame graphs,
+    from the outermost call to the innermost one: "module:function;module:function".
+    """
+    calls = []
+    while frame is not None:
+        calls.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs its callbacks.
+
+    A heartbeat task sleeps for the interval and records how much later than that it
+    wakes up. A watchdog thread checks the last heartbeat, and when the loop has been
+    blocked for longer than the threshold, it logs the stack the loop thread is stuck
+    in, once per stall. Both cost a few operations per interval.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self._interval = interval
+        self._threshold = threshold
+        self._loop_thread: int | None = None
+        self._beat = 0.0  # Monotonic time of the last heartbeat
+        self._reported_beat = 0.0  # Heartbeat of the last stall logged
+        self._heartbeat: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+        self._lag_max = 0.0
+        self._lag_total = 0.0
+        self._beats = 0
+        self._stalls = 0
+        self._last_stall: dict | None = None
+        self._profiling = asyncio.Lock()
+
+    @property
+    def loop_thread(self) -> int | None:
+        return self._loop_thread
+
+    def stats(self) -> dict:
+        """
+        Return the lag of the event loop and the last stall with its stack.
+        """
+        return {
+            "interval": self._interval,
+            "threshold": self._threshold,
+            "lag_seconds_avg": self._lag_total / self._beats if self._beats else 0.0,
+            "lag_seconds_max": self._lag_max,
+            "stalls": self._stalls,
+            "last_stall": self._last_stall,
+        }
+
+    def start(self) -> None:
+        """
+        Start the heartbeat on the running loop and the watchdog thread.
+        """
+        if self._heartbeat is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat = asyncio.create_task(self._run(), name="loop-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def profile(self, seconds: float, interval: float, all_threads: bool = False) -> Counter:
+        """
+        Sample the stack of the loop thread, or of every thread, every interval for the given
+        number of seconds, and return the number of samples of every collapsed stack.
+        The sampling runs in a thread, so the loop keeps serving requests meanwhile.
+        Only one profile runs at a time, RuntimeError is raised for the others.
+        """
+        if self._profiling.locked():
+            raise RuntimeError("A profile is already running.")
+        async with self._profiling:
+            threads = None if all_threads else {self._loop_thread or threading.get_ident()}
+            return await asyncio.to_thread(self._sample, seconds, interval, threads)
+
+    @staticmethod
+    def _sample(seconds: float, interval: float, threads: set[int] | None) -> Counter:
+        own_thread = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread and (threads is None or thread_id in threads):
+                    stacks[collapse_stack(frame)] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self._interval)
+            self._beat = time.monotonic()
+            lag = max(0.0, self._beat - started - self._interval)
+            self._beats += 1
+            self._lag_total += lag
+            self._lag_max = max(self._lag_max, lag)
+            event_loop_lag.observe(lag)
+
+    def _watch(self) -> None:
+        # Checked twice per threshold, so a stall is caught at most half a threshold late
+        while not self._stopped.wait(self._threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self._interval
+            if stalled < self._threshold or beat == self._reported_beat:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self._reported_beat = beat
+            self._stalls += 1
+            event_loop_stalls.inc()
+            stack = "".join(traceback.format_stack(frame))
+            self._last_stall = {"seconds": stalled, "at": time.time(), "stack": collapse_stack(frame)}
+            logger.warning("Event loop has been blocked for %.3f seconds in:\n%s", stalled, stack)
+
+
+loop_monitor = LoopMonitor(interval=settings.LOOP_LAG_INTERVAL, threshold=settings.LOOP_LAG_THRESHOLD)
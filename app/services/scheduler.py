@@ -0,0 +1,235 @@
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from enum import IntEnum
+from typing import Any, Awaitable, Callable
+
+from telethon.errors import FloodWaitError
+
+from app.config import settings
+from app.metrics import telegram_flood_wait_seconds, telegram_rpc_duration, telegram_rpc_errors, telegram_scheduler_wait
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of Telegram requests. Lower values are dispatched first.
+    """
+    INTERACTIVE = 0  # Auth flow, a user is waiting for the response
+    BACKGROUND = 1  # Restores, syncs and other bulk work
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # Tokens per second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """
+        Take a token and return the number of seconds to wait before it can be used.
+        The balance may go negative, so the reservations are served in order.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _ClientState:
+    def __init__(self, rate: float, capacity: float):
+        self.bucket = TokenBucket(rate, capacity)
+        self.flood_until = 0.0  # Monotonic time until which Telegram asked us to wait
+        self.answered_at = 0.0  # Monotonic time of the last successful call
+
+
+class TelegramScheduler:
+    """
+    Shapes the outbound traffic of all Telegram clients.
+
+    Every call waits for a token of its client's bucket and then for a token of the
+    process-wide bucket, which is handed out by priority. A FloodWaitError defers
+    all the following calls of that client by the requested number of seconds,
+    and the failed call is retried instead of failing the request.
+    Calls which are not shared only wait for their client's bucket and FloodWait
+    and don't take from the process-wide budget.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: float,
+        client_rate: float,
+        client_burst: float,
+        max_flood_wait: float,
+    ):
+        self._global = TokenBucket(global_rate, global_burst)
+        self._client_rate = client_rate
+        self._client_burst = client_burst
+        self._max_flood_wait = max_flood_wait
+
+        self._clients: weakref.WeakKeyDictionary[Any, _ClientState] = weakref.WeakKeyDictionary()
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._dispatcher: asyncio.Task | None = None
+
+        self._queued = {priority: 0 for priority in Priority}
+        self._deferred = 0
+        self._calls = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._flood_waits = 0
+        self._flood_wait_seconds = 0.0
+
+    async def call(
+        self,
+        client: Any,
+        method: Callable[..., Awaitable[Any]],
+        *args: Any,
+        priority: Priority = Priority.INTERACTIVE,
+        shared: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Call a method of the Telegram client once the rate limits allow it.
+        """
+        name = getattr(method, "__name__", None) or type(args[0]).__name__
+        state = self._clients.get(client)
+        if state is None:
+            state = self._clients[client] = _ClientState(self._client_rate, self._client_burst)
+
+        while True:
+            started = time.monotonic()
+            await self._wait_for_client(state)
+            if shared:
+                await self._wait_for_global(priority)
+            self._record_wait(time.monotonic() - started)
+            telegram_scheduler_wait.observe(time.monotonic() - started, priority.name.lower())
+
+            called = time.monotonic()
+            try:
+                result = await method(*args, **kwargs)
+                state.answered_at = time.monotonic()
+                return result
+            except FloodWaitError as e:
+                self._flood_waits += 1
+                self._flood_wait_seconds += e.seconds
+                telegram_rpc_errors.inc(name, type(e).__name__)
+                telegram_flood_wait_seconds.inc(name, value=e.seconds)
+                if e.seconds > self._max_flood_wait:
+                    raise
+                logger.warning("FloodWait of %s seconds on %s. The call is deferred.", e.seconds, name)
+                state.flood_until = max(state.flood_until, time.monotonic() + e.seconds)
+            except Exception as e:
+                telegram_rpc_errors.inc(name, type(e).__name__)
+                raise
+            finally:
+                telegram_rpc_duration.observe(time.monotonic() - called, name)
+
+    async def request(self, client: Any, request: Any, priority: Priority = Priority.INTERACTIVE) -> Any:
+        """
+        Send a raw MTProto request through the client once the rate limits allow it.
+        """
+        return await self.call(client, client, request, priority=priority)
+
+    def flood_wait(self, client: Any) -> float:
+        """
+        Return the number of seconds the calls of the client are still deferred for after a FloodWait.
+        """
+        state = self._clients.get(client)
+        return max(0.0, state.flood_until - time.monotonic()) if state is not None else 0.0
+
+    def answered_at(self, client: Any) -> float:
+        """
+        Return the monotonic time of the last successful call of the client, or 0 if there was none.
+        """
+        state = self._clients.get(client)
+        return state.answered_at if state is not None else 0.0
+
+    def stats(self) -> dict:
+        """
+        Return the current queue depth and the accumulated wait times.
+        """
+        return {
+            "queued": {priority.name.lower(): count for priority, count in self._queued.items()},
+            "deferred": self._deferred,
+            "calls": self._calls,
+            "wait_seconds_avg": self._wait_total / self._calls if self._calls else 0.0,
+            "wait_seconds_max": self._wait_max,
+            "flood_waits": self._flood_waits,
+            "flood_wait_seconds": self._flood_wait_seconds,
+        }
+
+    async def stop(self) -> None:
+        """
+        Stop the dispatcher. The calls still waiting for a token fail with RuntimeError.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+
+        while not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Telegram scheduler has been stopped."))
+
+    async def _wait_for_client(self, state: _ClientState) -> None:
+        delay = max(0.0, state.flood_until - time.monotonic()) + state.bucket.reserve()
+        if delay > 0:
+            self._deferred += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._deferred -= 1
+
+    async def _wait_for_global(self, priority: Priority) -> None:
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="telegram-scheduler")
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._sequence), future))
+        self._queued[priority] += 1
+        try:
+            await future
+        finally:
+            self._queued[priority] -= 1
+
+    async def _dispatch(self) -> None:
+        while True:
+            entry = await self._queue.get()
+            future = entry[2]
+            if future.done():  # The caller has been cancelled
+                continue
+
+            delay = self._global.reserve()
+            if delay > 0:
+                try:
+                    await asyncio.sleep(delay)
+                except asyncio.CancelledError:
+                    self._queue.put_nowait(entry)  # Failed by stop() with the rest of the queue
+                    raise
+            if not future.done():
+                future.set_result(None)
+
+    def _record_wait(self, waited: float) -> None:
+        self._calls += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+
+scheduler = TelegramScheduler(
+    global_rate=settings.TG_GLOBAL_RATE,
+    global_burst=settings.TG_GLOBAL_BURST,
+    client_rate=settings.TG_CLIENT_RATE,
+    client_burst=settings.TG_CLIENT_BURST,
+    max_flood_wait=settings.TG_MAX_FLOOD_WAIT,
+)
@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator
+from uuid import UUID
+
+from telethon import TelegramClient
+from telethon.tl.functions.messages import SearchRequest
+from telethon.tl.types import InputMessagesFilterEmpty
+
+from app.config import settings
+from app.models import UserChannel
+from app.services.channels import HISTORY_PAGE_SIZE
+from app.services.entities import entity_cache
+from app.services.scheduler import Priority, scheduler
+
+logger = logging.getLogger(__name__)
+
+_END = object()  # Marks the end of a channel's results in its queue
+
+
+async def search_channel(
+    client: TelegramClient,
+    user_id: UUID,
+    telegram_id: str,
+    query: str,
+    since: datetime | None,
+    until: datetime | None,
+    semaphore: asyncio.Semaphore,
+    page_size: int = HISTORY_PAGE_SIZE,
+) -> AsyncIterator[Any]:
+    """
+    Iterate over the messages of the channel matching the query, from the newest one.
+    Every page request holds the semaphore, so the fan-out over channels stays bounded.
+    """
+    peer = await entity_cache.resolve(client, user_id, telegram_id)
+
+    offset_id = 0
+    while True:
+        async with semaphore:
+            result = await scheduler.request(
+                client,
+                SearchRequest(
+                    peer=peer,
+                    q=query,
+                    filter=InputMessagesFilterEmpty(),
+                    min_date=since,
+                    max_date=until,
+                    offset_id=offset_id,
+                    add_offset=0,
+                    limit=page_size,
+                    max_id=0,
+                    min_id=0,
+                    hash=0,
+                ),
+                priority=Priority.INTERACTIVE,
+            )
+
+        for message in result.messages:
+            yield message
+        if len(result.messages) < page_size:
+            return
+        offset_id = result.messages[-1].id
+
+
+async def merge_by_date(
+    streams: list[AsyncIterator[Any]],
+    limit: int,
+    errors: dict[int, str],
+) -> AsyncIterator[tuple[int, Any]]:
+    """
+    Lazily k-way merge streams of messages ordered from the newest one.
+    Yield (stream index, message) until the limit is reached, then cancel the
+    outstanding fetches. Failed streams are skipped and their errors are put into errors.
+    """
+    queues = [asyncio.Queue(maxsize=HISTORY_PAGE_SIZE) for _ in streams]
+
+    async def produce(index: int) -> None:
+        try:
+            async for message in streams[index]:
+                await queues[index].put(message)
+        except asyncio.CancelledError:
+            # The consumer has stopped: nobody waits for the end, and its queue may be full
+            raise
+        except Exception as e:
+            logger.error("Search stream %s has failed: %s", index, str(e))
+            errors[index] = str(e)
+        await queues[index].put(_END)
+
+    producers = [asyncio.create_task(produce(index)) for index in range(len(streams))]
+    try:
+        heap = []
+
+        async def push_next(index: int) -> None:
+            message = await queues[index].get()
+            if message is not _END:
+                heapq.heappush(heap, (-message.date.timestamp(), index, message))
+
+        # The newest message can only be picked once the head of every stream is known
+        await asyncio.gather(*(push_next(index) for index in range(len(streams))))
+
+        returned = 0
+        while heap and returned < limit:
+            _, index, message = heapq.heappop(heap)
+            yield index, message
+            returned += 1
+            if returned < limit:
+                await push_next(index)
+    finally:
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+
+
+async def search_channels(
+    client: TelegramClient,
+    user_id: UUID,
+    channels: list[UserChannel],
+    query: str,
+    limit: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[list[tuple[str, Any]], dict[str, str]]:
+    """
+    Search the active channels of the user concurrently and return up to limit
+    (telegram_id, message) pairs ordered by date from the newest, and the errors per channel.
+    """
+    active = [channel for channel in channels if channel.is_active]
+    semaphore = asyncio.Semaphore(settings.SEARCH_CONCURRENCY)
+    streams = [
+        search_channel(client, user_id, channel.telegram_id, query, since, until, semaphore)
+        for channel in active
+    ]
+
+    errors: dict[int, str] = {}
+    results = [
+        (active[index].telegram_id, message)
+        async for index, message in merge_by_date(streams, limit, errors)
+    ]
+    return results, {active[index].telegram_id: error for index, error in errors.items()}
@@ -1,23 +1,223 @@
+import asyncio
 import logging
 import os
+import random
+import time
+from dataclasses import dataclass
 from uuid import UUID
 
 import aiohttp
 
+from app.config import settings
+from app.exceptions.exceptions import SessionUploadException
+from app.metrics import session_upload_duration, session_upload_failures
+
 logger = logging.getLogger(__name__)
 
 MAIN_SERVICE_URL = os.getenv("MAIN_SERVICE_URL")
 
 
-# TODO: Implement separate way to send session data. Use a Celery task or a background worker.
-async def send_encrypted_session(user_id: UUID, encrypted_session_data: str) -> None:
+async def send_encrypted_session(
+    user_id: UUID,
+    encrypted_session_data: str,
+    http_session: aiohttp.ClientSession | None = None,
+) -> dict:
     """
     Send the encrypted session data to the storage service.
+    If http_session is not provided, a short-lived session is opened for this call only.
     """
+    if http_session is None:
+        async with aiohttp.ClientSession() as http_session:
+            return await send_encrypted_session(user_id, encrypted_session_data, http_session)
+
     url = f"{MAIN_SERVICE_URL}/store_session/{str(user_id)}"
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json={"session_data": encrypted_session_data}) as response:
-            if response.status != 200:
-                logger.error("Failed to send session data for user %s: %s", user_id, response.status)
-                # raise Exception(f"Failed to send session data: {response.status}")
-            return await response.json()
\ No newline at end of file
+    async with http_session.post(url, json={"session_data": encrypted_session_data}) as response:
+        if response.status != 200:
+            logger.error("Failed to send session data for user %s: %s", user_id, response.status)
+            raise SessionUploadException(f"Failed to send session data: {response.status}")
+        return await response.json()
+
+
+@dataclass
+class _Upload:
+    session_data: str  # Encrypted session data
+    attempts: int = 0  # Failed deliveries so far
+    due: float = 0.0  # Monotonic time before which the upload is not retried
+
+
+class SessionUploader:
+    """
+    Background outbox that delivers encrypted sessions to the main service.
+
+    Pending uploads are keyed by user_id, so a newer session blob replaces an older one
+    that has not been sent yet. The outbox is drained in batches over a single pooled
+    HTTP session. A failed upload is put back into the outbox with a due time following
+    an exponential backoff, so it doesn't hold up the uploads of the other users.
+    """
+
+    def __init__(
+        self,
+        max_pending: int,
+        batch_size: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        pool_size: int,
+        timeout: float,
+    ):
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._pool_size = pool_size
+        self._timeout = timeout
+
+        self._pending: dict[UUID, _Upload] = {}  # {user_id: upload}, insertion-ordered
+        self._in_flight = 0
+        self._changed = asyncio.Condition()
+        self._http_session: aiohttp.ClientSession | None = None
+        self._worker: asyncio.Task | None = None
+
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self) -> None:
+        """
+        Open the pooled HTTP session and start the background worker.
+        """
+        if self._worker is not None:
+            return
+
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._pool_size, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+        )
+        self._worker = asyncio.create_task(self._run(), name="session-uploader")
+        logger.info("Session uploader has been started.")
+
+    async def stop(self, timeout: float | None = None) -> None:
+        """
+        Try to flush the pending uploads within the timeout, then stop the worker
+        and close the pooled HTTP session.
+        """
+        if self._worker is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Session uploader stopped with %s session(s) not delivered.", len(self._pending)
+            )
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        await self._http_session.close()
+        self._http_session = None
+        logger.info("Session uploader has been stopped.")
+
+    async def enqueue(self, user_id: UUID, encrypted_session_data: str) -> None:
+        """
+        Put the encrypted session into the outbox.
+        Waits for free space only if the outbox is full and holds nothing for this user yet.
+        """
+        await self.start()
+
+        async with self._changed:
+            if user_id in self._pending:
+                self.coalesced += 1
+            else:
+                await self._changed.wait_for(lambda: len(self._pending) < self._max_pending)
+            self._pending[user_id] = _Upload(encrypted_session_data)
+            self._changed.notify_all()
+
+    async def flush(self) -> None:
+        """
+        Wait until every pending upload has been processed.
+        """
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self._pending and not self._in_flight)
+
+    async def _run(self) -> None:
+        while True:
+            async with self._changed:
+                batch = await self._next_batch()
+                self._in_flight = len(batch)
+                self._changed.notify_all()
+
+            await asyncio.gather(
+                *(self._deliver(user_id, upload) for user_id, upload in batch), return_exceptions=True,
+            )
+
+            async with self._changed:
+                self._in_flight = 0
+                self._changed.notify_all()
+
+    async def _next_batch(self) -> list[tuple[UUID, _Upload]]:
+        """
+        Wait until some uploads are due and pop them. Called with the condition held.
+        """
+        while True:
+            now = time.monotonic()
+            due = [user_id for user_id, upload in self._pending.items() if upload.due <= now]
+            if due:
+                return [(user_id, self._pending.pop(user_id)) for user_id in due[: self._batch_size]]
+
+            # Sleep until the earliest retry unless a new upload comes first
+            next_due = min((upload.due for upload in self._pending.values()), default=None)
+            try:
+                await asyncio.wait_for(self._changed.wait(), None if next_due is None else next_due - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, user_id: UUID, upload: _Upload) -> None:
+        started = time.monotonic()
+        try:
+            await send_encrypted_session(user_id, upload.session_data, self._http_session)
+        except Exception as e:
+            session_upload_duration.observe(time.monotonic() - started, "error")
+            async with self._changed:
+                if user_id in self._pending:
+                    logger.info("Dropping stale session upload for user %s: newer one is queued.", user_id)
+                    return
+                upload.attempts += 1
+                if upload.attempts > self._max_retries:
+                    self.failed += 1
+                    session_upload_failures.inc()
+                    logger.error(
+                        "Giving up on session upload for user %s after %s attempts: %s",
+                        user_id, upload.attempts, repr(e),
+                    )
+                    return
+
+                delay = min(self._backoff_max, self._backoff_base * 2 ** (upload.attempts - 1))
+                upload.due = time.monotonic() + random.uniform(delay / 2, delay)
+                self._pending[user_id] = upload
+                self._changed.notify_all()
+            logger.warning("Session upload for user %s failed and is retried: %s", user_id, repr(e))
+        else:
+            session_upload_duration.observe(time.monotonic() - started, "ok")
+            self.sent += 1
+            logger.info("Session data for user %s has been sent to the storage service.", user_id)
+
+
+session_uploader = SessionUploader(
+    max_pending=settings.SESSION_UPLOAD_MAX_PENDING,
+    batch_size=settings.SESSION_UPLOAD_BATCH_SIZE,
+    max_retries=settings.SESSION_UPLOAD_MAX_RETRIES,
+    backoff_base=settings.SESSION_UPLOAD_BACKOFF_BASE,
+    backoff_max=settings.SESSION_UPLOAD_BACKOFF_MAX,
+    pool_size=settings.SESSION_UPLOAD_POOL_SIZE,
+    timeout=settings.SESSION_UPLOAD_TIMEOUT,
+)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from uuid import UUID
+
+from telethon import TelegramClient
+
+from app.config import settings
+from app.models import UserChannel
+from app.services.channels import DEFAULT_FIELDS, iter_history_pages, project_message
+from app.services.index import message_index
+from app.services.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+
+class HighWaterMarkStore:
+    """
+    SQLite store of the last synced message id and pts per (user_id, channel telegram_id).
+    The database is opened on first use. The blocking queries run in a thread.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Return the connection, opening the database first if needed. Called with the lock held.
+        """
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, check_same_thread=False, timeout=30, isolation_level=None)
+            if self._path != ":memory:":
+                connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS high_water_marks (
+                    user_id TEXT NOT NULL,
+                    telegram_id TEXT NOT NULL,
+                    last_message_id INTEGER NOT NULL,
+                    pts INTEGER,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, telegram_id)
+                )
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    async def get(self, user_id: UUID) -> dict[str, tuple[int, int | None]]:
+        """
+        Return {telegram_id: (last_message_id, pts)} of all channels of the user.
+        """
+        def query() -> list[tuple]:
+            with self._lock:
+                return self._connect().execute(
+                    "SELECT telegram_id, last_message_id, pts FROM high_water_marks WHERE user_id = ?",
+                    (str(user_id),),
+                ).fetchall()
+
+        rows = await asyncio.to_thread(query)
+        return {telegram_id: (last_message_id, pts) for telegram_id, last_message_id, pts in rows}
+
+    async def set(self, user_id: UUID, telegram_id: str, last_message_id: int, pts: int | None) -> None:
+        def update() -> None:
+            with self._lock:
+                self._connect().execute(
+                    "INSERT INTO high_water_marks (user_id, telegram_id, last_message_id, pts, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, telegram_id) DO UPDATE SET "
+                    "last_message_id = excluded.last_message_id, pts = excluded.pts, "
+                    "updated_at = excluded.updated_at",
+                    (str(user_id), telegram_id, last_message_id, pts, time.time()),
+                )
+
+        await asyncio.to_thread(update)
+
+
+async def sync_channel(
+    client: TelegramClient,
+    user_id: UUID,
+    telegram_id: str,
+    mark: tuple[int, int | None] | None,
+    fields: tuple[str, ...] = DEFAULT_FIELDS,
+) -> dict:
+    """
+    Fetch the messages of the channel newer than its high-water mark and move the mark.
+    A channel synced for the first time only returns its latest messages.
+    """
+    last_message_id, pts = mark or (0, None)
+    limit = None if mark else settings.SYNC_INITIAL_LIMIT
+
+    messages, newest_id = [], last_message_id
+    async for result in iter_history_pages(
+        client, user_id, telegram_id, min_id=last_message_id, limit=limit, priority=Priority.BACKGROUND,
+    ):
+        if not messages and result.messages:
+            pts = getattr(result, "pts", pts)  # Only channels have pts
+        for message in result.messages:
+            newest_id = max(newest_id, message.id)
+            messages.append(project_message(message, fields))
+        if settings.MESSAGE_INDEX_ENABLED:
+            message_index.add(user_id, telegram_id, result.messages)
+
+    # The mark only moves once the whole delta has been fetched
+    last_message_id = newest_id
+    await high_water_marks.set(user_id, telegram_id, last_message_id, pts)
+
+    return {"messages": messages, "last_message_id": last_message_id, "pts": pts, "error": None}
+
+
+async def sync_channels(
+    client: TelegramClient,
+    user_id: UUID,
+    channels: list[UserChannel],
+    fields: tuple[str, ...] = DEFAULT_FIELDS,
+) -> dict[str, dict]:
+    """
+    Sync the active channels of the user concurrently under SYNC_CONCURRENCY.
+    Return the new messages and the new marks per channel telegram_id.
+    """
+    marks = await high_water_marks.get(user_id)
+    semaphore = asyncio.Semaphore(settings.SYNC_CONCURRENCY)
+
+    async def sync(channel: UserChannel) -> dict:
+        async with semaphore:
+            try:
+                return await sync_channel(client, user_id, channel.telegram_id, marks.get(channel.telegram_id), fields)
+            except Exception as e:
+                logger.error("Failed to sync channel %s for user %s: %s", channel.telegram_id, user_id, str(e))
+                mark = marks.get(channel.telegram_id, (0, None))
+                return {"messages": [], "last_message_id": mark[0], "pts": mark[1], "error": str(e)}
+
+    active = [channel for channel in channels if channel.is_active]
+    results = await asyncio.gather(*(sync(channel) for channel in active))
+    return {channel.telegram_id: result for channel, result in zip(active, results)}
+
+
+high_water_marks = HighWaterMarkStore(settings.SYNC_STATE_PATH)
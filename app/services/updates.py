@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import weakref
+from collections import deque
+from uuid import UUID
+
+import aiohttp
+from telethon import TelegramClient, events, utils
+from telethon.errors import RPCError
+
+from app.config import settings
+from app.models import UserChannel
+from app.services.channels import DEFAULT_FIELDS, project_message
+from app.services.entities import entity_cache
+from app.services.index import message_index
+from app.services.scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "spill")
+
+
+class WebhookSender:
+    """
+    Delivers events to the main service in batches.
+
+    Events wait in a bounded in-memory queue and are sent once a full batch has been
+    collected or the flush interval has passed. When the queue is full, the overflow
+    policy either drops the oldest or the newest events, or spills them to a file
+    which is replayed once the queue has drained. A batch in flight when the sender is
+    stopped goes back to the queue, so it is delivered or spilled with the rest.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_queued: int,
+        batch_size: int,
+        flush_interval: float,
+        overflow_policy: str,
+        spill_path: str,
+        max_retries: int,
+        timeout: float,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+
+        self._url = url
+        self._max_queued = max_queued
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._overflow_policy = overflow_policy
+        self._spill_path = spill_path
+        self._max_retries = max_retries
+        self._timeout = timeout
+
+        self._queue: deque[dict] = deque()
+        self._not_empty = asyncio.Event()
+        self._batch_ready = asyncio.Event()
+        self._http_session: aiohttp.ClientSession | None = None
+        self._worker: asyncio.Task | None = None
+
+        self._stats = {"sent": 0, "dropped": 0, "spilled": 0, "failed_batches": 0}
+
+    def stats(self) -> dict:
+        return {"queued": len(self._queue), **self._stats}
+
+    def put(self, event: dict) -> None:
+        """
+        Queue the event for delivery, applying the overflow policy if the queue is full.
+        """
+        if len(self._queue) >= self._max_queued:
+            if self._overflow_policy == "drop_newest":
+                self._stats["dropped"] += 1
+                return
+            if self._overflow_policy == "spill":
+                self._spill([event])
+                return
+            self._queue.popleft()
+            self._stats["dropped"] += 1
+
+        self._queue.append(event)
+        self._not_empty.set()
+        if len(self._queue) >= self._batch_size:
+            self._batch_ready.set()
+
+    async def start(self) -> None:
+        if self._worker is not None:
+            return
+
+        self._http_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self._timeout))
+        self._worker = asyncio.create_task(self._run(), name="webhook-sender")
+
+    async def stop(self, timeout: float | None = None) -> None:
+        """
+        Send the queued events within the timeout, spill the rest if the policy allows it.
+        """
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Webhook sender stopped with %s events not delivered.", len(self._queue))
+            if self._overflow_policy == "spill":
+                self._spill(list(self._queue))
+                self._queue.clear()
+
+        await self._http_session.close()
+        self._http_session = None
+
+    async def _drain(self) -> None:
+        while self._queue:
+            await self._send(self._take_batch())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._not_empty.wait()
+
+            # Wait for a full batch, but not longer than the flush interval
+            deadline = loop.time() + self._flush_interval
+            while len(self._queue) < self._batch_size and loop.time() < deadline:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+
+            await self._send(self._take_batch())
+
+            if not self._queue and (os.path.exists(self._spill_path) or os.path.exists(self._replay_path)):
+                await self._replay_spill()
+
+    def _take_batch(self) -> list[dict]:
+        batch = [self._queue.popleft() for _ in range(min(self._batch_size, len(self._queue)))]
+        if not self._queue:
+            self._not_empty.clear()
+        return batch
+
+    @property
+    def _replay_path(self) -> str:
+        return self._spill_path + ".replay"
+
+    async def _send(self, batch: list[dict]) -> bool:
+        if not batch:
+            return True
+
+        try:
+            return await self._deliver(batch)
+        except asyncio.CancelledError:
+            # Stopped mid-flight: put the batch back in front, stop() sends or spills it
+            self._queue.extendleft(reversed(batch))
+            self._not_empty.set()
+            raise
+
+    async def _deliver(self, batch: list[dict]) -> bool:
+        for attempt in range(self._max_retries + 1):
+            try:
+                async with self._http_session.post(self._url, json=batch) as response:
+                    if response.status < 300:
+                        self._stats["sent"] += len(batch)
+                        return True
+                    logger.error("Failed to deliver %s events: %s", len(batch), response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error("Failed to deliver %s events: %s", len(batch), str(e))
+            if attempt < self._max_retries:
+                await asyncio.sleep(random.uniform(0.5, 1.0) * 2 ** attempt)
+
+        self._stats["failed_batches"] += 1
+        if self._overflow_policy == "spill":
+            self._spill(batch)
+        else:
+            self._stats["dropped"] += len(batch)
+        return False
+
+    def _spill(self, events: list[dict]) -> None:
+        with open(self._spill_path, "a", encoding="utf-8") as file:
+            for event in events:
+                file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self._stats["spilled"] += len(events)
+
+    async def _replay_spill(self) -> None:
+        """
+        Send the spilled events batch by batch, putting back the ones that still fail.
+        A replay file left by an interrupted replay is sent first, the spill file
+        is only moved in its place once it is gone.
+        """
+        replay_path = self._replay_path
+        if not os.path.exists(replay_path):
+            os.replace(self._spill_path, replay_path)
+        logger.info("Replaying spilled webhook events from %s", replay_path)
+
+        with open(replay_path, encoding="utf-8") as file:
+            batch = []
+            for line in file:
+                batch.append(json.loads(line))
+                if len(batch) == self._batch_size:
+                    await self._send(batch)
+                    batch = []
+            await self._send(batch)
+        os.remove(replay_path)
+
+
+class UpdateDispatcher:
+    """
+    Registers NewMessage handlers on active clients and forwards the messages
+    posted to the user's active channels to the webhook sender.
+    """
+
+    def __init__(self, sender: WebhookSender, fields: tuple[str, ...] = DEFAULT_FIELDS):
+        self._sender = sender
+        self._fields = fields
+        self._subscriptions: dict[UUID, tuple[weakref.ref, object]] = {}  # {user_id: (client, handler)}
+
+    @property
+    def subscribed(self) -> int:
+        return len(self._subscriptions)
+
+    async def subscribe(self, user_id: UUID, client: TelegramClient, channels: list[UserChannel]) -> list[str]:
+        """
+        Replace the channels watched for the user. Return the telegram_ids which couldn't be resolved.
+        """
+        self.unsubscribe(user_id)
+
+        watched, unresolved = {}, []
+        for channel in channels:
+            if not channel.is_active:
+                continue
+            try:
+                peer = await entity_cache.resolve(client, user_id, channel.telegram_id, Priority.BACKGROUND)
+            except (ValueError, TypeError, RPCError) as e:
+                logger.error("Failed to resolve channel %s for user %s: %s", channel.telegram_id, user_id, str(e))
+                unresolved.append(channel.telegram_id)
+                continue
+            watched[utils.get_peer_id(peer)] = channel.telegram_id
+
+        async def handler(event: events.NewMessage.Event) -> None:
+            telegram_id = watched[event.chat_id]
+            self._sender.put({
+                "user_id": str(user_id),
+                "telegram_id": telegram_id,
+                "message": project_message(event.message, self._fields),
+            })
+            if settings.MESSAGE_INDEX_ENABLED:
+                message_index.add(user_id, telegram_id, [event.message])
+
+        event_filter = events.NewMessage(func=lambda event: event.chat_id in watched)
+        client.add_event_handler(handler, event_filter)
+        self._subscriptions[user_id] = (weakref.ref(client), handler)
+        logger.info("Watching %s channels of user %s for new messages.", len(watched), user_id)
+        return unresolved
+
+    def unsubscribe(self, user_id: UUID) -> None:
+        subscription = self._subscriptions.pop(user_id, None)
+        if subscription is None:
+            return
+
+        client_ref, handler = subscription
+        client = client_ref()
+        if client is not None:
+            client.remove_event_handler(handler)
+
+
+webhook_sender = WebhookSender(
+    url=settings.UPDATES_WEBHOOK_URL or str(settings.MAIN_SERVICE_URL).rstrip("/") + "/new_messages",
+    max_queued=settings.UPDATES_QUEUE_SIZE,
+    batch_size=settings.UPDATES_BATCH_SIZE,
+    flush_interval=settings.UPDATES_FLUSH_INTERVAL,
+    overflow_policy=settings.UPDATES_OVERFLOW_POLICY,
+    spill_path=settings.UPDATES_SPILL_PATH,
+    max_retries=settings.UPDATES_MAX_RETRIES,
+    timeout=settings.SESSION_UPLOAD_TIMEOUT,
+)
+update_dispatcher = UpdateDispatcher(webhook_sender)
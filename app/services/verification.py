@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import pathlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+from uuid import UUID
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VerifiedSession:
+    fingerprint: str
+    verified_at: float  # Wall clock time, so it survives a restart
+    me: Any | None = None  # Result of get_me, not persisted
+
+
+class VerifiedSessionCache:
+    """
+    Cache of sessions which have recently passed the welcome message and get_me checks.
+    Entries are keyed by user_id and bound to a fingerprint of the session data,
+    so a changed session (new auth key, DC migration) is verified again.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries: OrderedDict[UUID, VerifiedSession] = OrderedDict()
+
+    @staticmethod
+    def fingerprint(session_data: str) -> str:
+        return hashlib.sha256(session_data.encode()).hexdigest()
+
+    def get(self, user_id: UUID, fingerprint: str) -> VerifiedSession | None:
+        """
+        Return the verified session if it matches the fingerprint and has not expired.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+
+        if entry.fingerprint != fingerprint or time.time() - entry.verified_at > self._ttl:
+            del self._entries[user_id]
+            return None
+
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def add(self, user_id: UUID, fingerprint: str, me: Any | None = None) -> None:
+        self._entries[user_id] = VerifiedSession(fingerprint, time.time(), me)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, user_id: UUID) -> None:
+        self._entries.pop(user_id, None)
+
+    def load(self, path: str) -> None:
+        """
+        Load the fingerprints saved by dump, skipping the expired ones.
+        """
+        file = pathlib.Path(path)
+        if not file.exists():
+            return
+
+        try:
+            entries = json.loads(file.read_text())
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load verified sessions from %s: %s", path, str(e))
+            return
+
+        now = time.time()
+        for user_id, entry in entries.items():
+            if now - entry["verified_at"] <= self._ttl:
+                self._entries[UUID(user_id)] = VerifiedSession(entry["fingerprint"], entry["verified_at"])
+        logger.info("Loaded %s verified sessions from %s", len(self._entries), path)
+
+    def dump(self, path: str) -> None:
+        """
+        Save the fingerprints and verification times, so restores after a restart are fast.
+        """
+        entries = {
+            str(user_id): {"fingerprint": entry.fingerprint, "verified_at": entry.verified_at}
+            for user_id, entry in self._entries.items()
+        }
+        try:
+            pathlib.Path(path).write_text(json.dumps(entries))
+        except OSError as e:
+            logger.error("Failed to save verified sessions to %s: %s", path, str(e))
+
+
+verified_sessions = VerifiedSessionCache(
+    ttl=settings.VERIFIED_SESSION_TTL,
+    max_size=settings.VERIFIED_SESSION_CACHE_SIZE,
+)
@@ -0,0 +1,372 @@
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import re
+import uuid
+from typing import Any
+from uuid import UUID
+
+import aiohttp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.registry import ClientRegistry
+
+logger = logging.getLogger(__name__)
+
+FORWARDED_HEADER = b"x-shard-forwarded"
+HOP_BY_HOP_HEADERS = {b"connection", b"keep-alive", b"transfer-encoding", b"host", b"upgrade"}
+# Batch routes split by owner, with the field keying the results of their items (None: the user_id)
+BATCH_ROUTES = {"/connect/batch": None, "/messages/batch": "id"}
+UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping user_ids to nodes.
+    Every node is placed on the ring many times, so the keys are spread evenly
+    and adding or removing a node only moves the keys of that node.
+    """
+
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        self.nodes = list(nodes)
+        self._ring: list[tuple[int, str]] = sorted(
+            (self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def node_for(self, key: Any) -> str:
+        index = bisect.bisect(self._keys, self._hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+def forwarded_token(secret: str) -> bytes:
+    """
+    Return the value of FORWARDED_HEADER which proves that a node sharing the secret forwarded the request.
+    """
+    return hmac.new(secret.encode(), FORWARDED_HEADER, hashlib.sha256).hexdigest().encode()
+
+
+def worker_nodes(host: str, base_port: int, workers: int) -> list[str]:
+    return [f"http://{host}:{base_port + i}" for i in range(workers)]
+
+
+class ShardRouter:
+    """
+    ASGI app forwarding every request to the node owning its user_id.
+
+    Used as a middleware inside a worker (own_node is set, owned requests go to the
+    wrapped app) and as a standalone front router (app and own_node are None).
+    The user_id is taken from the path or from the JSON body. The body of a batch route
+    is split by owner, sent to every owner and the "data" of the responses is merged;
+    the items of a part which failed get an error result of their own. Requests without
+    a user_id are handled locally or by the first node.
+
+    Forwarded requests are marked with FORWARDED_HEADER signed by the secret shared
+    by the nodes and are handled without routing them again. The header is stripped
+    from every request, so a caller can't make a node serve a user it doesn't own.
+    Without a secret, no request is trusted as forwarded.
+    """
+
+    def __init__(
+        self, app: ASGIApp | None, nodes: list[str], own_node: str | None = None, secret: str | None = None,
+    ):
+        self.app = app
+        self.ring = HashRing(nodes)
+        self.own_node = own_node
+        self._token = forwarded_token(secret) if secret else None
+        self._http: aiohttp.ClientSession | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(scope, receive, send)
+            return
+
+        if scope["type"] != "http" or self._forwarded(scope):
+            if self.app is None:
+                await self._reject(scope, send)
+                return
+            await self.app(scope, receive, send)
+            return
+
+        body = await self._read_body(receive)
+        payload = None
+        if body:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                pass
+
+        key_field = self._batch_key_field(scope["path"])
+        if isinstance(payload, list) and key_field is not False:
+            await self._forward_batch(scope, receive, payload, key_field, send)
+            return
+
+        owner = await self._owner(scope["path"], payload)
+        if self.app is not None and owner in (None, self.own_node):
+            await self.app(scope, self._replay(body, receive), send)
+        else:
+            await self._forward(scope, body, owner or self.ring.nodes[0], send)
+
+    async def node_for(self, user_id: str) -> str:
+        """
+        Return the address of the node owning the user_id.
+        """
+        return self.ring.node_for(user_id.lower())
+
+    def _forwarded(self, scope: Scope) -> bool:
+        """
+        Strip FORWARDED_HEADER from the request and return whether it has been signed by a node.
+        """
+        values = [value for name, value in scope["headers"] if name == FORWARDED_HEADER]
+        if not values:
+            return False
+        scope["headers"] = [(name, value) for name, value in scope["headers"] if name != FORWARDED_HEADER]
+        return self._token is not None and any(hmac.compare_digest(value, self._token) for value in values)
+
+    async def _owner(self, path: str, payload: Any) -> str | None:
+        user_id = self._user_id(payload)
+        if user_id is None:
+            match = UUID_RE.search(path)
+            user_id = match.group(0) if match else None
+        return await self.node_for(user_id) if user_id else None
+
+    @staticmethod
+    def _batch_key_field(path: str) -> str | None | bool:
+        """
+        Return the field keying the results of a batch route, None for the user_id,
+        or False if the path is not a batch route.
+        """
+        for route, key_field in BATCH_ROUTES.items():
+            if path.endswith(route):
+                return key_field
+        return False
+
+    @staticmethod
+    def _user_id(payload: Any) -> str | None:
+        if not isinstance(payload, dict):
+            return None
+        if isinstance(payload.get("user_id"), str):
+            return payload["user_id"]
+        user = payload.get("user")
+        if isinstance(user, dict) and isinstance(user.get("id"), str):
+            return user["id"]
+        return None
+
+    async def _forward(self, scope: Scope, body: bytes, node: str, send: Send) -> None:
+        """
+        Proxy the request to the node, streaming the response back as it arrives.
+        """
+        try:
+            async with self._session().request(
+                scope["method"], self._url(scope, node), headers=self._headers(scope), data=body,
+            ) as response:
+                await send({
+                    "type": "http.response.start",
+                    "status": response.status,
+                    "headers": [
+                        (name, value) for name, value in response.raw_headers
+                        if name.lower() not in HOP_BY_HOP_HEADERS
+                    ],
+                })
+                async for chunk in response.content.iter_any():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+        except aiohttp.ClientError as e:
+            logger.error("Failed to forward request to %s: %s", node, str(e))
+            await self._send_json(send, 502, {
+                "status": 502, "error": str(e), "message": "Owner node is unavailable.",
+            })
+
+    async def _forward_batch(
+        self,
+        scope: Scope,
+        receive: Receive,
+        items: list,
+        key_field: str | None,
+        send: Send,
+    ) -> None:
+        """
+        Split a batch by owner node, forward the parts concurrently and merge the results.
+        The response has the status of the parts which succeeded, or 502 if none did.
+        """
+        if key_field is not None:
+            # Keyed up front, so the items of a failed part can be reported under their own key
+            for item in items:
+                if isinstance(item, dict) and not item.get(key_field):
+                    item[key_field] = str(uuid.uuid4())
+
+        parts: dict[str, list] = {}
+        for item in items:
+            user_id = self._user_id(item)
+            node = await self.node_for(user_id) if user_id else self.ring.nodes[0]
+            parts.setdefault(node, []).append(item)
+
+        if len(parts) <= 1:
+            # Nothing to merge, the owner answers as is
+            node = next(iter(parts), self.ring.nodes[0])
+            body = json.dumps(items).encode()
+            if node == self.own_node:
+                await self.app(scope, self._replay(body, receive), send)
+            else:
+                await self._forward(scope, body, node, send)
+            return
+
+        async def forward(node: str, part: list) -> tuple[int, Any]:
+            async with self._session().request(
+                scope["method"], self._url(scope, node), headers=self._headers(scope), json=part,
+            ) as response:
+                body = await response.read()
+                try:
+                    return response.status, json.loads(body)
+                except ValueError:
+                    return response.status, body.decode(errors="replace")
+
+        responses = await asyncio.gather(
+            *(forward(node, part) for node, part in parts.items()), return_exceptions=True,
+        )
+
+        merged = {"status_code": 502, "message": "", "data": {}}
+        succeeded = set()
+        for node, response in zip(parts, responses):
+            if isinstance(response, BaseException):
+                logger.error("Failed to forward batch to %s: %s", node, str(response))
+                status_code, error = 502, str(response)
+            else:
+                status_code, content = response
+                if 200 <= status_code < 300 and isinstance(content, dict):
+                    succeeded.add(status_code)
+                    merged["message"] = content.get("message", merged["message"])
+                    merged["data"].update(content.get("data") or {})
+                    continue
+                logger.error("Batch forwarded to %s failed with status %s.", node, status_code)
+                error = content.get("detail", content) if isinstance(content, dict) else content
+
+            for item in parts[node]:
+                key = item.get(key_field) if key_field is not None and isinstance(item, dict) else self._user_id(item)
+                merged["data"][str(key)] = {"status": "failed", "status_code": status_code, "error": error}
+
+        if succeeded:
+            # Parts of one route answer with the same status, keep the lowest one otherwise
+            merged["status_code"] = min(succeeded)
+        else:
+            merged["message"] = "Owner nodes failed to process the batch."
+        await self._send_json(send, merged["status_code"], merged)
+
+    async def _reject(self, scope: Scope, send: Send) -> None:
+        """
+        Answer a request the front router cannot handle: there is no app behind it.
+        """
+        if scope["type"] == "http":
+            # A forwarded request reaching the front router means the nodes are misconfigured
+            await self._send_json(send, 421, {
+                "status": 421, "message": "Request has already been forwarded to this router.",
+            })
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1011})
+
+    async def _lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async def close_on_shutdown() -> Message:
+            message = await receive()
+            if message["type"] == "lifespan.shutdown" and self._http is not None:
+                await self._http.close()
+                self._http = None
+            return message
+
+        if self.app is not None:
+            await self.app(scope, close_on_shutdown, send)
+            return
+
+        while True:
+            message = await close_on_shutdown()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self._http is None:
+            # Keep the encoded body as is, it is passed to the caller unchanged
+            self._http = aiohttp.ClientSession(
+                auto_decompress=False, timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._http
+
+    @staticmethod
+    def _url(scope: Scope, node: str) -> str:
+        url = node + scope["path"]
+        if scope["query_string"]:
+            url += "?" + scope["query_string"].decode()
+        return url
+
+    def _headers(self, scope: Scope) -> list[tuple[str, str]]:
+        headers = [
+            (name.decode(), value.decode()) for name, value in scope["headers"]
+            if name not in HOP_BY_HOP_HEADERS and name not in (b"content-length", FORWARDED_HEADER)
+        ]
+        if self._token is not None:
+            headers.append((FORWARDED_HEADER.decode(), self._token.decode()))
+        return headers
+
+    @staticmethod
+    async def _read_body(receive: Receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                return body
+
+    @staticmethod
+    def _replay(body: bytes, receive: Receive) -> Receive:
+        """
+        Return the already read body once, then wait for the client's disconnect as usual.
+        """
+        sent = False
+
+        async def replay() -> Message:
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
+
+    @staticmethod
+    async def _send_json(send: Send, status_code: int, content: dict) -> None:
+        body = json.dumps(content).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class RegistryRouter(ShardRouter):
+    """
+    Router for multi-node deployments: the owner of a user_id is looked up in the client
+    registry. Users without a live owner are handled by this node.
+    """
+
+    def __init__(self, app: ASGIApp, registry: ClientRegistry, own_node: str, secret: str | None = None):
+        super().__init__(app, [own_node], own_node, secret)
+        self.registry = registry
+
+    async def node_for(self, user_id: str) -> str:
+        try:
+            location = await self.registry.locate(UUID(user_id))
+        except ValueError:
+            return self.own_node
+
+        if location is not None and location.alive and location.address:
+            return location.address
+        return self.own_node
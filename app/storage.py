@@ -1,22 +1,145 @@
+import abc
+import asyncio
 import logging
-from typing import Dict
+import os
+import socket
+import time
+from collections import OrderedDict
+from contextlib import AbstractContextManager, contextmanager
+from typing import Dict, Iterator
 from uuid import UUID
 
 from telethon import TelegramClient
 
+from app.config import settings
+from app.registry import ClientRegistry, SQLiteClientRegistry
+from app.security.crypto import decrypt_session, encrypt_session
+from app.services.checkpoint import checkpointer
+from app.services.scheduler import Priority, scheduler
+from app.sharding import HashRing
+from app.utils import SingleFlight, create_client, promote_client
+
 logger = logging.getLogger(__name__)
 
 
-class ClientStorage:
-    def __init__(self):
-        self._active_clients: Dict[UUID, TelegramClient] = {}  # {user_id: TelegramClient}
+class ClientStorage(abc.ABC):
+    """
+    Interface of the storage of live Telegram clients.
+    A client is unauthorized until the user signs in, then it becomes active.
+    An idle passive client may be suspended to its session, and is reconnected
+    by acquire_active_client on its next use. A leased client is never suspended
+    or evicted.
+    """
+
+    @abc.abstractmethod
+    def add_active_client(self, user_id: UUID, client: TelegramClient, passive: bool | None = None) -> None: ...
+
+    @abc.abstractmethod
+    def add_unauthorized_client(self, user_id: UUID, client: TelegramClient, passive: bool = False) -> None: ...
+
+    @abc.abstractmethod
+    def move_client_to_active(self, user_id: UUID) -> None: ...
+
+    @abc.abstractmethod
+    def get_unauthorized_client(self, user_id: UUID, raise_exc: bool = True) -> TelegramClient | None: ...
+
+    @abc.abstractmethod
+    def get_active_client(
+        self, user_id: UUID, raise_exc: bool = True, touch: bool = True,
+    ) -> TelegramClient | None: ...
+
+    @abc.abstractmethod
+    async def acquire_active_client(self, user_id: UUID) -> TelegramClient: ...
+
+    @abc.abstractmethod
+    async def promote(self, user_id: UUID) -> TelegramClient: ...
+
+    @abc.abstractmethod
+    def is_suspended(self, user_id: UUID) -> bool: ...
+
+    @abc.abstractmethod
+    def lease(self, user_id: UUID) -> AbstractContextManager[None]: ...
+
+    @abc.abstractmethod
+    def remove_active_client(self, user_id: UUID, raise_exc: bool = False) -> None: ...
+
+    @abc.abstractmethod
+    def remove_unauthorized_client(self, user_id: UUID, raise_exc: bool = False) -> None: ...
+
+    @abc.abstractmethod
+    def active_clients(self) -> list[tuple[UUID, TelegramClient]]: ...
+
+    @abc.abstractmethod
+    def stats(self) -> dict: ...
+
+    @abc.abstractmethod
+    def start(self) -> None: ...
+
+    @abc.abstractmethod
+    async def stop(self) -> None: ...
+
+    @abc.abstractmethod
+    async def shutdown(self, concurrency: int, timeout: float) -> None: ...
+
+
+class InMemoryClientStorage(ClientStorage):
+    def __init__(
+        self,
+        unauthorized_ttl: float | None = None,
+        active_limit: int | None = None,
+        active_idle_timeout: float | None = None,
+        passive_suspend_after: float | None = None,
+        sweep_interval: float = 60.0,
+    ):
+        # Active clients are kept in LRU order: the least recently used client comes first
+        self._active_clients: OrderedDict[UUID, TelegramClient] = OrderedDict()  # {user_id: TelegramClient}
         self._unauthorized_clients: Dict[UUID, TelegramClient] = {}
+        self._last_used: Dict[UUID, float] = {}  # {user_id: monotonic time of the last access}
+        self._created_at: Dict[UUID, float] = {}  # {user_id: monotonic time of the connection}
+        self._passive: set[UUID] = set()  # Users whose client is passive, stored or suspended
+        self._suspended: Dict[UUID, str] = {}  # {user_id: session data of the suspended client}
+        self._leases: Dict[UUID, int] = {}  # {user_id: requests and workers using the client}
+        self._resumes = SingleFlight()
+
+        self._unauthorized_ttl = unauthorized_ttl
+        self._active_limit = active_limit
+        self._active_idle_timeout = active_idle_timeout
+        self._passive_suspend_after = passive_suspend_after
+        self._sweep_interval = sweep_interval
+
+        self._sweeper: asyncio.Task | None = None
+        self._closing: set[asyncio.Task] = set()
+        self._evictions = {"unauthorized_expired": 0, "active_idle": 0, "active_over_limit": 0}
+        self._suspensions = {"suspended": 0, "resumed": 0, "promoted": 0}
+
+    def add_active_client(self, user_id: UUID, client: TelegramClient, passive: bool | None = None) -> None:
+        """
+        Store an active client. Its mode is kept from the unauthorized client unless passive is given.
+        """
+        previous = self._active_clients.get(user_id)
+        if previous is not None and previous is not client:
+            logger.warning("Active client for user %s is replaced by a new one.", user_id)
+            self._close(user_id, previous, checkpoint=False)
 
-    def add_active_client(self, user_id: UUID, client: TelegramClient) -> None:
         self._active_clients[user_id] = client
+        self._active_clients.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+        self._suspended.pop(user_id, None)
+        if passive is not None:
+            self._set_passive(user_id, passive)
+        self._client_added(user_id, client, "active")
+        self._enforce_active_limit()
+
+    def add_unauthorized_client(self, user_id: UUID, client: TelegramClient, passive: bool = False) -> None:
+        previous = self._unauthorized_clients.get(user_id)
+        if previous is not None and previous is not client:
+            logger.warning("Unauthorized client for user %s is replaced by a new one.", user_id)
+            self._close(user_id, previous, checkpoint=False)
 
-    def add_unauthorized_client(self, user_id: UUID, client: TelegramClient) -> None:
         self._unauthorized_clients[user_id] = client
+        self._created_at[user_id] = time.monotonic()
+        self._set_passive(user_id, passive)
+        self._client_added(user_id, client, "unauthorized")
 
     def move_client_to_active(self, user_id: UUID) -> None:
         """
@@ -25,7 +148,8 @@ class ClientStorage:
         """
         if user_id in self._unauthorized_clients:
             client = self._unauthorized_clients.pop(user_id)
-            self._active_clients[user_id] = client
+            self._created_at.pop(user_id, None)
+            self.add_active_client(user_id, client)
         else:
             raise KeyError(f"Client with user_id {user_id} not found in unauthorized clients.")
 
@@ -47,22 +171,91 @@ class ClientStorage:
         self,
         user_id: UUID,
         raise_exc: bool = True,
+        touch: bool = True,
     ) -> TelegramClient | None:
         """
-        Get a client from active storage by user_id.
+        Get a client from active storage by user_id and mark it as recently used unless touch is False.
         If raise_exc is True and the client is not found, raise KeyError.
         """
         client = self._active_clients.get(user_id)
-        if client is None and raise_exc:
+        if client is None:
+            if raise_exc:
+                raise KeyError(f"Client with user_id {user_id} not found in active clients.")
+            return None
+        if not touch:
+            return client
+
+        self._active_clients.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+        return client
+
+    async def acquire_active_client(self, user_id: UUID) -> TelegramClient:
+        """
+        Get a client from active storage by user_id, reconnecting it first if it has been suspended.
+        Concurrent calls for a suspended client share one reconnection.
+        If the client is neither active nor suspended, raise KeyError.
+        """
+        client = self.get_active_client(user_id, raise_exc=False)
+        if client is not None:
+            return client
+        if user_id not in self._suspended:
             raise KeyError(f"Client with user_id {user_id} not found in active clients.")
+        return await self._resumes.run(user_id, lambda: self._resume(user_id))
+
+    async def promote(self, user_id: UUID) -> TelegramClient:
+        """
+        Turn the passive client of the user into a full one, which receives updates
+        and keeps the default caches. A full client is returned as is.
+        """
+        client = await self.acquire_active_client(user_id)
+        if user_id in self._passive:
+            # Out of the passive set first, so the sweep doesn't suspend it meanwhile
+            self._passive.discard(user_id)
+            try:
+                await promote_client(client)
+            except Exception:
+                self._passive.add(user_id)
+                raise
+            self._suspensions["promoted"] += 1
+            logger.info("Passive client for user %s has been promoted to a full client.", user_id)
         return client
 
+    def is_suspended(self, user_id: UUID) -> bool:
+        return user_id in self._suspended
+
+    @contextmanager
+    def lease(self, user_id: UUID) -> Iterator[None]:
+        """
+        Keep the client of the user from being suspended or evicted while the block runs.
+        Leases are counted, the client is marked as recently used once the last one is released,
+        which also evicts another client if the active limit has been exceeded meanwhile.
+        """
+        self._leases[user_id] = self._leases.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            leases = self._leases.pop(user_id) - 1
+            if leases:
+                self._leases[user_id] = leases
+            else:
+                self.get_active_client(user_id, raise_exc=False)
+                self._enforce_active_limit()
+
     def remove_active_client(self, user_id: UUID, raise_exc: bool = False) -> None:
         """
-        Remove a client from active storage by user_id.
+        Remove a client from active storage by user_id, whether it is connected or suspended.
         """
-        if user_id in self._active_clients:
+        if user_id in self._suspended:
+            del self._suspended[user_id]
+            self._passive.discard(user_id)
+            self._client_removed(user_id)
+            logger.info(f"Suspended client with user_id {user_id} has been removed.")
+        elif user_id in self._active_clients:
             del self._active_clients[user_id]
+            self._last_used.pop(user_id, None)
+            self._passive.discard(user_id)
+            checkpointer.forget(user_id)
+            self._client_removed(user_id)
             logger.info(f"Client with user_id {user_id} has been removed from active clients.")
         elif raise_exc:
             raise KeyError(f"Client with user_id {user_id} not found in active clients.")
@@ -78,6 +271,10 @@ class ClientStorage:
         """
         if user_id in self._unauthorized_clients:
             del self._unauthorized_clients[user_id]
+            self._created_at.pop(user_id, None)
+            self._passive.discard(user_id)
+            self._forget_session(user_id)
+            self._client_removed(user_id)
             logger.info(f"Client with user_id {user_id} has been removed from unauthorized clients.")
         elif raise_exc:
             raise KeyError(f"Client with user_id {user_id} not found in unauthorized clients.")
@@ -87,5 +284,429 @@ class ClientStorage:
                 f"It has already been removed from unauthorized storage."
             )
 
+    def active_clients(self) -> list[tuple[UUID, TelegramClient]]:
+        """
+        Return a snapshot of the active clients without marking them as recently used.
+        """
+        return list(self._active_clients.items())
+
+    def stats(self) -> dict:
+        """
+        Return the current number of stored clients and the eviction and suspension counters.
+        Passive clients are counted as active too, unless they are suspended.
+        """
+        return {
+            "active": len(self._active_clients),
+            "unauthorized": len(self._unauthorized_clients),
+            "passive": len(self._passive.intersection(self._active_clients)),
+            "suspended": len(self._suspended),
+            "leased": len(self._leases),
+            "active_limit": self._active_limit,
+            "evictions": dict(self._evictions),
+            "suspensions": dict(self._suspensions),
+        }
+
+    def start(self) -> None:
+        """
+        Start the background sweeper which evicts expired and idle clients.
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever(), name="client-storage-sweeper")
+
+    async def stop(self) -> None:
+        """
+        Stop the background sweeper and wait for the evicted clients to be closed.
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    async def shutdown(self, concurrency: int, timeout: float) -> None:
+        """
+        Stop the sweeper and disconnect all the clients concurrently within the timeout.
+        Sessions of the active clients are checkpointed to the main service,
+        the suspended ones have been checkpointed on their suspension.
+        """
+        await self.stop()
+
+        clients = [(user_id, client, True) for user_id, client in self._active_clients.items()]
+        clients += [(user_id, client, False) for user_id, client in self._unauthorized_clients.items()]
+        self._active_clients.clear()
+        self._unauthorized_clients.clear()
+        self._last_used.clear()
+        self._created_at.clear()
+        self._passive.clear()
+        self._suspended.clear()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def close(user_id: UUID, client: TelegramClient) -> None:
+            async with semaphore:
+                await self._disconnect(user_id, client, checkpoint=False)
+
+        async def close_all() -> None:
+            # The sessions are checkpointed in one batch before the slow disconnects
+            active = [(user_id, client) for user_id, client, is_active in clients if is_active]
+            try:
+                await checkpointer.checkpoint_many(active)
+            except Exception as e:
+                logger.error("Failed to checkpoint sessions on shutdown: %s", str(e))
+            for user_id, _ in active:
+                checkpointer.forget(user_id)
+            await asyncio.gather(*(close(user_id, client) for user_id, client, _ in clients))
+
+        logger.info("Disconnecting %s clients on shutdown.", len(clients))
+        try:
+            await asyncio.wait_for(close_all(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Clients have not been disconnected within %s seconds.", timeout)
+        else:
+            logger.info("All clients have been disconnected.")
+
+    async def sweep(self) -> None:
+        """
+        Evict unauthorized clients which outlived their TTL and active clients
+        which have been idle for longer than the idle timeout. Passive clients idle
+        for longer than their own timeout are suspended instead.
+        """
+        now = time.monotonic()
+
+        if self._unauthorized_ttl is not None:
+            expired = [
+                user_id for user_id, created_at in self._created_at.items()
+                if now - created_at > self._unauthorized_ttl
+            ]
+            for user_id in expired:
+                client = self._unauthorized_clients.pop(user_id)
+                self._created_at.pop(user_id, None)
+                self._passive.discard(user_id)
+                self._forget_session(user_id)
+                self._evictions["unauthorized_expired"] += 1
+                self._client_removed(user_id)
+                logger.info("Unauthorized client for user %s has expired and is evicted.", user_id)
+                self._close(user_id, client, checkpoint=False)
+
+        if self._active_idle_timeout is not None:
+            # Clients are in LRU order, so stop at the first recently used one
+            idle = []
+            for user_id in self._active_clients:
+                if now - self._last_used[user_id] <= self._active_idle_timeout:
+                    break
+                if user_id not in self._leases:
+                    idle.append(user_id)
+            for user_id in idle:
+                client = self._active_clients.pop(user_id)
+                self._last_used.pop(user_id, None)
+                self._passive.discard(user_id)
+                self._evictions["active_idle"] += 1
+                self._client_removed(user_id)
+                logger.info("Active client for user %s is idle and is evicted.", user_id)
+                self._close(user_id, client, checkpoint=True)
+
+        if self._passive_suspend_after is not None:
+            idle = [
+                user_id for user_id in self._passive
+                if user_id in self._active_clients and user_id not in self._leases
+                and now - self._last_used[user_id] > self._passive_suspend_after
+            ]
+            for user_id in idle:
+                self._suspend(user_id)
+
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("Failed to sweep the client storage: %s", str(e))
+
+    def _enforce_active_limit(self) -> None:
+        if self._active_limit is None:
+            return
+
+        while len(self._active_clients) > self._active_limit:
+            # The least recently used client which is not leased, the limit is exceeded until one is released
+            user_id = next((user_id for user_id in self._active_clients if user_id not in self._leases), None)
+            if user_id is None:
+                return
+            client = self._active_clients.pop(user_id)
+            self._last_used.pop(user_id, None)
+            self._passive.discard(user_id)
+            self._evictions["active_over_limit"] += 1
+            self._client_removed(user_id)
+            logger.info("Active clients limit is reached. Client for user %s is evicted.", user_id)
+            self._close(user_id, client, checkpoint=True)
+
+    def _set_passive(self, user_id: UUID, passive: bool) -> None:
+        if passive:
+            self._passive.add(user_id)
+        else:
+            self._passive.discard(user_id)
+
+    def _suspend(self, user_id: UUID) -> None:
+        """
+        Keep only the session of an idle passive client and disconnect it in the background.
+        The client stays registered as active, it is reconnected on its next use.
+        """
+        client = self._active_clients.pop(user_id)
+        self._last_used.pop(user_id, None)
+        self._suspended[user_id] = client.session.save()
+        self._suspensions["suspended"] += 1
+        logger.info("Passive client for user %s is idle and is suspended.", user_id)
+        self._close(user_id, client, checkpoint=True)
+
+    async def _resume(self, user_id: UUID) -> TelegramClient:
+        """
+        Reconnect the suspended client of the user. If the user has been reconnected
+        meanwhile, the new client is returned, and KeyError is raised if it has been removed.
+        """
+        session_data = self._suspended.get(user_id)
+        if session_data is not None:
+            client = create_client(session_data, passive=True)
+            await client.connect()
+            if self._suspended.get(user_id) != session_data:
+                await client.disconnect()
+                session_data = None
+
+        if session_data is None:
+            current = self.get_active_client(user_id, raise_exc=False)
+            if current is None:
+                raise KeyError(f"Client with user_id {user_id} not found in active clients.")
+            return current
+
+        checkpointer.mark_clean(user_id, session_data)
+        self.add_active_client(user_id, client, passive=True)
+        self._suspensions["resumed"] += 1
+        logger.info("Suspended client for user %s has been reconnected.", user_id)
+        return client
+
+    def _forget_session(self, user_id: UUID) -> None:
+        """
+        Drop the checkpoint hash recorded on connect, unless it belongs to a stored client of the user.
+        """
+        if user_id not in self._active_clients and user_id not in self._suspended:
+            checkpointer.forget(user_id)
+
+    def _client_added(self, user_id: UUID, client: TelegramClient, state: str) -> None:
+        """
+        Called when a client is stored in the given state ("unauthorized" or "active").
+        """
+
+    def _client_removed(self, user_id: UUID) -> None:
+        """
+        Called when a client is removed or evicted from the storage.
+        """
+
+    def _close(self, user_id: UUID, client: TelegramClient, checkpoint: bool) -> None:
+        """
+        Disconnect an evicted client in the background, checkpointing its session if required.
+        """
+        task = asyncio.create_task(self._disconnect(user_id, client, checkpoint))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _disconnect(user_id: UUID, client: TelegramClient, checkpoint: bool) -> None:
+        try:
+            await client.disconnect()
+            if checkpoint:
+                await checkpointer.checkpoint(user_id, client)
+                checkpointer.forget(user_id)
+        except Exception as e:
+            logger.error("Failed to close evicted client for user %s: %s", user_id, str(e))
+
+
+class RegistryClientStorage(InMemoryClientStorage):
+    """
+    In-memory storage which also publishes the location of its clients to a shared registry,
+    so requests can be routed to the node holding a user's client.
+
+    The node keeps its lease alive with heartbeats and saves the last encrypted session
+    of every active client to the registry. When another node's lease expires, its active
+    clients are split between the live nodes by consistent hashing and reconnected
+    from the saved sessions.
+    """
+
+    def __init__(
+        self,
+        registry: ClientRegistry,
+        node_id: str,
+        address: str | None,
+        lease_ttl: float,
+        heartbeat_interval: float,
+        restore_concurrency: int,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.registry = registry
+        self.node_id = node_id
+        self.address = address
+        self._lease_ttl = lease_ttl
+        self._heartbeat_interval = heartbeat_interval
+        self._restore_semaphore = asyncio.Semaphore(restore_concurrency)
+
+        # Registry writes are applied in order by a single writer
+        self._writes: asyncio.Queue = asyncio.Queue()
+        self._writer: asyncio.Task | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._restoring: set[UUID] = set()
+        self._restores: set[asyncio.Task] = set()
+        self._taken_over = 0
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(node_id=self.node_id, restoring=len(self._restoring), taken_over=self._taken_over)
+        return stats
+
+    def start(self) -> None:
+        super().start()
+        checkpointer.subscribe(self._session_saved)
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_forever(), name="client-registry-writer")
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._heartbeat_forever(), name="client-registry-heartbeat")
+
+    async def shutdown(self, concurrency: int, timeout: float) -> None:
+        """
+        Disconnect all the clients and leave the registry. The active clients stay registered
+        with their last sessions, so the other nodes take them over right away.
+        """
+        await self._cancel(self._heartbeat)
+        self._heartbeat = None
+        for task in self._restores:
+            task.cancel()
+
+        await super().shutdown(concurrency, timeout)
+
+        try:
+            await asyncio.wait_for(self._writes.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Registry writes have not been flushed within %s seconds.", timeout)
+        await self._cancel(self._writer)
+        self._writer = None
+        await self.registry.remove_node(self.node_id)
+        logger.info("Node %s has left the client registry.", self.node_id)
+
+    def _client_added(self, user_id: UUID, client: TelegramClient, state: str) -> None:
+        self._writes.put_nowait((self.registry.set_client, (user_id, self.node_id, state)))
+        if state == "active":
+            # The session the client was connected with is needed for a handover
+            self._session_saved(user_id, encrypt_session(client.session.save()))
+
+    def _client_removed(self, user_id: UUID) -> None:
+        self._writes.put_nowait((self.registry.remove_client, (user_id, self.node_id)))
+
+    def _session_saved(self, user_id: UUID, encrypted_session: str) -> None:
+        self._writes.put_nowait((self.registry.save_session, (user_id, encrypted_session)))
+
+    async def _write_forever(self) -> None:
+        while True:
+            method, args = await self._writes.get()
+            try:
+                await method(*args)
+            except Exception as e:
+                logger.error("Failed to update the client registry: %s", str(e))
+            finally:
+                self._writes.task_done()
+
+    async def _heartbeat_forever(self) -> None:
+        while True:
+            try:
+                await self.registry.heartbeat(self.node_id, self.address, self._lease_ttl)
+                await self._take_over_orphans()
+            except Exception as e:
+                logger.error("Failed to heartbeat the client registry: %s", str(e))
+            await asyncio.sleep(self._heartbeat_interval)
+
+    async def _take_over_orphans(self) -> None:
+        """
+        Claim this node's share of the active clients held by dead nodes and reconnect them.
+        """
+        live_nodes = await self.registry.live_nodes()
+        if self.node_id not in live_nodes:
+            return
+
+        ring = HashRing(live_nodes)
+        await self.registry.prune()
+        for user_id, node_id, encrypted_session in await self.registry.orphaned_clients():
+            if user_id in self._restoring or ring.node_for(str(user_id)) != self.node_id:
+                continue
+            if encrypted_session is None:
+                await self.registry.remove_client(user_id, node_id)
+                continue
+            if not await self.registry.claim(user_id, node_id, self.node_id):
+                continue
+
+            logger.info("Taking over the client of user %s from the dead node %s.", user_id, node_id)
+            self._restoring.add(user_id)
+            task = asyncio.create_task(self._restore(user_id, encrypted_session))
+            self._restores.add(task)
+            task.add_done_callback(self._restores.discard)
+
+    async def _restore(self, user_id: UUID, encrypted_session: str) -> None:
+        try:
+            async with self._restore_semaphore:
+                session_data = decrypt_session(encrypted_session)
+                client = create_client(session_data)
+                await client.connect()
+                if not await scheduler.call(client, client.is_user_authorized, priority=Priority.BACKGROUND):
+                    logger.warning("Session of user %s is no longer authorized. Dropping it.", user_id)
+                    await client.disconnect()
+                    await self.registry.remove_client(user_id, self.node_id)
+                    return
+
+                checkpointer.mark_clean(user_id, session_data)
+                self.add_active_client(user_id, client)
+                self._taken_over += 1
+        except Exception as e:
+            logger.error("Failed to take over the client of user %s: %s", user_id, str(e))
+        finally:
+            self._restoring.discard(user_id)
+
+    @staticmethod
+    async def _cancel(task: asyncio.Task | None) -> None:
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+def create_storage() -> ClientStorage:
+    """
+    Create the client storage configured by STORAGE_BACKEND.
+    """
+    limits = dict(
+        unauthorized_ttl=settings.UNAUTHORIZED_CLIENT_TTL,
+        active_limit=settings.ACTIVE_CLIENTS_LIMIT,
+        active_idle_timeout=settings.ACTIVE_CLIENT_IDLE_TIMEOUT,
+        passive_suspend_after=settings.PASSIVE_CLIENT_SUSPEND_AFTER,
+        sweep_interval=settings.CLIENT_STORAGE_SWEEP_INTERVAL,
+    )
+    if settings.STORAGE_BACKEND == "memory":
+        return InMemoryClientStorage(**limits)
+    if settings.STORAGE_BACKEND == "registry":
+        return RegistryClientStorage(
+            registry=SQLiteClientRegistry(settings.REGISTRY_PATH),
+            node_id=settings.NODE_ID or f"{socket.gethostname()}-{os.getpid()}",
+            address=settings.NODE_ADDRESS,
+            lease_ttl=settings.REGISTRY_LEASE_TTL,
+            heartbeat_interval=settings.REGISTRY_HEARTBEAT_INTERVAL,
+            restore_concurrency=settings.REGISTRY_RESTORE_CONCURRENCY,
+            **limits,
+        )
+    raise ValueError(f"Unknown storage backend: {settings.STORAGE_BACKEND}")
+
 
-storage = ClientStorage()
\ No newline at end of file
+storage = create_storage()
@@ -1,25 +1,142 @@
+import asyncio
 import logging
-from typing import Any
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+
+from app.config import settings
+from app.services.scheduler import Priority, scheduler
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Default entity_cache_limit of Telethon, restored on promotion
+FULL_ENTITY_CACHE_LIMIT = 5000
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into a single in-flight execution.
+    Every caller awaits the same operation and gets its result or its exception.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            logger.info("Joining the in-flight call for %s", key)
+
+        # Shield the shared operation, so one cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()  # Mark the exception as retrieved if every caller has gone
+
+
+class CappedStringSession(StringSession):
+    """
+    StringSession keeping at most `entity_limit` entities, the least recently seen are dropped.
+    The memory session otherwise stores every user and chat seen in any response.
+    A limit of None keeps them all.
+    """
+
+    def __init__(self, string: str | None = None, entity_limit: int | None = None):
+        super().__init__(string)
+        self.entity_limit = entity_limit
+        self._entity_rows: OrderedDict[int, tuple] = OrderedDict()  # {entity id: row in _entities}
+
+    def process_entities(self, tlo) -> None:
+        for row in self._entities_to_rows(tlo):
+            previous = self._entity_rows.pop(row[0], None)
+            if previous is not None:
+                self._entities.discard(previous)
+            self._entity_rows[row[0]] = row
+            self._entities.add(row)
+            # Trimmed row by row, so the containers never grow past the limit
+            if self.entity_limit is not None and len(self._entity_rows) > self.entity_limit:
+                _, oldest = self._entity_rows.popitem(last=False)
+                self._entities.discard(oldest)
+
+
+def as_utc(value: datetime | None) -> datetime | None:
+    """
+    Treat a naive datetime as UTC, so it can be compared with the aware dates of Telegram.
+    """
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def create_client(session_data: str, passive: bool = False) -> TelegramClient:
+    """
+    Create a Telegram client from the decrypted session data.
+    FloodWaits are left to the scheduler, so Telethon doesn't sleep through them itself.
+    A passive client receives no updates and keeps capped entity caches.
+    """
+    if passive:
+        return TelegramClient(
+            CappedStringSession(session_data, entity_limit=settings.PASSIVE_ENTITY_CACHE_LIMIT),
+            settings.TG_API_ID,
+            settings.TG_API_HASH,
+            flood_sleep_threshold=settings.TG_FLOOD_SLEEP_THRESHOLD,
+            receive_updates=False,
+            entity_cache_limit=settings.PASSIVE_ENTITY_CACHE_LIMIT,
+        )
+
+    return TelegramClient(
+        StringSession(session_data),
+        settings.TG_API_ID,
+        settings.TG_API_HASH,
+        flood_sleep_threshold=settings.TG_FLOOD_SLEEP_THRESHOLD,
+    )
+
+
+async def promote_client(client: TelegramClient, priority=Priority.INTERACTIVE) -> None:
+    """
+    Turn a passive client into a full one in place: lift the entity cache limits
+    and ask Telegram to send updates again.
+    """
+    if isinstance(client.session, CappedStringSession):
+        client.session.entity_limit = None
+    client._entity_cache_limit = FULL_ENTITY_CACHE_LIMIT
+    await scheduler.call(client, client.set_receive_updates, True, priority=priority)
+
 
-async def send_welcome_message(client, user="me") -> None:
+async def send_welcome_message(client, user="me", priority=Priority.INTERACTIVE) -> None:
     """
     Send a welcome message to the user.
     """
-    await client.send_message(
+    await scheduler.call(
+        client,
+        client.send_message,
         user,
         "Welcome to the Vacancy Collector Application! "
         "You are successfully connected.",
+        priority=priority,
     )
 
 
-async def get_user_info(client, user_id, raise_exc=False) -> Any | None:
+async def get_user_info(client, user_id, raise_exc=False, priority=Priority.INTERACTIVE) -> Any | None:
     """
     Retrieve basic user information.
     """
-    me = await client.get_me()
+    me = await scheduler.call(client, client.get_me, priority=priority)
     if not me:
         logger.error("Failed to retrieve basic info for user %s", user_id)
         if raise_exc:
@@ -0,0 +1,97 @@
+"""
+Memory held per client in each mode: full, passive and suspended.
+
+Clients are built by create_client and are not connected. Each one is fed the same
+responses full of users and chats as if it had resolved them, so its session keeps as
+many entities as the mode allows. Full clients are also fed the same entities as updates,
+which passive clients don't receive. A suspended client is only its session string.
+The connection buffers and tasks of a live client come on top of the full and passive
+figures, see load_test.py for the RSS of connected clients.
+Run from the repository root:
+
+    python benchmarks/client_footprint.py --clients 500 --entities 2000
+"""
+import argparse
+import base64
+import gc
+import os
+import pathlib
+import sys
+import tracemalloc
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
+
+from telethon.tl.types import Channel, ChatPhotoEmpty, User, contacts  # NOQA: E402
+
+from app.config import settings  # NOQA: E402
+from app.utils import create_client  # NOQA: E402
+from crypto_sessions import fake_session  # NOQA: E402
+
+
+def resolved_peers(count: int, offset: int) -> contacts.ResolvedPeer:
+    users = [
+        User(id=offset + number, access_hash=number, first_name="User", username=f"user{offset + number}")
+        for number in range(count // 2)
+    ]
+    chats = [
+        Channel(
+            id=offset + number, title="Channel", photo=ChatPhotoEmpty(), date=None,
+            access_hash=number, username=f"channel{offset + number}",
+        )
+        for number in range(count // 2, count)
+    ]
+    return contacts.ResolvedPeer(peer=None, users=users, chats=chats)
+
+
+def measure(args: argparse.Namespace, mode: str) -> int:
+    """
+    Return the bytes allocated per client of the mode.
+    """
+    # Responses are built before the measurement, only what the clients keep is counted
+    responses = [resolved_peers(args.entities, offset) for offset in (0, args.entities)]
+    sessions = [fake_session() for _ in range(args.clients)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    held = []
+    for session_data in sessions:
+        client = create_client(session_data, passive=mode == "passive")
+        for response in responses:
+            client.session.process_entities(response)
+            if mode == "full":
+                client._mb_entity_cache.extend(response.users, response.chats)
+        if mode == "suspended":
+            # Only the session string outlives a suspended client
+            held.append(client.session.save())
+        else:
+            held.append(client)
+        del client
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) // args.clients
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--entities", type=int, default=2000, help="Users and chats seen by every client")
+    args = parser.parse_args()
+
+    print(
+        f"{args.clients} clients, {args.entities * 2} entities seen each, "
+        f"PASSIVE_ENTITY_CACHE_LIMIT={settings.PASSIVE_ENTITY_CACHE_LIMIT}\n"
+    )
+    full = measure(args, "full")
+    for mode in ("full", "passive", "suspended"):
+        size = full if mode == "full" else measure(args, mode)
+        print(f"{mode:<10} {size:>10} bytes/client  {full / size:8.1f}x clients per box")
+
+
+if __name__ == "__main__":
+    main()
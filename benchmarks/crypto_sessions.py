@@ -0,0 +1,121 @@
+"""
+Micro-benchmark of the session encryption: throughput per 1k sessions.
+
+Compares the former per-call Cipher construction with the shared AESGCM key object,
+both envelopes, and the batch APIs. Run from the repository root:
+
+    python benchmarks/crypto_sessions.py --sessions 10000
+"""
+import argparse
+import asyncio
+import base64
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
+
+from cryptography.hazmat.backends import default_backend  # NOQA: E402
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # NOQA: E402
+from telethon.crypto import AuthKey  # NOQA: E402
+from telethon.sessions import StringSession  # NOQA: E402
+
+from app.security.crypto import (  # NOQA: E402
+    ENCRYPTION_KEY,
+    decrypt_session,
+    decrypt_sessions,
+    encrypt_session,
+    encrypt_sessions,
+)
+
+
+def cipher_per_call_encrypt(data: str) -> str:
+    # The implementation replaced by the shared key object
+    iv = os.urandom(12)
+    encryptor = Cipher(algorithms.AES(ENCRYPTION_KEY), modes.GCM(iv), backend=default_backend()).encryptor()
+    ciphertext = encryptor.update(data.encode()) + encryptor.finalize()
+    return ":".join(base64.b64encode(part).decode() for part in (ciphertext, iv, encryptor.tag))
+
+
+def cipher_per_call_decrypt(encrypted_data: str) -> str:
+    ciphertext, iv, tag = map(base64.b64decode, encrypted_data.split(":"))
+    decryptor = Cipher(algorithms.AES(ENCRYPTION_KEY), modes.GCM(iv, tag), backend=default_backend()).decryptor()
+    return (decryptor.update(ciphertext) + decryptor.finalize()).decode()
+
+
+def fake_session() -> str:
+    session = StringSession()
+    session.set_dc(2, "149.154.167.51", 443)
+    session.auth_key = AuthKey(os.urandom(256))
+    return session.save()
+
+
+async def measure_loop_lag(work) -> tuple[float, float]:
+    """
+    Run the work and return its duration and the longest stall of the event loop meanwhile.
+    """
+    lag, running = 0.0, True
+
+    async def probe() -> None:
+        nonlocal lag
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0)
+            lag = max(lag, time.perf_counter() - started)
+
+    task = asyncio.create_task(probe())
+    await asyncio.sleep(0)  # Let the probe start before the work
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    running = False
+    await task
+    return elapsed, lag
+
+
+def report(name: str, count: int, elapsed: float, lag: float | None = None) -> None:
+    line = f"{name:<34} {elapsed / count * 1000 * 1000:9.2f} ms/1k  {count / elapsed:12.0f} sessions/s"
+    if lag is not None:
+        line += f"  max loop stall {lag * 1000:8.2f} ms"
+    print(line)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    args = parser.parse_args()
+
+    sessions = [fake_session() for _ in range(args.sessions)]
+    legacy = [encrypt_session(data, "legacy") for data in sessions]
+    compact = [encrypt_session(data, "compact") for data in sessions]
+    print(f"{args.sessions} sessions, legacy blob {len(legacy[0])} chars, compact blob {len(compact[0])} chars\n")
+
+    for name, func, items in (
+        ("encrypt, Cipher per call", cipher_per_call_encrypt, sessions),
+        ("encrypt, shared key, legacy", lambda data: encrypt_session(data, "legacy"), sessions),
+        ("encrypt, shared key, compact", lambda data: encrypt_session(data, "compact"), sessions),
+        ("decrypt, Cipher per call", cipher_per_call_decrypt, legacy),
+        ("decrypt, shared key, legacy", decrypt_session, legacy),
+        ("decrypt, shared key, compact", decrypt_session, compact),
+    ):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        report(name, len(items), time.perf_counter() - started)
+
+    print()
+    for name, work in (
+        ("loop, encrypt one by one", lambda: asyncio.sleep(0, [encrypt_session(data) for data in sessions])),
+        ("batch, encrypt_sessions", lambda: encrypt_sessions(sessions)),
+        ("loop, decrypt one by one", lambda: asyncio.sleep(0, [decrypt_session(data) for data in legacy])),
+        ("batch, decrypt_sessions", lambda: decrypt_sessions(legacy)),
+    ):
+        elapsed, lag = await measure_loop_lag(work)
+        report(name, len(sessions), elapsed, lag)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""
+In-process stand-ins for Telegram and the main service, used by load_test.py.
+"""
+import asyncio
+import os
+import random
+from dataclasses import dataclass, field
+from itertools import count
+
+from aiohttp import web
+from telethon import TelegramClient
+from telethon.crypto import AuthKey
+from telethon.errors import FloodWaitError, RPCError
+from telethon.sessions import StringSession
+from telethon.tl.types import User
+
+TELEGRAM_DC = (2, "149.154.167.51", 443)
+
+
+@dataclass
+class FakeTelegramProfile:
+    latency: float = 0.05  # Mean seconds per call, exponentially distributed
+    flood_rate: float = 0.0  # Share of calls failing with FloodWaitError
+    flood_seconds: int = 1
+    failure_rate: float = 0.0  # Share of calls failing with an RPC error
+    calls: dict[str, int] = field(default_factory=dict)
+    floods: int = 0
+    failures: int = 0
+
+
+class FakeTelegramClient(TelegramClient):
+    """
+    TelegramClient whose network methods are simulated, so the memory held per client
+    is the one of a real client, while calls only cost the configured latency.
+    A session without an auth key is unauthorized until sign_in.
+    """
+
+    profile = FakeTelegramProfile()
+    _ids = count(1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._fake_connected = False
+
+    async def _fake_call(self, name: str, faulty: bool = True) -> None:
+        profile = self.profile
+        profile.calls[name] = profile.calls.get(name, 0) + 1
+        await asyncio.sleep(random.expovariate(1 / profile.latency) if profile.latency > 0 else 0)
+        if not faulty:
+            return
+        roll = random.random()
+        if roll < profile.flood_rate:
+            profile.floods += 1
+            raise FloodWaitError(request=None, capture=profile.flood_seconds)
+        if roll < profile.flood_rate + profile.failure_rate:
+            profile.failures += 1
+            raise RPCError(request=None, message="INTERNAL_SERVER_ERROR", code=500)
+
+    async def connect(self) -> None:
+        # Connecting is not an RPC, Telegram doesn't answer it with FloodWait
+        await self._fake_call("connect", faulty=False)
+        if self.session.server_address is None:
+            # A new session is bound to a data center on the first connection
+            self.session.set_dc(*TELEGRAM_DC)
+        self._fake_connected = True
+
+    def is_connected(self) -> bool:
+        return self._fake_connected
+
+    async def disconnect(self) -> None:
+        self._fake_connected = False
+
+    async def is_user_authorized(self) -> bool:
+        await self._fake_call("is_user_authorized")
+        return self.session.auth_key is not None
+
+    async def send_code_request(self, phone: str, **kwargs) -> None:
+        await self._fake_call("send_code_request")
+
+    async def sign_in(self, phone: str | None = None, code: str | None = None, **kwargs) -> User:
+        await self._fake_call("sign_in")
+        self.session.auth_key = AuthKey(os.urandom(256))
+        return await self.get_me()
+
+    async def get_me(self, input_peer: bool = False) -> User:
+        await self._fake_call("get_me")
+        return User(id=next(self._ids), first_name="Load", last_name="Test", phone="10000000000")
+
+    async def send_message(self, *args, **kwargs) -> None:
+        await self._fake_call("send_message")
+
+    async def __call__(self, request, ordered: bool = False):
+        await self._fake_call(type(request).__name__)
+
+
+def authorized_session() -> str:
+    """
+    Session data of an authorized account, as the main service would store it decrypted.
+    """
+    session = StringSession()
+    session.set_dc(*TELEGRAM_DC)
+    session.auth_key = AuthKey(os.urandom(256))
+    return session.save()
+
+
+class MainServiceStub:
+    """
+    Local HTTP server accepting the session uploads and pushed messages of the app.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sessions = 0
+        self.messages = 0
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def _store_session(self, request: web.Request) -> web.Response:
+        await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sessions += 1
+        return web.json_response({"status": "ok"})
+
+    async def _new_messages(self, request: web.Request) -> web.Response:
+        self.messages += len(await request.json())
+        return web.json_response({"status": "ok"})
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/store_session/{user_id}", self._store_session)
+        app.router.add_post("/new_messages", self._new_messages)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
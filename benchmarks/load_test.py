@@ -0,0 +1,305 @@
+"""
+Load test of /connect, /authorize_client and /disconnect against a fake Telegram backend.
+
+The app runs in-process under uvicorn with FakeTelegramClient in place of the Telethon
+client, and session uploads go to a local stub of the main service. Every user goes
+through connect (and authorize_client if its session is not authorized), all clients are
+held while the memory is measured, then every user disconnects. The report is JSON with
+the latency percentiles and the throughput per phase and the RSS per held client.
+Run from the repository root:
+
+    python benchmarks/load_test.py --users 1000 --concurrency 200 --output result.json
+    python benchmarks/load_test.py --users 1000 --baseline result.json  # exits 1 on a regression
+
+The Telegram rate limits of the app apply; raise them with --tg-global-rate and
+--tg-client-rate to measure the app rather than the limits.
+"""
+import argparse
+import asyncio
+import base64
+import gc
+import json
+import logging
+import os
+import pathlib
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+from telethon.sessions import StringSession
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "app")]
+
+from fake_telegram import FakeTelegramClient, MainServiceStub, authorized_session  # NOQA: E402
+
+API_KEY = "load-test"
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current RSS, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.statuses: dict[str, int] = {}
+        self.started = self.finished = 0.0
+
+    def record(self, latency: float, status: int | str) -> None:
+        self.latencies.append(latency)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def report(self) -> dict:
+        duration = self.finished - self.started
+        return {
+            "requests": len(self.latencies),
+            "errors": sum(count for status, count in self.statuses.items() if not status.startswith("2")),
+            "statuses": self.statuses,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(self.latencies) / duration, 2) if duration else 0.0,
+            "p50_ms": round(percentile(self.latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(self.latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(self.latencies, 0.99) * 1000, 2),
+            "max_ms": round(max(self.latencies, default=0.0) * 1000, 2),
+        }
+
+
+async def run_phase(phase: Phase, requests: list, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(request) -> int | str:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await request()
+            except Exception as e:
+                status = type(e).__name__
+            phase.record(time.perf_counter() - started, status)
+            return status
+
+    phase.started = time.perf_counter()
+    results = await asyncio.gather(*(run(request) for request in requests))
+    phase.finished = time.perf_counter()
+    return results
+
+
+def find_regressions(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the latency, throughput and memory with a previous result.
+    """
+    regressions = []
+    for name, phase in result["phases"].items():
+        previous = baseline.get("phases", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if previous[metric] and phase[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {previous[metric]} -> {phase[metric]}")
+        if phase["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}.throughput_rps: {previous['throughput_rps']} -> {phase['throughput_rps']}")
+
+    previous_rss = baseline.get("memory", {}).get("rss_per_client_bytes")
+    rss = result["memory"]["rss_per_client_bytes"]
+    if previous_rss and rss > previous_rss * (1 + tolerance):
+        regressions.append(f"memory.rss_per_client_bytes: {previous_rss} -> {rss}")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> dict:
+    stub = MainServiceStub(latency=args.main_service_latency)
+    main_service_url = await stub.start()
+
+    # The app reads its settings on import
+    os.environ["MAIN_SERVICE_URL"] = main_service_url
+    os.environ["API_KEY"] = API_KEY
+    os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
+    state = tempfile.mkdtemp(prefix="load-test-")
+    for name, path in (
+        ("SYNC_STATE_PATH", "sync_state.sqlite3"),
+        ("MESSAGE_INDEX_PATH", "message_index.sqlite3"),
+        ("MEDIA_CACHE_PATH", "media_cache"),
+        ("EXPORT_PATH", "exports"),
+    ):
+        os.environ[name] = os.path.join(state, path)
+    if args.tg_global_rate:
+        os.environ["TG_GLOBAL_RATE"] = os.environ["TG_GLOBAL_BURST"] = str(args.tg_global_rate)
+    if args.tg_client_rate:
+        os.environ["TG_CLIENT_RATE"] = os.environ["TG_CLIENT_BURST"] = str(args.tg_client_rate)
+
+    import uvicorn
+
+    import app.api.v1.endpoints
+    import app.storage
+    from app.config import settings
+    from app.main import app as application
+    from app.security.crypto import encrypt_session
+
+    profile = FakeTelegramClient.profile
+    profile.latency = args.latency
+    profile.flood_rate = args.flood_rate
+    profile.flood_seconds = args.flood_seconds
+    profile.failure_rate = args.failure_rate
+
+    def create_client(session_data: str, passive: bool = False) -> FakeTelegramClient:
+        return FakeTelegramClient(
+            StringSession(session_data), settings.TG_API_ID, settings.TG_API_HASH, receive_updates=not passive,
+        )
+
+    app.api.v1.endpoints.create_client = create_client
+    app.storage.create_client = create_client
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        application, host="127.0.0.1", port=port, lifespan="on", log_level=args.log_level.lower(), access_log=False,
+    ))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        if serving.done():
+            await serving
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{port}/api/v1"
+    headers = {"x-api-key": API_KEY}
+    users = []
+    for number in range(args.users):
+        user_id = str(uuid.uuid4())
+        authorized = number >= args.users * args.unauthorized_share
+        users.append({
+            "id": str(uuid.uuid4()),
+            "session_data": encrypt_session(authorized_session()) if authorized else "",
+            "is_active": True,
+            "user_id": user_id,
+            "user": {
+                "id": user_id,
+                "phone": f"+1{number:010d}",
+                "email": f"user{number}@example.com",
+                "channels": [],
+                "telegram_connection_id": None,
+            },
+        })
+
+    phases = {name: Phase(name) for name in ("connect", "authorize_client", "disconnect")}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as http:
+        async def post(path: str, body: dict | None = None) -> int:
+            async with http.post(base_url + path, json=body) as response:
+                await response.read()
+                return response.status
+
+        gc.collect()
+        rss_before = rss_bytes()
+
+        statuses = await run_phase(
+            phases["connect"], [lambda user=user: post("/connect", user) for user in users], args.concurrency,
+        )
+        # Users without an authorized session have been sent a code
+        pending = [user for user, status in zip(users, statuses) if status == 401]
+        await run_phase(
+            phases["authorize_client"],
+            [
+                lambda user=user: post("/authorize_client", {
+                    "user_id": user["user_id"], "phone": user["user"]["phone"], "code": "12345",
+                })
+                for user in pending
+            ],
+            args.concurrency,
+        )
+
+        async with http.get(base_url + "/storage/stats") as response:
+            held = (await response.json())["data"]["active"]
+        gc.collect()
+        rss_held = rss_bytes()
+
+        await run_phase(
+            phases["disconnect"],
+            [lambda user=user: post(f"/disconnect/{user['user_id']}") for user in users],
+            args.concurrency,
+        )
+
+    server.should_exit = True
+    await serving
+    await stub.stop()
+
+    try:
+        version = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True,
+        ).stdout.strip()
+    except OSError:
+        version = None
+
+    return {
+        "version": version,
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_level")},
+        "phases": {name: phase.report() for name, phase in phases.items()},
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "rss_held_bytes": rss_held,
+            "held_clients": held,
+            "rss_per_client_bytes": (rss_held - rss_before) // held if held else None,
+        },
+        "telegram": {"calls": profile.calls, "flood_waits": profile.floods, "failures": profile.failures},
+        "main_service": {"sessions_stored": stub.sessions},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at once")
+    parser.add_argument("--unauthorized-share", type=float, default=0.1,
+                        help="Share of users going through authorize_client")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean seconds per fake Telegram call")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="Share of calls failing with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of calls failing with an RPC error")
+    parser.add_argument("--main-service-latency", type=float, default=0.0, help="Seconds per session upload")
+    parser.add_argument("--tg-global-rate", type=float, help="Override TG_GLOBAL_RATE and TG_GLOBAL_BURST")
+    parser.add_argument("--tg-client-rate", type=float, help="Override TG_CLIENT_RATE and TG_CLIENT_BURST")
+    parser.add_argument("--log-level", default="CRITICAL", help="Log level of the app, injected errors are logged")
+    parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    parser.add_argument("--baseline", help="Previous JSON result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=arguments.log_level)
+    result = asyncio.run(main(arguments))
+
+    output = json.dumps(result, indent=2)
+    if arguments.output:
+        pathlib.Path(arguments.output).write_text(output)
+    else:
+        print(output)
+
+    if arguments.baseline:
+        found = find_regressions(result, json.loads(pathlib.Path(arguments.baseline).read_text()), arguments.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        sys.exit(1 if found else 0)
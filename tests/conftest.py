@@ -0,0 +1,5 @@
+import base64
+import os
+
+# Settings are read at import time and the encryption key is required
+os.environ.setdefault("ENCRYPTION_KEY", base64.b64encode(os.urandom(32)).decode())
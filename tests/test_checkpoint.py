@@ -0,0 +1,56 @@
+import asyncio
+import uuid
+
+from app.services import checkpoint
+from app.services.checkpoint import SessionCheckpointer
+
+
+class FakeSession:
+    def __init__(self, data: str):
+        self.data = data
+
+    def save(self) -> str:
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, data: str):
+        self.session = FakeSession(data)
+
+
+async def test_replaced_client_is_not_checkpointed(monkeypatch):
+    uploaded = []
+
+    async def enqueue(user_id, encrypted_session):
+        uploaded.append(user_id)
+
+    monkeypatch.setattr(checkpoint.session_uploader, "enqueue", enqueue)
+    monkeypatch.setattr(checkpoint, "encrypt_session", lambda data: data)
+    kept, replaced = uuid.uuid4(), uuid.uuid4()
+    old, new = FakeClient("old"), FakeClient("new")
+    current = {kept: FakeClient("kept"), replaced: new}
+    snapshot = [(kept, current[kept]), (replaced, old)]
+
+    checkpointer = SessionCheckpointer(interval=0.01)
+    checkpointer.start(lambda: snapshot, current.get)
+    await asyncio.sleep(0.05)
+    await checkpointer.stop()
+
+    assert set(uploaded) == {kept}
+
+
+async def test_removed_unauthorized_client_forgets_its_session(monkeypatch):
+    from app.storage import InMemoryClientStorage
+
+    forgotten = []
+    monkeypatch.setattr(checkpoint.checkpointer, "forget", forgotten.append)
+    storage = InMemoryClientStorage(unauthorized_ttl=0)
+    removed, expired = uuid.uuid4(), uuid.uuid4()
+    for user_id in (removed, expired):
+        storage.add_unauthorized_client(user_id, FakeClient("session"))
+
+    storage.remove_unauthorized_client(removed)
+    storage._close = lambda *args, **kwargs: None
+    await storage.sweep()
+
+    assert forgotten == [removed, expired]
@@ -0,0 +1,51 @@
+import base64
+import os
+
+import pytest
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from app.security import crypto
+from app.security.crypto import decrypt_session, decrypt_sessions, encrypt_session, encrypt_sessions
+
+
+def legacy_encrypt(data: str) -> str:
+    """
+    The envelope written before the compact one existed, as the main service still stores it.
+    """
+    iv = os.urandom(12)
+    encryptor = Cipher(algorithms.AES(crypto.ENCRYPTION_KEY), modes.GCM(iv)).encryptor()
+    ciphertext = encryptor.update(data.encode()) + encryptor.finalize()
+    return ":".join(base64.b64encode(part).decode() for part in (ciphertext, iv, encryptor.tag))
+
+
+def test_legacy_envelope_is_decrypted():
+    session_data = "1BVtsOHkBu6wQ1" + "A" * 300
+    assert decrypt_session(legacy_encrypt(session_data)) == session_data
+
+
+@pytest.mark.parametrize("envelope", ["legacy", "compact"])
+def test_envelope_round_trip(envelope):
+    encrypted = encrypt_session("session", envelope)
+    assert encrypted.startswith(crypto.COMPACT_PREFIX) == (envelope == "compact")
+    assert decrypt_session(encrypted) == "session"
+
+
+def test_tampered_envelope_is_rejected():
+    ciphertext, iv, tag = legacy_encrypt("session").split(":")
+    tampered = ":".join((ciphertext, iv, base64.b64encode(bytes(16)).decode()))
+    with pytest.raises(Exception):
+        decrypt_session(tampered)
+
+
+async def test_batches_mix_both_envelopes(monkeypatch):
+    monkeypatch.setattr(crypto.settings, "CRYPTO_THREAD_THRESHOLD", 2)
+    monkeypatch.setattr(crypto.settings, "CRYPTO_CHUNK_SIZE", 2)
+    sessions = [f"session-{number}" for number in range(5)]
+    encrypted = await encrypt_sessions(sessions, "compact")
+    encrypted[1] = legacy_encrypt(sessions[1])
+    encrypted[3] = "not:an:envelope"
+
+    results = await decrypt_sessions(encrypted, return_exceptions=True)
+
+    assert [results[index] for index in (0, 1, 2, 4)] == [sessions[index] for index in (0, 1, 2, 4)]
+    assert isinstance(results[3], Exception)
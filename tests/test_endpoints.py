@@ -0,0 +1,166 @@
+import asyncio
+import uuid
+
+import pytest
+from telethon.errors import SessionPasswordNeededError
+
+from app import utils
+from app.api.v1 import endpoints
+from app.exceptions.exceptions import AuthTelegramException
+from app.models import Connection
+from app.security.crypto import encrypt_session
+from app.services.scheduler import TelegramScheduler
+from app.services.verification import VerifiedSessionCache
+from app.storage import InMemoryClientStorage
+
+
+class FakeSession:
+    def __init__(self, data: str):
+        self.data = data
+
+    def save(self) -> str:
+        return self.data
+
+
+class FakeClient:
+    """
+    Client whose behaviour is picked by its session data: "unauthorized", "2fa", "broken" or anything else.
+    """
+
+    def __init__(self, data: str):
+        self.session = FakeSession(data)
+        self.calls = []
+
+    async def connect(self) -> None:
+        self.calls.append("connect")
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def is_user_authorized(self) -> bool:
+        return self.session.data != "unauthorized"
+
+    async def send_code_request(self, phone):
+        self.calls.append("send_code_request")
+
+    async def send_message(self, peer, text):
+        self.calls.append("send_message")
+        if self.session.data == "2fa":
+            raise SessionPasswordNeededError(request=None)
+
+    async def get_me(self):
+        self.calls.append("get_me")
+        if self.session.data == "broken":
+            raise ConnectionError("Telegram is unavailable.")
+        return {"id": 1}
+
+
+@pytest.fixture
+async def telegram(monkeypatch):
+    """
+    Fake Telegram clients behind the endpoints, with a storage and a scheduler of their own.
+    """
+    clients = []
+
+    def create_client(session_data, passive=False):
+        clients.append(FakeClient(session_data))
+        return clients[-1]
+
+    scheduler = TelegramScheduler(
+        global_rate=1000, global_burst=1000, client_rate=1000, client_burst=1000, max_flood_wait=1,
+    )
+    monkeypatch.setattr(endpoints, "create_client", create_client)
+    monkeypatch.setattr(endpoints, "storage", InMemoryClientStorage())
+    monkeypatch.setattr(endpoints, "scheduler", scheduler)
+    monkeypatch.setattr(utils, "scheduler", scheduler)
+    monkeypatch.setattr(endpoints, "verified_sessions", VerifiedSessionCache(ttl=60, max_size=100))
+    yield clients
+    await scheduler.stop()
+
+
+def connection(session_data: str, user_id: uuid.UUID | None = None) -> Connection:
+    user_id = user_id or uuid.uuid4()
+    return Connection(
+        id=uuid.uuid4(),
+        session_data=encrypt_session(session_data),
+        is_active=True,
+        user_id=user_id,
+        user={
+            "id": user_id, "phone": "+10000000000", "email": "user@example.com",
+            "channels": None, "telegram_connection_id": None,
+        },
+    )
+
+
+async def test_batch_connect_reports_every_user(telegram):
+    connections = [connection("valid"), connection("unauthorized"), connection("2fa"), connection("broken")]
+    undecryptable = connection("valid")
+    undecryptable.session_data = "not-encrypted"
+
+    response = await endpoints.connect_batch([*connections, undecryptable])
+
+    assert response["status_code"] == 200
+    assert {user_id: result["status"] for user_id, result in response["data"].items()} == {
+        str(connections[0].user.id): "active",
+        str(connections[1].user.id): "code_sent",
+        str(connections[2].user.id): "2fa_required",
+        str(connections[3].user.id): "failed",
+        str(undecryptable.user.id): "failed",
+    }
+    assert response["data"][str(connections[0].user.id)]["error"] is None
+    assert "unavailable" in response["data"][str(connections[3].user.id)]["error"]
+    assert endpoints.storage.get_active_client(connections[0].user.id) is telegram[0]
+    assert endpoints.storage.get_active_client(connections[3].user.id, raise_exc=False) is None
+
+
+async def test_concurrent_connects_of_a_user_share_one(telegram):
+    user_id = uuid.uuid4()
+    first, second = connection("valid", user_id), connection("valid", user_id)
+
+    responses = await asyncio.gather(endpoints.connect(first), endpoints.connect(second))
+
+    assert responses[0] is responses[1]
+    assert len(telegram) == 1
+    assert telegram[0].calls.count("connect") == 1
+
+
+async def test_concurrent_connects_share_the_error(telegram):
+    user_id = uuid.uuid4()
+    results = await asyncio.gather(
+        endpoints.connect(connection("unauthorized", user_id)),
+        endpoints.connect(connection("unauthorized", user_id)),
+        return_exceptions=True,
+    )
+
+    assert [type(result) for result in results] == [AuthTelegramException, AuthTelegramException]
+    assert telegram[0].calls.count("send_code_request") == 1
+    assert len(telegram) == 1
+
+    # The failed flight is over, so the next call connects again
+    with pytest.raises(AuthTelegramException):
+        await endpoints.connect(connection("unauthorized", user_id))
+    assert len(telegram) == 2
+
+
+async def test_recently_verified_session_skips_the_checks(telegram):
+    user_id = uuid.uuid4()
+    await endpoints.connect(connection("valid", user_id))
+    await endpoints.connect(connection("valid", user_id))
+    # A new auth key is verified again
+    await endpoints.connect(connection("migrated", user_id))
+
+    assert [client.calls for client in telegram] == [
+        ["connect", "send_message", "get_me"],
+        ["connect"],
+        ["connect", "send_message", "get_me"],
+    ]
+    await endpoints.storage.stop()
+
+
+async def test_unauthorized_session_is_no_longer_verified(telegram):
+    user_id = uuid.uuid4()
+    await endpoints.connect(connection("valid", user_id))
+    with pytest.raises(AuthTelegramException):
+        await endpoints.connect(connection("unauthorized", user_id))
+
+    assert endpoints.verified_sessions.get(user_id, endpoints.verified_sessions.fingerprint("valid")) is None
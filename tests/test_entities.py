@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+from telethon.tl.types import Channel, ChatPhotoEmpty, InputPeerChannel, PeerChannel
+
+from app.services import entities
+from app.services.entities import EntityCache
+
+
+class FakeClient:
+    def __init__(self, access_hash: int):
+        self.access_hash = access_hash
+        self.calls = []
+
+    async def get_input_entity(self, target):
+        self.calls.append(("get_input_entity", target))
+        return InputPeerChannel(1234, self.access_hash)
+
+    async def get_entity(self, target):
+        self.calls.append(("get_entity", target))
+        return Channel(
+            id=1234, title="Jobs", photo=ChatPhotoEmpty(), date=None, access_hash=self.access_hash, username="jobs",
+        )
+
+
+@pytest.fixture(autouse=True)
+def direct_scheduler(monkeypatch):
+    async def call(client, method, *args, priority=None, **kwargs):
+        return await method(*args, **kwargs)
+
+    monkeypatch.setattr(entities.scheduler, "call", call)
+
+
+@pytest.fixture
+def cache():
+    return EntityCache(max_channels=10, max_users=10, ttl=3600)
+
+
+async def test_username_is_resolved_without_the_full_channel(cache):
+    client = FakeClient(access_hash=1)
+    user_id = uuid.uuid4()
+
+    assert await cache.resolve(client, user_id, "@jobs") == InputPeerChannel(1234, 1)
+    assert await cache.resolve(client, user_id, "1234") == InputPeerChannel(1234, 1)
+    assert client.calls == [("get_input_entity", "jobs")]
+
+
+async def test_full_channel_is_fetched_only_for_an_unknown_id(cache):
+    first, second = FakeClient(access_hash=1), FakeClient(access_hash=2)
+
+    assert await cache.resolve(first, uuid.uuid4(), "1234") == InputPeerChannel(1234, 1)
+    assert first.calls == [("get_input_entity", PeerChannel(1234)), ("get_entity", InputPeerChannel(1234, 1))]
+
+    # Another user resolves it by the username learnt from the full channel
+    assert await cache.resolve(second, uuid.uuid4(), "1234") == InputPeerChannel(1234, 2)
+    assert second.calls == [("get_input_entity", "jobs")]
@@ -0,0 +1,72 @@
+import gzip
+import json
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import export
+from app.services.export import ExportManager
+
+
+class FakeStorage:
+    @contextmanager
+    def lease(self, user_id):
+        yield
+
+
+@pytest.fixture
+def history(monkeypatch):
+    """
+    Fake channel history of message ids 1 to 10, recording the max_id of every walk.
+    """
+    walks = []
+
+    async def iter_history_pages(client, user_id, telegram_id, max_id=0, priority=None):
+        walks.append((telegram_id, max_id))
+        ids = [message_id for message_id in range(10, 0, -1) if not max_id or message_id < max_id]
+        for start in range(0, len(ids), 2):
+            yield SimpleNamespace(messages=[SimpleNamespace(id=message_id) for message_id in ids[start:start + 2]])
+
+    monkeypatch.setattr(export, "iter_history_pages", iter_history_pages)
+    monkeypatch.setattr(export, "project_message", lambda message, fields: {"id": message.id})
+    monkeypatch.setattr(export, "storage", FakeStorage())
+    return walks
+
+
+async def test_interrupted_job_resumes_from_its_saved_state(tmp_path, history):
+    user_id = uuid.uuid4()
+    job_dir = tmp_path / "job-1"
+    job_dir.mkdir()
+    # The previous run stopped after writing the first chunk of channel-a, messages 10 to 7
+    (job_dir / "job.json").write_text(json.dumps({
+        "id": "job-1",
+        "user_id": str(user_id),
+        "channels": [
+            {"telegram_id": "channel-a", "offset_id": 7, "messages": 4, "chunks": 1, "done": False, "error": None},
+            {"telegram_id": "channel-b", "offset_id": 0, "messages": 0, "chunks": 0, "done": False, "error": None},
+        ],
+        "status": "running",
+        "takeout": False,
+        "created_at": 0.0,
+        "finished_at": None,
+        "error": None,
+    }))
+
+    manager = ExportManager(str(tmp_path), chunk_size=4, concurrency=1, use_takeout=False)
+    manager.load()
+    job = manager.get("job-1")
+    assert job.status == "interrupted"
+
+    manager.resume(user_id, SimpleNamespace())
+    await manager._tasks["job-1"]
+
+    assert history == [("channel-a", 7), ("channel-b", 0)]
+    assert job.status == "done"
+    assert [(channel.messages, channel.chunks) for channel in job.channels] == [(10, 3), (10, 3)]
+    # The first chunk of channel-a is not written again, the next ones follow it
+    assert not (job_dir / "channel-a-00000.ndjson.gz").exists()
+    lines = gzip.decompress((job_dir / "channel-a-00001.ndjson.gz").read_bytes()).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [6, 5, 4, 3]
+    assert json.loads((job_dir / "job.json").read_text())["status"] == "done"
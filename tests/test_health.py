@@ -0,0 +1,119 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app.services import health
+from app.services.health import HEALTHY, RECONNECTING, HealthMonitor
+from app.services.scheduler import Priority, TelegramScheduler, _ClientState
+
+
+class FakeClient:
+    def __init__(self, answer_after: float = 0.0):
+        self.answer_after = answer_after
+        self.pings = 0
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def __call__(self, request):
+        self.pings += 1
+        await asyncio.sleep(self.answer_after)
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = TelegramScheduler(global_rate=5, global_burst=1, client_rate=1000, client_burst=1000, max_flood_wait=1)
+    monkeypatch.setattr(health, "scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture
+async def monitor():
+    monitor = HealthMonitor(
+        interval=60, ping_timeout=0.05, base_delay=10, max_delay=10, max_attempts=1, evict_revoked=False,
+    )
+    yield monitor
+    await monitor.stop()
+
+
+async def test_rate_limit_wait_does_not_count_against_the_ping_timeout(scheduler, monitor):
+    client = FakeClient()
+    # The client's bucket is drained, so the ping waits about 0.4 seconds for a token
+    state = scheduler._clients[client] = _ClientState(rate=5, capacity=1)
+    state.bucket.reserve()
+    state.bucket.reserve()
+
+    assert await monitor.check(uuid.uuid4(), client) == HEALTHY
+    assert client.pings == 1
+    await scheduler.stop()
+
+
+async def test_unanswered_ping_starts_a_reconnect(scheduler, monitor):
+    client = FakeClient(answer_after=1)
+
+    assert await monitor.check(uuid.uuid4(), client) == RECONNECTING
+    await scheduler.stop()
+
+
+async def test_flood_waiting_client_is_alive(scheduler, monitor):
+    client = FakeClient(answer_after=1)
+    state = scheduler._clients[client] = _ClientState(rate=1000, capacity=1000)
+    state.flood_until = time.monotonic() + 30
+
+    assert await monitor.check(uuid.uuid4(), client) == HEALTHY
+    assert client.pings == 0
+
+
+async def test_pings_do_not_delay_other_scheduled_calls(scheduler, monitor):
+    clients = [FakeClient() for _ in range(20)]
+    await asyncio.gather(*(monitor.check(uuid.uuid4(), client) for client in clients))
+
+    async def method():
+        return "done"
+
+    # The global bucket allows one call at once and 5 per second, the pings haven't taken from it
+    started = time.monotonic()
+    assert await scheduler.call(FakeClient(), method, priority=Priority.BACKGROUND) == "done"
+    assert time.monotonic() - started < 0.1
+    assert all(client.pings == 1 for client in clients)
+    await scheduler.stop()
+
+
+async def test_client_with_recent_traffic_is_not_pinged(scheduler, monitor):
+    client = FakeClient()
+    await scheduler.call(client, client, object())
+    assert client.pings == 1
+
+    assert await monitor.check(uuid.uuid4(), client) == HEALTHY
+    assert client.pings == 1
+    await scheduler.stop()
+
+
+async def test_walk_does_not_wait_for_slow_pings(scheduler, monkeypatch):
+    clients = {uuid.uuid4(): FakeClient(answer_after=0.2) for _ in range(10)}
+
+    class Storage:
+        def active_clients(self):
+            return list(clients.items())
+
+        def get_active_client(self, user_id, **kwargs):
+            return clients.get(user_id)
+
+    monkeypatch.setattr(health, "storage", Storage())
+    monitor = HealthMonitor(
+        interval=0.1, ping_timeout=1, base_delay=10, max_delay=10, max_attempts=1, evict_revoked=False,
+    )
+    monitor.start()
+    # Pinged one after another, the walk would take two seconds
+    await asyncio.sleep(0.15)
+    await monitor.stop()
+
+    assert all(client.pings == 1 for client in clients.values())
@@ -0,0 +1,72 @@
+import sqlite3
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.v1.index import search_index
+from app.services.index import MAX_WRITE_ATTEMPTS, MessageIndex
+
+
+def message(message_id: int, text: str) -> SimpleNamespace:
+    return SimpleNamespace(id=message_id, message=text, date=datetime(2024, 5, 1, tzinfo=timezone.utc))
+
+
+@pytest.fixture
+def message_index(tmp_path):
+    return MessageIndex(str(tmp_path / "index.sqlite3"), batch_size=100, flush_interval=60)
+
+
+async def test_index_is_opened_on_first_use(tmp_path, message_index):
+    assert not (tmp_path / "index.sqlite3").exists()
+    user_id = uuid.uuid4()
+    message_index.add(user_id, "channel", [message(1, "Python developer wanted")])
+    await message_index.flush()
+
+    results = await message_index.search(user_id, "python")
+    assert [result["id"] for result in results] == [1]
+    await message_index.stop()
+
+
+async def test_failed_write_is_retried_then_dropped(message_index, monkeypatch):
+    user_id = uuid.uuid4()
+    message_index.add(user_id, "channel", [message(1, "First")])
+
+    broken = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+    monkeypatch.setattr(message_index, "_connection", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        await message_index.flush()
+    assert message_index.pending == 1
+
+    # The rows of the failed write go out with the next batch
+    monkeypatch.setattr(message_index, "_connection", None)
+    message_index.add(user_id, "channel", [message(2, "Second")])
+    await message_index.flush()
+    assert message_index.pending == 0
+    assert len(await message_index.search(user_id, "first")) == 1
+    assert len(await message_index.search(user_id, "second")) == 1
+
+    message_index.add(user_id, "channel", [message(3, "Third")])
+    monkeypatch.setattr(message_index, "_connection", broken)
+    for _ in range(MAX_WRITE_ATTEMPTS):
+        with pytest.raises(sqlite3.OperationalError):
+            await message_index.flush()
+    assert message_index.pending == 0
+    assert (message_index.write_failures, message_index.dropped) == (MAX_WRITE_ATTEMPTS + 1, 1)
+
+
+async def test_query_without_words_matches_nothing(message_index):
+    user_id = uuid.uuid4()
+    message_index.add(user_id, "channel", [message(1, "Python developer wanted")])
+    await message_index.flush()
+
+    assert await message_index.search(user_id, " \t") == []
+    await message_index.stop()
+
+
+async def test_search_endpoint_rejects_a_query_without_words():
+    with pytest.raises(HTTPException) as raised:
+        await search_index(uuid.uuid4(), q=" ")
+    assert raised.value.status_code == 400
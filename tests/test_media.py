@@ -0,0 +1,53 @@
+from app.services import media
+from app.services.media import MediaCache, MediaFile
+
+
+class FakeDownload:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    def __init__(self, data: bytes, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.download = None
+
+    def iter_download(self, location, offset, limit, request_size, file_size):
+        chunks = [self.data[at:at + request_size] for at in range(offset, file_size, request_size)][:limit]
+        self.download = FakeDownload(chunks)
+        return self.download
+
+
+async def test_download_is_trimmed_to_the_range_and_scheduled_per_chunk(tmp_path, monkeypatch):
+    calls = []
+
+    async def call(client, method, *args, **kwargs):
+        calls.append(method.__name__)
+        return await method(*args, **kwargs)
+
+    monkeypatch.setattr(media.scheduler, "call", call)
+    data = bytes(range(100))
+    client = FakeClient(data, chunk_size=16)
+    cache = MediaCache(str(tmp_path), max_bytes=1000, chunk_size=16)
+    file = MediaFile("document-1", len(data), "application/octet-stream", None, None)
+
+    received = b"".join([chunk async for chunk in cache.stream(client, file, 20, 50)])
+
+    assert received == data[20:51]
+    # Chunks at 16, 32 and 48; the download stops once the range is covered
+    assert calls == ["download_chunk"] * 3
+    assert client.download.closed
@@ -0,0 +1,37 @@
+import pytest
+
+from app.metrics import Counter, Gauge, Histogram, Metric, MetricsRegistry
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("metric", "Documentation.")
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter("requests_total", "Requests.", ("route",)))
+    clients = registry.register(Gauge("clients", "Clients."))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+
+    requests.inc('/a"b')
+    requests.inc('/a"b', value=2)
+    clients.set_function(lambda: {(): 3})
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b"} 3',
+        "# HELP clients Clients.",
+        "# TYPE clients gauge",
+        "clients 3",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
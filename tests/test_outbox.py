@@ -0,0 +1,133 @@
+import asyncio
+import uuid
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from app.models import OutboundMessage
+from app.services import outbox as outbox_module
+from app.services.outbox import CAPTION_LIMIT, Outbox
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, peer, text):
+        self.sent.append((peer, text))
+        return SimpleNamespace(id=len(self.sent))
+
+
+class FakeStorage:
+    def __init__(self):
+        self.clients = {}
+
+    async def acquire_active_client(self, user_id):
+        return self.clients.setdefault(user_id, FakeClient())
+
+    @contextmanager
+    def lease(self, user_id):
+        yield
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    async def call(client, method, *args, priority=None, **kwargs):
+        return await method(*args, **kwargs)
+
+    storage = FakeStorage()
+    monkeypatch.setattr(outbox_module, "storage", storage)
+    monkeypatch.setattr(outbox_module.scheduler, "call", call)
+    return storage
+
+
+@pytest.fixture
+def outbox():
+    return Outbox(rate=100, burst=10, peer_interval=0, queue_limit=10, job_ttl=60, max_flood_wait=1)
+
+
+async def finished(outbox: Outbox) -> None:
+    while any(account.worker is not None for account in outbox._accounts.values()):
+        await asyncio.sleep(0.01)
+
+
+async def test_texts_to_the_same_peer_are_coalesced(outbox, storage):
+    user_id = uuid.uuid4()
+    jobs = outbox.submit([
+        OutboundMessage(user_id=user_id, peer="me", text="first"),
+        OutboundMessage(user_id=user_id, peer="me", text="second"),
+        OutboundMessage(user_id=user_id, peer="me", text="alone", coalesce=False),
+    ])
+    await asyncio.wait_for(finished(outbox), 1)
+
+    assert storage.clients[user_id].sent == [("me", "first\n\nsecond"), ("me", "alone")]
+    assert [job.status for job in jobs] == ["sent"] * 3
+    assert [job.coalesced_with for job in jobs] == [None, jobs[0].id, None]
+    assert [job.message_id for job in jobs] == [1, 1, 2]
+    assert outbox.stats()["coalesced"] == 1
+
+
+async def test_resubmitted_job_is_not_sent_again(outbox, storage):
+    user_id = uuid.uuid4()
+    message = OutboundMessage(id="job-1", user_id=user_id, peer="me", text="hello")
+
+    first = outbox.submit([message])
+    await asyncio.wait_for(finished(outbox), 1)
+    again = outbox.submit([message])
+    await asyncio.wait_for(finished(outbox), 1)
+
+    assert again[0] is first[0]
+    assert storage.clients[user_id].sent == [("me", "hello")]
+    assert outbox.get(user_id, "job-1") is first[0]
+    assert outbox.get(uuid.uuid4(), "job-1") is None
+
+
+async def test_job_id_of_another_account_is_a_conflict(outbox, storage):
+    outbox.submit([OutboundMessage(id="job-1", user_id=uuid.uuid4(), peer="me", text="hello")])
+
+    other = uuid.uuid4()
+    with pytest.raises(ValueError):
+        outbox.submit([
+            OutboundMessage(id="job-2", user_id=other, peer="me", text="queued"),
+            OutboundMessage(id="job-1", user_id=other, peer="me", text="conflict"),
+        ])
+    assert outbox.get(other, "job-2") is None
+    await asyncio.wait_for(finished(outbox), 1)
+
+
+async def test_finished_jobs_are_pruned_behind_an_unfinished_one(outbox, storage, monkeypatch):
+    waiting, other = uuid.uuid4(), uuid.uuid4()
+    released = asyncio.Event()
+    acquire = storage.acquire_active_client
+
+    async def acquire_active_client(user_id):
+        if user_id == waiting:
+            await released.wait()  # Like a long FloodWait of the account
+        return await acquire(user_id)
+
+    monkeypatch.setattr(storage, "acquire_active_client", acquire_active_client)
+    stuck = outbox.submit([OutboundMessage(user_id=waiting, peer="me", text="stuck")])[0]
+    done = outbox.submit([OutboundMessage(user_id=other, peer="me", text="done")])[0]
+    while done.status != "sent":
+        await asyncio.sleep(0.01)
+
+    outbox._finished[done.id] = done.finished_at = done.finished_at - 120
+    outbox.submit([OutboundMessage(user_id=other, peer="me", text="next")])
+
+    assert outbox.get(other, done.id) is None
+    assert outbox.get(waiting, stuck.id) is stuck
+    released.set()
+    await asyncio.wait_for(finished(outbox), 1)
+
+
+async def test_media_with_a_long_caption_is_rejected(outbox, storage):
+    user_id = uuid.uuid4()
+    jobs = outbox.submit([
+        OutboundMessage(user_id=user_id, peer="me", text="x" * (CAPTION_LIMIT + 1), file="https://example.com/a.png"),
+        OutboundMessage(user_id=user_id, peer="me", text="x" * (CAPTION_LIMIT + 1)),
+    ])
+    await asyncio.wait_for(finished(outbox), 1)
+
+    assert [job.status for job in jobs] == ["rejected", "sent"]
+    assert str(CAPTION_LIMIT) in jobs[0].error
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from app.services.profiling import LoopMonitor
+
+
+def block_the_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+async def test_watchdog_reports_a_stall_once_with_its_stack():
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    block_the_loop(0.4)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    stats = monitor.stats()
+    assert stats["stalls"] == 1
+    assert stats["last_stall"]["seconds"] >= 0.1
+    assert stats["last_stall"]["stack"].endswith("tests.test_profiling:block_the_loop")
+    assert stats["lag_seconds_max"] >= 0.3
+
+
+async def test_busy_loop_without_stalls_is_not_reported():
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+    monitor.start()
+    for _ in range(10):
+        block_the_loop(0.01)
+        await asyncio.sleep(0.01)
+    await monitor.stop()
+
+    assert monitor.stats()["stalls"] == 0
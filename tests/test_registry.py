@@ -0,0 +1,168 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app import storage as storage_module
+from app.registry import SQLiteClientRegistry
+from app.services.scheduler import TelegramScheduler
+from app.sharding import HashRing
+from app.storage import RegistryClientStorage
+
+
+class FakeSession:
+    def __init__(self, data: str):
+        self.data = data
+
+    def save(self) -> str:
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, data: str = "session"):
+        self.session = FakeSession(data)
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def is_user_authorized(self) -> bool:
+        return self.session.data != "revoked"
+
+
+@pytest.fixture(autouse=True)
+async def fake_telegram(monkeypatch):
+    monkeypatch.setattr(storage_module, "create_client", lambda data, passive=False: FakeClient(data))
+    scheduler = TelegramScheduler(
+        global_rate=1000, global_burst=1000, client_rate=1000, client_burst=1000, max_flood_wait=1,
+    )
+    monkeypatch.setattr(storage_module, "scheduler", scheduler)
+    yield
+    await scheduler.stop()
+
+
+@pytest.fixture
+async def registry():
+    return SQLiteClientRegistry(":memory:")
+
+
+@pytest.fixture
+async def nodes(registry):
+    """
+    Storages of three nodes sharing one registry, their writers are running but the heartbeats are manual.
+    """
+    storages = {
+        node_id: RegistryClientStorage(
+            registry, node_id, None, lease_ttl=60, heartbeat_interval=60, restore_concurrency=4,
+        )
+        for node_id in ("node-a", "node-b", "node-c")
+    }
+    for node in storages.values():
+        node._writer = asyncio.create_task(node._write_forever())
+        await registry.heartbeat(node.node_id, None, ttl=60)
+    yield storages
+    for node in storages.values():
+        await node._cancel(node._writer)
+
+
+async def settle(*storages: RegistryClientStorage) -> None:
+    for node in storages:
+        await node._writes.join()
+        if node._restores:
+            await asyncio.gather(*node._restores)
+        await node._writes.join()
+
+
+async def expire(registry: SQLiteClientRegistry, node_id: str) -> None:
+    await registry.heartbeat(node_id, None, ttl=-1)
+
+
+async def test_expired_lease_orphans_the_active_clients(registry):
+    user_id = uuid.uuid4()
+    await registry.heartbeat("node-a", "http://a", ttl=60)
+    await registry.set_client(user_id, "node-a", "active")
+    await registry.save_session(user_id, "encrypted")
+
+    assert await registry.live_nodes() == ["node-a"]
+    assert (await registry.locate(user_id)).alive
+    assert await registry.orphaned_clients() == []
+
+    await registry.heartbeat("node-a", "http://a", ttl=-1)
+
+    assert await registry.live_nodes() == []
+    location = await registry.locate(user_id)
+    assert (location.node_id, location.address, location.alive) == ("node-a", "http://a", False)
+    assert await registry.orphaned_clients() == [(user_id, "node-a", "encrypted")]
+
+
+async def test_orphan_is_claimed_once(registry):
+    user_id = uuid.uuid4()
+    await registry.set_client(user_id, "node-a", "active")
+
+    claims = await asyncio.gather(
+        registry.claim(user_id, "node-a", "node-b"), registry.claim(user_id, "node-a", "node-c"),
+    )
+
+    assert sorted(claims) == [False, True]
+    winner = "node-b" if claims[0] else "node-c"
+    assert (await registry.locate(user_id)).node_id == winner
+
+
+async def test_prune_deletes_only_unauthorized_clients_of_dead_nodes(registry):
+    dead_unauthorized, dead_active, live_unauthorized = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    await registry.heartbeat("node-b", None, ttl=60)
+    await registry.set_client(dead_unauthorized, "node-a", "unauthorized")
+    await registry.set_client(dead_active, "node-a", "active")
+    await registry.set_client(live_unauthorized, "node-b", "unauthorized")
+
+    assert await registry.prune() == 1
+
+    assert await registry.locate(dead_unauthorized) is None
+    assert await registry.locate(dead_active) is not None
+    assert await registry.locate(live_unauthorized) is not None
+
+
+async def test_clients_of_a_dead_node_are_restored_once_by_the_survivors(registry, nodes):
+    node_a, node_b, node_c = nodes.values()
+    users = {uuid.uuid4(): f"session-{i}" for i in range(20)}
+    unauthorized = uuid.uuid4()
+    for user_id, data in users.items():
+        node_a.add_active_client(user_id, FakeClient(data))
+    node_a.add_unauthorized_client(unauthorized, FakeClient())
+    await settle(node_a)
+
+    await expire(registry, "node-a")
+    # Both survivors walk the orphans at the same time
+    await asyncio.gather(node_b._take_over_orphans(), node_c._take_over_orphans(), node_b._take_over_orphans())
+    await settle(node_b, node_c)
+
+    ring = HashRing(["node-b", "node-c"])
+    restored = {}
+    for node in (node_b, node_c):
+        for user_id, client in node.active_clients():
+            assert user_id not in restored
+            assert ring.node_for(str(user_id)) == node.node_id
+            restored[user_id] = client.session.data
+            assert (await registry.locate(user_id)).node_id == node.node_id
+    assert restored == users
+    assert node_b.stats()["taken_over"] + node_c.stats()["taken_over"] == len(users)
+
+    assert await registry.orphaned_clients() == []
+    assert await registry.locate(unauthorized) is None
+
+
+async def test_revoked_session_is_dropped_instead_of_restored(registry, nodes):
+    node_a, node_b, _ = nodes.values()
+    user_id = uuid.uuid4()
+    node_a.add_active_client(user_id, FakeClient("revoked"))
+    await settle(node_a)
+
+    await expire(registry, "node-a")
+    await registry.remove_node("node-c")
+    await node_b._take_over_orphans()
+    await settle(node_b)
+
+    assert node_b.active_clients() == []
+    assert await registry.locate(user_id) is None
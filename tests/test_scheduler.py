@@ -0,0 +1,65 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.services.scheduler import Priority, TelegramScheduler, TokenBucket
+
+
+class FakeClient:
+    pass
+
+
+def scheduler(global_rate: float = 1000, global_burst: float = 1000) -> TelegramScheduler:
+    return TelegramScheduler(
+        global_rate=global_rate, global_burst=global_burst, client_rate=1000, client_burst=1000, max_flood_wait=1,
+    )
+
+
+def test_token_bucket_serves_the_burst_then_the_rate():
+    with mock.patch("app.services.scheduler.time.monotonic", return_value=100.0) as monotonic:
+        bucket = TokenBucket(rate=2, capacity=3)
+        assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+        # Reservations beyond the burst queue up behind each other
+        assert [bucket.reserve() for _ in range(2)] == [0.5, 1.0]
+
+        monotonic.return_value = 110.0
+        # Refilled up to the capacity only
+        assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+
+
+async def test_interactive_calls_are_dispatched_before_background_ones():
+    telegram = scheduler(global_rate=1000, global_burst=1)
+    order = []
+
+    async def method(name):
+        order.append(name)
+
+    client = FakeClient()
+    calls = [
+        telegram.call(client, method, "background-1", priority=Priority.BACKGROUND),
+        telegram.call(client, method, "background-2", priority=Priority.BACKGROUND),
+        telegram.call(client, method, "interactive", priority=Priority.INTERACTIVE),
+    ]
+    await asyncio.gather(*calls)
+    await telegram.stop()
+
+    assert order == ["interactive", "background-1", "background-2"]
+
+
+async def test_stop_fails_the_queued_calls():
+    telegram = scheduler(global_rate=0.1, global_burst=1)
+
+    async def method():
+        return "done"
+
+    client = FakeClient()
+    first = asyncio.create_task(telegram.call(client, method))
+    queued = [asyncio.create_task(telegram.call(client, method)) for _ in range(2)]
+    assert await first == "done"
+    await asyncio.sleep(0)
+
+    await asyncio.wait_for(telegram.stop(), 1)
+    for task in queued:
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(task, 1)
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.services.search import merge_by_date
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+async def stream(name: str, minutes: list[int], fail: bool = False):
+    # From the newest message, as Telegram returns them
+    for minute in minutes:
+        yield SimpleNamespace(name=name, date=START + timedelta(minutes=minute))
+    if fail:
+        raise ConnectionError("Channel is unavailable.")
+
+
+async def merge(streams, limit: int, errors: dict) -> list[tuple[int, str]]:
+    return [(index, message.date.minute) async for index, message in merge_by_date(streams, limit, errors)]
+
+
+async def test_streams_are_merged_from_the_newest_message():
+    errors = {}
+    streams = [stream("a", [50, 30, 10]), stream("b", [40, 20]), stream("c", [])]
+
+    assert await merge(streams, 10, errors) == [(0, 50), (1, 40), (0, 30), (1, 20), (0, 10)]
+    assert errors == {}
+
+
+async def test_failed_stream_is_skipped_and_reported():
+    errors = {}
+    streams = [stream("a", [50, 10]), stream("b", [40], fail=True)]
+
+    assert await merge(streams, 10, errors) == [(0, 50), (1, 40), (0, 10)]
+    assert errors == {1: "Channel is unavailable."}
+
+
+async def test_early_termination_with_full_queues_does_not_hang():
+    errors = {}
+    # Far more messages than a queue holds, so the producers are blocked on put when the limit is reached
+    streams = [stream(name, list(range(1000, 0, -1))) for name in "ab"]
+
+    results = await asyncio.wait_for(merge(streams, 3, errors), 1)
+
+    assert len(results) == 3
+
+
+async def test_consumer_stopping_early_does_not_hang():
+    streams = [stream(name, list(range(1000, 0, -1))) for name in "ab"]
+    merged = merge_by_date(streams, 1000, {})
+
+    await merged.__anext__()
+    await asyncio.wait_for(merged.aclose(), 1)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from app.services import session
+from app.services.session import SessionUploader
+
+
+@pytest.fixture
+def uploader():
+    return SessionUploader(
+        max_pending=10, batch_size=10, max_retries=2, backoff_base=0.01, backoff_max=0.02, pool_size=1, timeout=1,
+    )
+
+
+async def test_failed_delivery_does_not_kill_the_worker(uploader, monkeypatch):
+    calls = []
+
+    async def send(user_id, data, http_session=None):
+        calls.append(data)
+        if len(calls) == 1:
+            raise json.JSONDecodeError("Expecting value", "", 0)
+        return {}
+
+    monkeypatch.setattr(session, "send_encrypted_session", send)
+    await uploader.enqueue(uuid.uuid4(), "first")
+    await asyncio.wait_for(uploader.flush(), 1)
+    await uploader.enqueue(uuid.uuid4(), "second")
+    await asyncio.wait_for(uploader.flush(), 1)
+    await uploader.stop()
+
+    assert calls == ["first", "first", "second"]
+    assert uploader.sent == 2
+    assert uploader.failed == 0
+
+
+async def test_retries_do_not_hold_up_other_uploads(uploader, monkeypatch):
+    failing, healthy = uuid.uuid4(), uuid.uuid4()
+    delivered = asyncio.Event()
+    attempts = 0
+
+    async def send(user_id, data, http_session=None):
+        nonlocal attempts
+        if user_id == failing:
+            attempts += 1
+            raise RuntimeError("Storage service is down.")
+        delivered.set()
+        return {}
+
+    monkeypatch.setattr(session, "send_encrypted_session", send)
+    uploader._backoff_base = uploader._backoff_max = 0.5
+    await uploader.enqueue(failing, "failing")
+    await asyncio.sleep(0.05)
+    await uploader.enqueue(healthy, "healthy")
+    await asyncio.wait_for(delivered.wait(), 0.2)
+    assert attempts == 1
+
+    uploader._backoff_base = uploader._backoff_max = 0.01
+    await asyncio.wait_for(uploader.flush(), 2)
+    await uploader.stop()
+    assert attempts == 3
+    assert (uploader.sent, uploader.failed) == (1, 1)
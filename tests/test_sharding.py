@@ -0,0 +1,185 @@
+import json
+import uuid
+from collections import Counter
+
+import pytest
+
+from app.sharding import FORWARDED_HEADER, HashRing, ShardRouter, forwarded_token
+
+NODES = ["http://node-a", "http://node-b", "http://node-c"]
+SECRET = "shared-secret"
+
+
+def test_hash_ring_spreads_keys_evenly():
+    ring = HashRing(NODES)
+    owners = Counter(ring.node_for(uuid.uuid4()) for _ in range(3000))
+
+    assert set(owners) == set(NODES)
+    assert min(owners.values()) > 700
+
+
+def test_hash_ring_moves_only_the_keys_of_a_removed_node():
+    keys = [str(uuid.uuid4()) for _ in range(1000)]
+    before = HashRing(NODES)
+    after = HashRing(NODES[:2])
+
+    for key in keys:
+        if before.node_for(key) != NODES[2]:
+            assert after.node_for(key) == before.node_for(key)
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_any(self):
+        yield self.body
+
+
+class FakeResponse:
+    def __init__(self, status: int, content: dict):
+        self.status = status
+        self.body = json.dumps(content).encode()
+        self.raw_headers = [(b"content-type", b"application/json")]
+        self.content = FakeContent(self.body)
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+        self.headers = []
+
+    def request(self, method, url, headers, json=None, data=None):
+        node = url.split("/api")[0]
+        self.requests.append((node, json if data is None else data))
+        self.headers.append(headers)
+        return FakeResponse(*self.answer(node, json))
+
+
+async def call(router: ShardRouter, path: str, payload, headers=()) -> tuple[int, dict]:
+    body = json.dumps(payload).encode()
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"", "headers": list(headers)}
+    await router(scope, receive, send)
+    return sent[0]["status"], json.loads(b"".join(message.get("body", b"") for message in sent[1:]))
+
+
+def users_on_different_nodes(ring: HashRing) -> tuple[str, str]:
+    users = {}
+    while len(users) < 2:
+        user_id = str(uuid.uuid4())
+        users.setdefault(ring.node_for(user_id), user_id)
+    return tuple(users.values())
+
+
+@pytest.fixture
+def router():
+    return ShardRouter(None, NODES, secret=SECRET)
+
+
+async def test_batch_is_split_by_owner_and_keeps_the_status(router):
+    first, second = users_on_different_nodes(router.ring)
+
+    def answer(node, part):
+        return 202, {"status_code": 202, "message": "Messages have been queued.", "data": {
+            item["id"]: {"status": "queued"} for item in part
+        }}
+
+    router._http = FakeSession(answer)
+    messages = [{"user_id": first, "peer": "me", "text": "a"}, {"user_id": second, "peer": "me", "text": "b"}]
+    status, content = await call(router, "/api/v1/messages/batch", messages)
+
+    assert status == 202
+    assert len(router._http.requests) == 2
+    for node, part in router._http.requests:
+        assert [router.ring.node_for(item["user_id"]) for item in part] == [node]
+    assert content["status_code"] == 202
+    assert len(content["data"]) == 2
+
+
+async def test_failed_part_reports_every_job_of_it(router):
+    user_id, other = users_on_different_nodes(router.ring)
+    failing = router.ring.node_for(user_id)
+
+    def answer(node, part):
+        if node == failing:
+            return 503, {"detail": "Outbox is unavailable."}
+        data = {item["id"]: {"status": "queued"} for item in part}
+        return 202, {"message": "Messages have been queued.", "data": data}
+
+    router._http = FakeSession(answer)
+    messages = [
+        {"id": "job-1", "user_id": user_id, "peer": "me", "text": "a"},
+        {"id": "job-2", "user_id": user_id, "peer": "me", "text": "b"},
+        {"id": "job-3", "user_id": other, "peer": "me", "text": "c"},
+    ]
+    status, content = await call(router, "/api/v1/messages/batch", messages)
+
+    assert status == 202
+    assert content["data"]["job-1"] == {"status": "failed", "status_code": 503, "error": "Outbox is unavailable."}
+    assert content["data"]["job-2"]["status"] == "failed"
+    assert content["data"]["job-3"] == {"status": "queued"}
+
+
+async def test_list_body_of_other_routes_is_not_split(router):
+    first, second = users_on_different_nodes(router.ring)
+    router._http = FakeSession(lambda node, part: (200, {"data": {}}))
+    status, _ = await call(router, "/api/v1/other", [{"user_id": first}, {"user_id": second}])
+
+    assert status == 200
+    assert router._http.requests == [(NODES[0], json.dumps([{"user_id": first}, {"user_id": second}]).encode())]
+
+
+async def test_front_router_rejects_forwarded_requests(router):
+    headers = [(FORWARDED_HEADER, forwarded_token(SECRET))]
+    status, content = await call(router, "/api/v1/connect", {}, headers=headers)
+
+    assert status == 421
+
+
+async def test_forged_forwarded_header_is_stripped_and_routed(router):
+    user_id = str(uuid.uuid4())
+    router._http = FakeSession(lambda node, part: (200, {"data": {}}))
+    status, _ = await call(router, "/api/v1/connect", {"user_id": user_id}, headers=[(FORWARDED_HEADER, b"1")])
+
+    assert status == 200
+    assert [node for node, _ in router._http.requests] == [router.ring.node_for(user_id)]
+    assert [value for name, value in router._http.headers[0] if name == FORWARDED_HEADER.decode()] == [
+        forwarded_token(SECRET).decode()
+    ]
+
+
+async def test_worker_trusts_only_signed_forwarded_requests():
+    handled = []
+
+    async def app(scope, receive, send):
+        handled.append(scope["headers"])
+        await ShardRouter._send_json(send, 200, {"data": {}})
+
+    worker = ShardRouter(app, NODES, own_node=NODES[0], secret=SECRET)
+    worker._http = FakeSession(lambda node, part: (200, {"data": {}}))
+    user_id = next(str(key) for key in iter(uuid.uuid4, None) if worker.ring.node_for(str(key)) != NODES[0])
+
+    await call(worker, "/api/v1/connect", {"user_id": user_id}, headers=[(FORWARDED_HEADER, b"1")])
+    assert handled == []
+    assert [node for node, _ in worker._http.requests] == [worker.ring.node_for(user_id)]
+
+    await call(worker, "/api/v1/connect", {"user_id": user_id}, headers=[(FORWARDED_HEADER, forwarded_token(SECRET))])
+    assert handled == [[]]
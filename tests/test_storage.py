@@ -0,0 +1,254 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from app import storage as storage_module
+from app.storage import InMemoryClientStorage
+
+
+class FakeSession:
+    def __init__(self, data: str):
+        self.data = data
+
+    def save(self) -> str:
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, data: str = "session", connected: asyncio.Event | None = None):
+        self.session = FakeSession(data)
+        self.connected = connected
+        self.connecting = False
+        self.disconnected = False
+
+    async def connect(self) -> None:
+        self.connecting = True
+        if self.connected is not None:
+            await self.connected.wait()
+
+    async def disconnect(self) -> None:
+        self.disconnected = True
+
+
+@pytest.fixture(autouse=True)
+def no_checkpoints(monkeypatch):
+    async def checkpoint(user_id, client, force=False):
+        return False
+
+    monkeypatch.setattr(storage_module.checkpointer, "checkpoint", checkpoint)
+
+
+@pytest.fixture
+def storage():
+    return InMemoryClientStorage(passive_suspend_after=60)
+
+
+def make_idle(storage: InMemoryClientStorage, user_id: uuid.UUID) -> None:
+    storage._last_used[user_id] = time.monotonic() - 120
+
+
+async def test_idle_passive_client_is_suspended_and_resumed(storage, monkeypatch):
+    user_id = uuid.uuid4()
+    client = FakeClient("saved-session")
+    storage.add_active_client(user_id, client, passive=True)
+    make_idle(storage, user_id)
+
+    await storage.sweep()
+
+    assert storage.is_suspended(user_id)
+    assert client.disconnected
+    assert storage.get_active_client(user_id, raise_exc=False) is None
+
+    created = []
+    monkeypatch.setattr(
+        storage_module, "create_client", lambda data, passive: created.append((data, passive)) or FakeClient(data),
+    )
+    resumed = await storage.acquire_active_client(user_id)
+
+    assert created == [("saved-session", True)]
+    assert not storage.is_suspended(user_id)
+    assert storage.get_active_client(user_id) is resumed
+    assert storage.stats()["suspensions"]["resumed"] == 1
+
+
+async def test_full_client_is_not_suspended(storage):
+    user_id = uuid.uuid4()
+    storage.add_active_client(user_id, FakeClient(), passive=False)
+    make_idle(storage, user_id)
+
+    await storage.sweep()
+
+    assert not storage.is_suspended(user_id)
+
+
+async def test_leased_client_is_not_suspended(storage):
+    user_id = uuid.uuid4()
+    client = FakeClient()
+    storage.add_active_client(user_id, client, passive=True)
+
+    with storage.lease(user_id):
+        with storage.lease(user_id):
+            make_idle(storage, user_id)
+            await storage.sweep()
+        await storage.sweep()
+        assert not storage.is_suspended(user_id)
+        assert storage.stats()["leased"] == 1
+
+    # Releasing the last lease counts as a use
+    await storage.sweep()
+    assert storage.get_active_client(user_id, raise_exc=False) is client
+    assert storage.stats()["leased"] == 0
+
+
+async def test_resume_returns_the_client_of_a_reconnected_user(storage, monkeypatch):
+    user_id = uuid.uuid4()
+    storage.add_active_client(user_id, FakeClient(), passive=True)
+    make_idle(storage, user_id)
+    await storage.sweep()
+
+    connected = asyncio.Event()
+    resuming = FakeClient(connected=connected)
+    monkeypatch.setattr(storage_module, "create_client", lambda data, passive: resuming)
+    acquired = asyncio.create_task(storage.acquire_active_client(user_id))
+    while not resuming.connecting:
+        await asyncio.sleep(0)
+
+    # The user connects again while the suspended client is being reconnected
+    reconnected = FakeClient("new-session")
+    storage.add_active_client(user_id, reconnected, passive=False)
+    connected.set()
+
+    assert await acquired is reconnected
+    assert resuming.disconnected
+    assert storage.get_active_client(user_id) is reconnected
+
+
+async def test_resume_after_the_user_reconnected_returns_the_new_client(storage):
+    user_id = uuid.uuid4()
+    reconnected = FakeClient()
+    storage.add_active_client(user_id, reconnected)
+
+    assert await storage._resume(user_id) is reconnected
+    with pytest.raises(KeyError):
+        await storage._resume(uuid.uuid4())
+
+
+async def test_unauthorized_client_expires_after_its_ttl():
+    storage = InMemoryClientStorage(unauthorized_ttl=60)
+    expired, fresh = uuid.uuid4(), uuid.uuid4()
+    expired_client = FakeClient()
+    storage.add_unauthorized_client(expired, expired_client)
+    storage.add_unauthorized_client(fresh, FakeClient())
+    storage._created_at[expired] = time.monotonic() - 120
+
+    await storage.sweep()
+
+    assert storage.get_unauthorized_client(expired, raise_exc=False) is None
+    assert storage.get_unauthorized_client(fresh, raise_exc=False) is not None
+    assert expired_client.disconnected
+    assert storage.stats()["evictions"]["unauthorized_expired"] == 1
+
+
+async def test_idle_active_client_is_evicted():
+    storage = InMemoryClientStorage(active_idle_timeout=60)
+    idle, recent = uuid.uuid4(), uuid.uuid4()
+    idle_client = FakeClient()
+    storage.add_active_client(idle, idle_client)
+    storage.add_active_client(recent, FakeClient())
+    make_idle(storage, idle)
+
+    await storage.sweep()
+
+    assert storage.get_active_client(idle, raise_exc=False) is None
+    assert storage.get_active_client(recent, raise_exc=False) is not None
+    assert idle_client.disconnected
+    assert storage.stats()["evictions"]["active_idle"] == 1
+
+
+async def test_least_recently_used_client_is_evicted_over_the_limit():
+    storage = InMemoryClientStorage(active_limit=2)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    storage.add_active_client(first, FakeClient())
+    storage.add_active_client(second, FakeClient())
+    storage.get_active_client(first)
+
+    storage.add_active_client(third, FakeClient())
+    await storage.stop()
+
+    assert [user_id for user_id, _ in storage.active_clients()] == [first, third]
+    assert storage.stats()["evictions"]["active_over_limit"] == 1
+
+
+async def test_leased_client_is_never_evicted():
+    storage = InMemoryClientStorage(active_limit=1, active_idle_timeout=60)
+    leased, other = uuid.uuid4(), uuid.uuid4()
+    storage.add_active_client(leased, FakeClient())
+
+    with storage.lease(leased):
+        make_idle(storage, leased)
+        await storage.sweep()
+        assert storage.get_active_client(leased, raise_exc=False, touch=False) is not None
+
+        # Over the limit, the unleased client goes first, even though it is the most recent one
+        storage.add_active_client(other, FakeClient())
+        assert [user_id for user_id, _ in storage.active_clients()] == [leased]
+
+        # Only leased clients are left, so the limit is exceeded until a lease is released
+        with storage.lease(other):
+            storage.add_active_client(other, FakeClient())
+            assert len(storage.active_clients()) == 2
+        assert [user_id for user_id, _ in storage.active_clients()] == [leased]
+
+    await storage.stop()
+
+
+async def test_shutdown_checkpoints_active_clients_and_bounds_the_disconnects(monkeypatch):
+    storage = InMemoryClientStorage()
+    disconnecting, most = 0, 0
+
+    class SlowClient(FakeClient):
+        async def disconnect(self) -> None:
+            nonlocal disconnecting, most
+            disconnecting += 1
+            most = max(most, disconnecting)
+            await asyncio.sleep(0.01)
+            disconnecting -= 1
+            self.disconnected = True
+
+    checkpointed = []
+
+    async def checkpoint_many(clients, force=False):
+        checkpointed.extend(user_id for user_id, _ in clients)
+        return len(clients)
+
+    monkeypatch.setattr(storage_module.checkpointer, "checkpoint_many", checkpoint_many)
+    active = {uuid.uuid4(): SlowClient() for _ in range(5)}
+    for user_id, client in active.items():
+        storage.add_active_client(user_id, client)
+    unauthorized = SlowClient()
+    storage.add_unauthorized_client(uuid.uuid4(), unauthorized)
+
+    await storage.shutdown(concurrency=2, timeout=1)
+
+    assert checkpointed == list(active)
+    assert most == 2
+    assert all(client.disconnected for client in [*active.values(), unauthorized])
+    assert storage.stats()["active"] == storage.stats()["unauthorized"] == 0
+
+
+async def test_shutdown_gives_up_after_the_timeout(monkeypatch):
+    storage = InMemoryClientStorage()
+
+    class StuckClient(FakeClient):
+        async def disconnect(self) -> None:
+            await asyncio.sleep(10)
+
+    async def checkpoint_many(clients, force=False):
+        return len(clients)
+
+    monkeypatch.setattr(storage_module.checkpointer, "checkpoint_many", checkpoint_many)
+    storage.add_active_client(uuid.uuid4(), StuckClient())
+
+    await asyncio.wait_for(storage.shutdown(concurrency=2, timeout=0.05), 1)
@@ -0,0 +1,17 @@
+import uuid
+
+from app.services.sync import HighWaterMarkStore
+
+
+async def test_store_is_opened_on_first_use(tmp_path):
+    path = tmp_path / "sync_state.sqlite3"
+    store = HighWaterMarkStore(str(path))
+    assert not path.exists()
+
+    user_id = uuid.uuid4()
+    await store.set(user_id, "channel", 42, 7)
+    assert path.exists()
+    assert await store.get(user_id) == {"channel": (42, 7)}
+
+    store.close()
+    assert await HighWaterMarkStore(str(path)).get(user_id) == {"channel": (42, 7)}
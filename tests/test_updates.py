@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+
+from app.services.updates import WebhookSender
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, block: bool):
+        self.block = block
+
+    async def __aenter__(self):
+        if self.block:
+            await asyncio.Event().wait()  # Never answers
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeHTTPSession:
+    def __init__(self, block: bool = False):
+        self.block = block
+        self.batches = []
+
+    def post(self, url, json):
+        self.batches.append(json)
+        return FakeResponse(self.block)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def sender(tmp_path):
+    return WebhookSender(
+        url="http://main/new_messages", max_queued=10, batch_size=2, flush_interval=0.01,
+        overflow_policy="spill", spill_path=str(tmp_path / "spill.jsonl"), max_retries=0, timeout=1,
+    )
+
+
+async def test_batch_in_flight_on_stop_is_spilled(sender, tmp_path):
+    await sender.start()
+    await sender._http_session.close()
+    sender._http_session = FakeHTTPSession(block=True)
+    sender.put({"id": 1})
+    sender.put({"id": 2})
+    await asyncio.sleep(0.05)
+    assert sender._http_session.batches == [[{"id": 1}, {"id": 2}]]
+
+    await sender.stop(timeout=0.05)
+
+    lines = (tmp_path / "spill.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": 1}, {"id": 2}]
+
+
+async def test_replay_sends_a_leftover_replay_file_first(sender, tmp_path):
+    (tmp_path / "spill.jsonl.replay").write_text(json.dumps({"id": 1}) + "\n")
+    (tmp_path / "spill.jsonl").write_text(json.dumps({"id": 2}) + "\n")
+    sender._http_session = FakeHTTPSession()
+
+    await sender._replay_spill()
+    assert sender._http_session.batches == [[{"id": 1}]]
+    assert not (tmp_path / "spill.jsonl.replay").exists()
+
+    await sender._replay_spill()
+    assert sender._http_session.batches == [[{"id": 1}], [{"id": 2}]]
+    assert not (tmp_path / "spill.jsonl").exists()
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.utils import SingleFlight, as_utc
+
+
+def test_as_utc_treats_naive_datetimes_as_utc():
+    assert as_utc(datetime(2024, 5, 1, 12)) == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    aware = datetime(2024, 5, 1, 12, tzinfo=timezone(timedelta(hours=3)))
+    assert as_utc(aware) is aware
+    assert as_utc(None) is None
+
+
+async def test_single_flight_shares_one_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    assert await asyncio.gather(*(flights.run("key", call) for _ in range(3))) == [1, 1, 1]
+    assert not flights.in_flight("key")
+    # A finished call is not shared with the later ones
+    assert await flights.run("key", call) == 2
+
+
+async def test_single_flight_passes_the_error_to_every_caller():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(*(flights.run("key", call) for _ in range(2)), return_exceptions=True)
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert results[0] is results[1]
+
+
+async def test_single_flight_survives_a_cancelled_caller():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    first = asyncio.create_task(flights.run("key", call))
+    second = asyncio.create_task(flights.run("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"